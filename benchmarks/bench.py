@@ -0,0 +1,356 @@
+"""
+Time the collection and render paths against synthetic hosts (see synthetic.py) of
+increasing size, and catch regressions against an earlier run.
+
+    python benchmarks/bench.py --save before.json
+    ... change things ...
+    python benchmarks/bench.py --compare before.json
+
+Also measures the memory a host of about 50,000 entities takes, laid out as a table.
+
+Exits 1 if any phase got slower than --threshold times the baseline, if its cost per
+entity grows more than --scaling times between the two largest hosts, if the host or table
+takes more than --threshold times the baseline's memory, if walking sysfs makes more calls
+into the filesystem than it did, or if a whole `lsblkpro` run against a small host, started
+in a fresh interpreter, takes longer than --startup-budget.
+"""
+
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import io
+import os
+import sys
+import gc
+import json
+import time
+import platform
+import tempfile
+import subprocess
+import argparse
+import collections
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import synthetic
+from lsblkpro import data
+from lsblkpro import fleet
+from lsblkpro import lsblkpro
+from lsblkpro import pager
+from lsblkpro import snapshot
+
+SIZES = (10, 1000, 10000)
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# what a bare `lsblkpro` imports before it does anything
+STARTUP_MODULE = 'lsblkpro.lsblkpro'
+
+# disks in the host a whole `lsblkpro` run is timed against for --startup-budget: few, so
+# that it's mostly starting up (imports, formatters, ...) that's measured
+STARTUP_DISKS = 10
+
+# --fleet is only timed for sizes where this many disks or fewer make up the whole fleet
+FLEET_DISKS = 50000
+
+# the screen Pager.frame is timed for
+PAGER_SCREEN = (50, 200)
+
+# what count_fs_calls counts, besides opens: os.path.exists and friends call stat
+FS_CALLS = ('listdir', 'scandir', 'readlink', 'stat', 'lstat')
+
+# disks in the host the memory is measured for: about 50,000 entities, with two partitions
+# (or ZFS's two) on each
+MEMORY_DISKS = 16667
+
+def timed(fn, repeat):
+    """(seconds for each of `repeat` calls of `fn`, the last result)"""
+    times = []
+    result = None
+    for _ in range(repeat):
+        gc.collect()
+        started = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - started)
+    return times, result
+
+def count_fs_calls(fn):
+    """(fn(), how many calls into the filesystem it made). Each of FS_CALLS, or an open in
+    lsblkpro.data, is one system call or a few: listdir and scandir open, read and close a
+    directory, and an open is followed by a read and a close."""
+    counter = collections.Counter()
+
+    def counting(name, real):
+        def call(*args, **kwargs):
+            counter[name] += 1
+            return real(*args, **kwargs)
+        return call
+
+    saved = {name: getattr(os, name) for name in FS_CALLS}
+    real_open = data.open  # (bound in lsblkpro.data by `from builtins import *`)
+    try:
+        for name, real in saved.items():
+            setattr(os, name, counting(name, real))
+        data.open = counting('open', real_open)
+        result = fn()
+    finally:
+        for name, real in saved.items():
+            setattr(os, name, real)
+        data.open = real_open
+    return result, sum(counter.values())
+
+def summary(times):
+    ordered = sorted(times)
+    return {
+        'min': ordered[0],
+        'median': ordered[len(ordered) // 2],
+        'runs': len(ordered),
+    }
+
+def import_time(module, repeat):
+    """best cumulative time to import `module` in a fresh interpreter, per `-X importtime`"""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, (ROOT, env.get('PYTHONPATH'))))
+    best = None
+    for _ in range(repeat):
+        err = subprocess.check_output([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                                      env=env, stderr=subprocess.STDOUT)
+        for line in err.decode('utf-8', 'replace').splitlines():
+            # import time: self [us] | cumulative | imported package
+            fields = line.split('|')
+            if len(fields) == 3 and fields[2].strip() == module:
+                seconds = int(fields[1]) / 1e6
+                best = seconds if best is None else min(best, seconds)
+    return best
+
+def run_time(root, repeat):
+    """best wall-clock time of a whole `lsblkpro` run against the synthetic host at `root`, in a
+    fresh interpreter: startup, collection and the table, sizes and all"""
+    code = ("import sys; sys.path.insert(0, {!r}); import synthetic; synthetic.configure({!r}); "
+            "from lsblkpro import lsblkpro; sys.argv = ['lsblkpro', '--color', 'never']; "
+            "lsblkpro.main()").format(os.path.dirname(os.path.abspath(__file__)), root)
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, (ROOT, env.get('PYTHONPATH'))))
+    best = None
+    with open(os.devnull, 'wb') as devnull:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            subprocess.check_call([sys.executable, '-c', code], env=env, stdout=devnull)
+            seconds = time.perf_counter() - started
+            best = seconds if best is None else min(best, seconds)
+    return best
+
+def args_for(width, collector):
+    # no timeouts: a collector that gives up would make its phase look fast
+    argv = ['--color', 'never', '--collector', collector] + [
+        '--timeout={}=none'.format(source) for source in data.COLLECTOR_TIMEOUTS]
+    if not width:
+        argv.append('-A')
+    args = lsblkpro.parse_args(argv)
+    args.width_limit = width or lsblkpro.INF
+    args.projection = lsblkpro.projection_for(args)
+    return args
+
+def bench_size(root, disks, opts):
+    synthetic.ensure(root, disks=disks, partitions=opts.partitions, md_every=8, dm_every=0,
+                     pools=opts.pools, vdev_width=6, zfs_fraction=0.5)
+    synthetic.configure(root)
+    with open(os.path.join(root, 'params.json')) as f:
+        entities = json.load(f)['entities']
+    repeat = opts.repeat if disks < 10000 else max(1, opts.repeat // 3)
+
+    results = collections.OrderedDict()
+    args = args_for(opts.width, opts.collectors[-1])
+    times, _ = timed(lambda: data.Host.from_sysfs(args), repeat)
+    results['Host.from_sysfs'] = summary(times)
+    _, results['Host.from_sysfs']['fs_calls'] = count_fs_calls(lambda: data.Host.from_sysfs(args))
+
+    for collector in opts.collectors:
+        args = args_for(opts.width, collector)
+        times, host = timed(lambda: data.Host.go(args), repeat)
+        results['Host.go[{}]'.format(collector)] = summary(times)
+
+    times, table = timed(lambda: lsblkpro.Table(host, args), repeat)
+    results['Table.__init__'] = summary(times)
+
+    times, _ = timed(lambda: table.print_(out=io.StringIO()), repeat)
+    results['Table.print_'] = summary(times)
+
+    # one screenful from the middle of every column, which should cost the same at any size:
+    # counted as one entity, so --scaling compares the time per frame
+    browser = pager.Pager(host, args_for(0, opts.collectors[-1]))
+    browser.top = len(browser.visible) // 2
+    times, _ = timed(lambda: browser.frame(*PAGER_SCREEN), repeat)
+    results['Pager.frame'] = summary(times)
+    results['Pager.frame']['entities'] = 1
+
+    with open(os.path.join(root, 'zpool-status.out'), 'rb') as f:
+        status = f.read()
+    times, _ = timed(lambda: data.parse_zpool_status(status), repeat)
+    results['parse_zpool_status'] = summary(times)
+
+    if opts.fleet_hosts and disks * opts.fleet_hosts <= FLEET_DISKS:
+        # the same host's snapshot under different names
+        directory = os.path.join(root, 'fleet-{}'.format(opts.fleet_hosts))
+        if not os.path.isdir(directory):
+            os.mkdir(directory)
+            for ii in range(opts.fleet_hosts):
+                snapshot.store(os.path.join(directory, 'host{}'.format(ii)), host, hostname='host{}'.format(ii))
+        times, hosts = timed(lambda: fleet.load(directory), repeat)
+        results['fleet.load'] = summary(times)
+        times, _ = timed(lambda: lsblkpro.Table(hosts, args), repeat)
+        results['Table.__init__[fleet]'] = summary(times)
+        for phase in ('fleet.load', 'Table.__init__[fleet]'):
+            results[phase]['entities'] = entities * opts.fleet_hosts
+
+    return entities, results
+
+def bench_memory(root, disks, opts):
+    """bytes the Host for `disks` disks and the Table laid out from it (every column) hold,
+    and how long a full garbage collection takes with them alive"""
+    import tracemalloc
+
+    synthetic.ensure(root, disks=disks, partitions=opts.partitions, md_every=8, dm_every=0,
+                     pools=opts.pools, vdev_width=6, zfs_fraction=0.5)
+    synthetic.configure(root)
+    args = args_for(0, opts.collectors[-1])
+    gc.collect()
+    tracemalloc.start()
+    try:
+        host = data.Host.go(args)
+        gc.collect()
+        host_bytes = tracemalloc.get_traced_memory()[0]
+        table = lsblkpro.Table(host, args)
+        gc.collect()
+        total, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    times, _ = timed(gc.collect, opts.repeat)
+    return collections.OrderedDict([
+        ('entities', len(host.devices) + len(host.partitions)),
+        ('rows', len(table.rows)),
+        ('host_bytes', host_bytes),
+        ('table_bytes', total - host_bytes),
+        ('peak_bytes', peak),
+        ('gc', summary(times)),
+    ])
+
+def scaling_problems(run, factor):
+    """phases whose time per entity grows more than `factor` times between the two largest
+    hosts (the smallest is mostly fixed overhead)"""
+    sizes = sorted(run['results'], key=int)
+    if len(sizes) < 2:
+        return
+    small, large = run['results'][sizes[-2]], run['results'][sizes[-1]]
+    for phase in large:
+        if phase not in small:
+            continue
+        per_small = small[phase]['min'] / small[phase]['entities']
+        per_large = large[phase]['min'] / large[phase]['entities']
+        if per_small > 0 and per_large / per_small > factor:
+            yield "{}: {:.1f}us/entity at {} disks, {:.1f}us/entity at {} disks".format(
+                phase, per_small * 1e6, sizes[-2], per_large * 1e6, sizes[-1])
+
+def regressions(run, baseline, factor):
+    for what, seconds in run['startup'].items():
+        before = baseline.get('startup', {}).get(what)
+        if before and seconds / before > factor:
+            yield "{}: {:.4f}s, was {:.4f}s ({:.2f}x)".format(what, seconds, before, seconds / before)
+    for size, phases in sorted(run['results'].items(), key=lambda kv: int(kv[0])):
+        for phase, result in phases.items():
+            before = baseline['results'].get(size, {}).get(phase)
+            if before and before['median'] > 0 and result['median'] / before['median'] > factor:
+                yield "{} at {} disks: {:.4f}s, was {:.4f}s ({:.2f}x)".format(
+                    phase, size, result['median'], before['median'], result['median'] / before['median'])
+            if before and result.get('fs_calls', 0) > before.get('fs_calls', lsblkpro.INF):
+                # (the same every run, so any more is more work)
+                yield "{} at {} disks: {} fs calls, was {}".format(phase, size, result['fs_calls'], before['fs_calls'])
+    memory, before = run.get('memory'), baseline.get('memory')
+    if memory and before and before['entities'] == memory['entities']:
+        for key in ('host_bytes', 'table_bytes'):
+            if before[key] and memory[key] / before[key] > factor:
+                yield "memory, {}: {:.1f}MB, was {:.1f}MB ({:.2f}x)".format(
+                    key, memory[key] / 1e6, before[key] / 1e6, memory[key] / before[key])
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark lsblkpro against synthetic hosts")
+    parser.add_argument("--sizes", default=','.join(str(size) for size in SIZES),
+                        help="comma-separated numbers of disks (default: %(default)s)")
+    parser.add_argument("--partitions", type=int, default=2, help="per disk not in a pool")
+    parser.add_argument("--pools", type=int, default=4)
+    parser.add_argument("--collectors", default='native,lsblk',
+                        help="collectors to time Host.go with (default: %(default)s)")
+    parser.add_argument("--fleet-hosts", type=int, default=20,
+                        help="also time --fleet with this many copies of each host, as long as that's "
+                             "no more than {} disks; 0 to skip (default: %(default)s)".format(FLEET_DISKS))
+    parser.add_argument("--width", type=int, default=200,
+                        help="terminal width to lay out for; 0 for unbounded like -A (default: %(default)s)")
+    parser.add_argument("--memory-disks", type=int, default=MEMORY_DISKS,
+                        help="disks in the host whose memory is measured; 0 to skip (default: %(default)s)")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per phase (a third as many at 10k disks)")
+    parser.add_argument("--tree-dir", default=os.path.join(tempfile.gettempdir(), 'lsblkpro-bench'),
+                        help="where to generate (and reuse) the synthetic hosts")
+    parser.add_argument("--startup-budget", type=float, default=150.0, metavar='MS',
+                        help="flag a whole `lsblkpro` run against {} disks, from a fresh interpreter, "
+                             "that takes longer (default: %(default)s)".format(STARTUP_DISKS))
+    parser.add_argument("--save", metavar='FILE', help="write results as JSON")
+    parser.add_argument("--compare", metavar='FILE', help="compare against results saved earlier")
+    parser.add_argument("--threshold", type=float, default=1.5,
+                        help="flag phases slower than this many times the baseline's median")
+    parser.add_argument("--scaling", type=float, default=3.0,
+                        help="flag phases whose cost per entity grows more than this many times")
+    opts = parser.parse_args()
+    opts.collectors = opts.collectors.split(',')
+
+    run = {
+        'created': time.time(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'options': {k: v for k, v in vars(opts).items() if k not in ('save', 'compare', 'tree_dir')},
+        'startup': collections.OrderedDict(),
+        'results': collections.OrderedDict(),
+    }
+    root = os.path.join(opts.tree_dir, 'disks-{}-parts-{}-pools-{}'.format(STARTUP_DISKS, opts.partitions, opts.pools))
+    synthetic.ensure(root, disks=STARTUP_DISKS, partitions=opts.partitions, md_every=8, dm_every=0,
+                     pools=opts.pools, vdev_width=6, zfs_fraction=0.5)
+    startup_run = 'lsblkpro ({} disks)'.format(STARTUP_DISKS)
+    run['startup']['import ' + STARTUP_MODULE] = import_time(STARTUP_MODULE, opts.repeat)
+    run['startup'][startup_run] = run_time(root, opts.repeat)
+    print("startup: importing {} took {:.1f}ms; {} took {:.1f}ms (budget {:g}ms)".format(
+        STARTUP_MODULE, run['startup']['import ' + STARTUP_MODULE] * 1e3, startup_run,
+        run['startup'][startup_run] * 1e3, opts.startup_budget))
+    for size in (int(size) for size in opts.sizes.split(',')):
+        root = os.path.join(opts.tree_dir, 'disks-{}-parts-{}-pools-{}'.format(size, opts.partitions, opts.pools))
+        entities, results = bench_size(root, size, opts)
+        for phase, result in results.items():
+            result.setdefault('entities', entities)
+            print("{:>6} disks {:>7} entities  {:<22} min {:9.4f}s  median {:9.4f}s{}".format(
+                size, result['entities'], phase, result['min'], result['median'],
+                "  {} fs calls".format(result['fs_calls']) if 'fs_calls' in result else ''))
+        run['results'][str(size)] = results
+
+    if opts.memory_disks:
+        root = os.path.join(opts.tree_dir, 'disks-{}-parts-{}-pools-{}'.format(
+            opts.memory_disks, opts.partitions, opts.pools))
+        memory = run['memory'] = bench_memory(root, opts.memory_disks, opts)
+        print("memory: {} entities: host {:.1f}MB ({:.0f} bytes each), table {:.1f}MB, peak {:.1f}MB; "
+              "gc.collect() {:.4f}s".format(
+                  memory['entities'], memory['host_bytes'] / 1e6, memory['host_bytes'] / memory['entities'],
+                  memory['table_bytes'] / 1e6, memory['peak_bytes'] / 1e6, memory['gc']['min']))
+
+    if opts.save:
+        with open(opts.save, 'w') as f:
+            json.dump(run, f, indent=2)
+            f.write('\n')
+
+    problems = list(scaling_problems(run, opts.scaling))
+    if run['startup'][startup_run] * 1e3 > opts.startup_budget:
+        problems.append("{} took {:.1f}ms, over the {:g}ms budget".format(
+            startup_run, run['startup'][startup_run] * 1e3, opts.startup_budget))
+    if opts.compare:
+        with open(opts.compare) as f:
+            problems.extend(regressions(run, json.load(f), opts.threshold))
+    for problem in problems:
+        print("REGRESSION: {}".format(problem))
+    sys.exit(1 if problems else 0)
+
+if __name__ == '__main__':
+    main()
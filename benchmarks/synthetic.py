@@ -0,0 +1,384 @@
+"""
+Build a fake host for benchmarking: a sysfs tree, /dev/disk links, a udev database,
+mountinfo, diskstats, and `lsblk` and `zpool status` stand-ins that print canned output, for N disks
+with M partitions each. Some disks are mirrored in pairs with md, some partitions carry dm
+(LVM) volumes, and some disks are whole-disk ZFS vdevs in raidz2 groups across several pools.
+
+    python benchmarks/synthetic.py /tmp/host --disks 1000 --partitions 2
+
+`configure(root)` points lsblkpro at a tree made by `generate(root, ...)`.
+"""
+
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import os
+import sys
+import json
+import stat
+import shutil
+import uuid
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from lsblkpro import data
+
+SECTOR = 512
+DISK_SECTORS = 7814037168  # 4TB
+VDEV_SLOTS = 24  # bays per enclosure, for by-vdev names like a1 .. a24, b1 ..
+POOL_PARTITIONS = (1, 9)  # what ZFS makes on a whole disk
+
+# bumped when generate() writes something new, so ensure() replaces trees made before
+LAYOUT = 2
+
+def letters(ii):
+    """0 -> 'a', 25 -> 'z', 26 -> 'aa', like disk names"""
+    result = ''
+    ii += 1
+    while ii:
+        ii, rem = divmod(ii - 1, 26)
+        result = chr(ord('a') + rem) + result
+    return result
+
+def disk_major_minor(ii):
+    # 16 minors per disk: the whole disk, then up to 15 partitions
+    return (8 if ii < 16 else 1000 + ii // 16), (ii % 16) * 16
+
+def stable_uuid(*parts):
+    return str(uuid.uuid5(uuid.NAMESPACE_OID, '/'.join(str(part) for part in parts)))
+
+class Tree(object):
+    def __init__(self, root):
+        self.root = root
+        self.entities = []  # lsblk records, in lsblk order
+        self.mounts = []  # (major, minor, mountpoint)
+        self.pools = []  # (pool, [(group, [vdev names])])
+
+    def path(self, *parts):
+        return os.path.join(self.root, *parts)
+
+    def put(self, path, text):
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(path, 'w') as f:
+            f.write(text)
+
+    def mkdir(self, path):
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def link(self, kind, entry, target):
+        path = self.path('dev', 'disk', kind, entry)
+        self.mkdir(os.path.dirname(path))
+        os.symlink(os.path.join('..', '..', target), path)
+
+    def udev(self, major, minor, props, links):
+        lines = ['S:disk/{}'.format(link) for link in links]
+        lines.extend('E:{}={}'.format(k, v) for k, v in sorted(props.items()))
+        self.put(self.path('run', 'udev', 'data', 'b{}:{}'.format(major, minor)), '\n'.join(lines) + '\n')
+
+    def record(self, fields):
+        rec = dict.fromkeys(data.LSBLK_COLUMNS, '')
+        rec.update((k, str(v)) for k, v in fields.items())
+        rec['PATH'] = os.path.join('/dev', rec['NAME'])
+        self.entities.append(rec)
+        return rec
+
+    def block(self, name, major, minor, sectors, parent=None):
+        """the sysfs directory of a device, or a partition of `parent`"""
+        path = self.path('sys', 'block', parent, name) if parent else self.path('sys', 'block', name)
+        self.put(os.path.join(path, 'dev'), '{}:{}\n'.format(major, minor))
+        by_dev = self.path('sys', 'dev', 'block')
+        self.mkdir(by_dev)
+        os.symlink(os.path.relpath(path, by_dev), os.path.join(by_dev, '{}:{}'.format(major, minor)))
+        self.put(os.path.join(path, 'size'), '{}\n'.format(sectors))
+        for filename in ('ro', 'alignment_offset', 'discard_alignment'):
+            self.put(os.path.join(path, filename), '0\n')
+        self.mkdir(os.path.join(path, 'holders'))
+        return path
+
+    def hold(self, holder, members):
+        for parent, member in members:
+            path = self.path('sys', 'block', parent, member) if parent else self.path('sys', 'block', member)
+            self.put(os.path.join(path, 'holders', holder), '')
+            self.put(self.path('sys', 'block', holder, 'slaves', member), '')
+
+def generate(root, disks=10, partitions=2, md_every=8, dm_every=0, pools=2, vdev_width=6,
+             zfs_fraction=0.5):
+    """Write a fake host under `root` (which must not exist yet). The first `zfs_fraction` of
+    the disks go to `pools` pools in raidz2 groups of `vdev_width`; the others get `partitions`
+    partitions with filesystems. Every `md_every`th pair of those is mirrored with md on their
+    first partitions, and every `dm_every`th one has an LVM volume on its last partition.
+    """
+    tree = Tree(root)
+    params = {
+        'disks': disks, 'partitions': partitions, 'md_every': md_every, 'dm_every': dm_every,
+        'pools': pools, 'vdev_width': vdev_width, 'zfs_fraction': zfs_fraction,
+    }
+    os.makedirs(root)
+
+    zfs_disks = int(round(disks * zfs_fraction / vdev_width)) * vdev_width if pools else 0
+    groups = [[] for _ in range(zfs_disks // vdev_width)]
+    per_pool = max(1, -(-len(groups) // pools)) if pools else 1
+
+    fs_disks = []
+    for ii in range(disks):
+        name = 'sd' + letters(ii)
+        major, minor = disk_major_minor(ii)
+        serial = 'ZA{:08d}'.format(ii)
+        wwn = '0x5000c500{:08x}'.format(ii)
+        model = 'ST4000NM0033-9ZM170'
+        path = tree.block(name, major, minor, DISK_SECTORS)
+
+        # the SCSI device the disk hangs off, for HCTL and TRAN
+        hctl = '{}:0:0:0'.format(ii)
+        device = tree.path('sys', 'devices', 'pci0000:00', '0000:00:1f.2', 'ata{}'.format(ii + 1),
+                           'host{}'.format(ii), 'target{}:0:0'.format(ii), hctl)
+        for filename, value in (('model', model), ('vendor', 'ATA'), ('rev', 'SN04'),
+                                ('state', 'running'), ('type', '0')):
+            tree.put(os.path.join(device, filename), value + '\n')
+        os.symlink(os.path.relpath(device, path), os.path.join(path, 'device'))
+        for key, filename in data_queue_files():
+            tree.put(os.path.join(path, 'queue', filename), '{}\n'.format(key))
+        tree.put(os.path.join(path, 'queue', 'scheduler'), '[mq-deadline] none\n')
+        tree.put(os.path.join(path, 'removable'), '0\n')
+
+        in_pool = ii < zfs_disks
+        vdev = letters(ii // VDEV_SLOTS) + str(ii % VDEV_SLOTS + 1) if in_pool else None
+        by_id = 'ata-{}_{}'.format(model, serial)
+        ptuuid = stable_uuid(name, 'pt')
+
+        links = ['by-id/' + by_id, 'by-id/wwn-' + wwn]
+        tree.link('by-id', by_id, name)
+        tree.link('by-id', 'wwn-' + wwn, name)
+        if in_pool:
+            groups[ii // vdev_width].append(vdev)
+            links.append('by-vdev/' + vdev)
+            tree.link('by-vdev', vdev, name)
+        tree.udev(major, minor, {
+            'ID_SERIAL_SHORT': serial, 'ID_WWN': wwn, 'ID_PART_TABLE_TYPE': 'gpt',
+            'ID_PART_TABLE_UUID': ptuuid, 'ID_BUS': 'ata',
+        }, links)
+        tree.record({
+            'NAME': name, 'KNAME': name, 'MAJ:MIN': '{}:{}'.format(major, minor),
+            'SIZE': DISK_SECTORS * SECTOR, 'TYPE': 'disk', 'MODEL': model, 'VENDOR': 'ATA',
+            'REV': 'SN04', 'STATE': 'running', 'SERIAL': serial, 'WWN': wwn, 'HCTL': hctl,
+            'TRAN': 'sata', 'PTTYPE': 'gpt', 'PTUUID': ptuuid, 'RO': 0, 'RM': 0, 'ROTA': 1,
+            'RA': 128, 'RQ-SIZE': 256, 'PHY-SEC': 4096, 'LOG-SEC': 512, 'MIN-IO': 4096,
+            'OPT-IO': 0, 'SCHED': 'mq-deadline',
+        })
+
+        numbers = POOL_PARTITIONS if in_pool else range(1, partitions + 1)
+        part_sectors = DISK_SECTORS // (len(numbers) + 1)
+        part_names = []
+        for number in numbers:
+            part_name = '{}{}'.format(name, number)
+            part_names.append(part_name)
+            part_path = tree.block(part_name, major, minor + number, part_sectors, parent=name)
+            tree.put(os.path.join(part_path, 'start'), '{}\n'.format(2048 + number * part_sectors))
+            tree.put(os.path.join(part_path, 'partition'), '{}\n'.format(number))
+
+            partuuid = stable_uuid(name, number)
+            links = ['by-id/{}-part{}'.format(by_id, number), 'by-partuuid/' + partuuid]
+            tree.link('by-id', '{}-part{}'.format(by_id, number), part_name)
+            tree.link('by-partuuid', partuuid, part_name)
+            props = {'ID_PART_ENTRY_UUID': partuuid, 'ID_PART_ENTRY_NUMBER': str(number),
+                     'ID_PART_ENTRY_TYPE': '0fc63daf-8483-4772-8e79-3d69d8477de4'}
+            rec = {
+                'NAME': part_name, 'KNAME': part_name, 'MAJ:MIN': '{}:{}'.format(major, minor + number),
+                'SIZE': part_sectors * SECTOR, 'TYPE': 'part', 'PKNAME': name, 'PARTUUID': partuuid,
+                'PARTTYPE': props['ID_PART_ENTRY_TYPE'], 'RO': 0, 'RM': 0, 'ROTA': 1, 'RA': 128,
+                'SCHED': 'mq-deadline',
+            }
+            if in_pool:
+                links.append('by-vdev/{}-part{}'.format(vdev, number))
+                tree.link('by-vdev', '{}-part{}'.format(vdev, number), part_name)
+                if number == 1:
+                    # blkid's ID_FS_UUID_SUB is the vdev GUID, in decimal like `zpool status` shows it
+                    guid = int(stable_uuid(name, 'vdev').replace('-', ''), 16) >> 64
+                    props.update(ID_FS_TYPE='zfs_member', ID_FS_LABEL='tank{}'.format(ii // vdev_width // per_pool),
+                                 ID_FS_UUID_SUB=str(guid))
+                    rec.update({'FSTYPE': 'zfs_member', 'LABEL': props['ID_FS_LABEL']})
+            else:
+                fs_uuid = stable_uuid(name, number, 'fs')
+                links.append('by-uuid/' + fs_uuid)
+                tree.link('by-uuid', fs_uuid, part_name)
+                props.update(ID_FS_TYPE='ext4', ID_FS_UUID=fs_uuid)
+                rec.update({'FSTYPE': 'ext4', 'UUID': fs_uuid})
+                mountpoint = '/srv/{}'.format(part_name)
+                tree.mounts.append((major, minor + number, mountpoint))
+                rec['MOUNTPOINT'] = mountpoint
+            tree.udev(major, minor + number, props, links)
+            tree.record(rec)
+
+        if not in_pool and part_names:
+            fs_disks.append((name, part_names))
+
+    # md mirrors over the first partitions of pairs of disks
+    if md_every:
+        for kk, ii in enumerate(range(0, len(fs_disks) - 1, 2 * md_every)):
+            md = 'md{}'.format(kk)
+            members = [fs_disks[ii], fs_disks[ii + 1]]
+            path = tree.block(md, 9, kk, DISK_SECTORS // 3)
+            tree.put(os.path.join(path, 'md', 'level'), 'raid1\n')
+            tree.hold(md, [(disk, parts[0]) for disk, parts in members])
+            tree.udev(9, kk, {}, [])
+            tree.record({'NAME': md, 'KNAME': md, 'MAJ:MIN': '9:{}'.format(kk),
+                         'SIZE': DISK_SECTORS // 3 * SECTOR, 'TYPE': 'raid1',
+                         'PKNAME': members[0][1][0], 'RO': 0, 'RM': 0, 'ROTA': 1})
+
+    # LVM volumes on the last partition of some disks
+    if dm_every:
+        for kk, ii in enumerate(range(0, len(fs_disks), dm_every)):
+            dm, lv = 'dm-{}'.format(kk), 'vg0-lv{}'.format(kk)
+            disk, parts = fs_disks[ii]
+            path = tree.block(dm, 253, kk, DISK_SECTORS // 4)
+            tree.put(os.path.join(path, 'dm', 'name'), lv + '\n')
+            tree.put(os.path.join(path, 'dm', 'uuid'), 'LVM-{}\n'.format(stable_uuid(lv).replace('-', '')))
+            tree.hold(dm, [(disk, parts[-1])])
+            tree.udev(253, kk, {'DM_NAME': lv}, [])
+            rec = tree.record({'NAME': lv, 'KNAME': dm, 'MAJ:MIN': '253:{}'.format(kk),
+                               'SIZE': DISK_SECTORS // 4 * SECTOR, 'TYPE': 'lvm',
+                               'PKNAME': parts[-1], 'RO': 0, 'RM': 0, 'ROTA': 1})
+            rec['PATH'] = os.path.join('/dev', 'mapper', lv)
+
+    # pools of raidz2 groups
+    for pp in range(0, len(groups), per_pool):
+        pool = 'tank{}'.format(pp // per_pool)
+        tree.pools.append((pool, [('raidz2-{}'.format(gg), group)
+                                  for gg, group in enumerate(groups[pp:pp + per_pool])]))
+
+    write_mountinfo(tree)
+    tree.put(tree.path('proc', 'swaps'), 'Filename\t\t\t\tType\t\tSize\t\tUsed\t\tPriority\n')
+    tree.put(tree.path('proc', 'diskstats'), diskstats_output(tree.entities))
+    tree.put(tree.path('sys', 'kernel', 'uevent_seqnum'), '{}\n'.format(len(tree.entities)))
+    tree.put(tree.path('lsblk.out'), lsblk_output(tree.entities))
+    tree.put(tree.path('zpool-status.out'), zpool_status_output(tree.pools))
+    tree.put(tree.path('zpool-list.out'), ''.join(pool + '\n' for pool, _ in tree.pools))
+    for pool in tree.pools:
+        tree.put(tree.path('zpool-status-{}.out'.format(pool[0])), zpool_status_output([pool]))
+        write_kstat(tree, pool[0])
+    scripts = (
+        ('lsblk', 'exec cat {}\n'.format(tree.path('lsblk.out'))),
+        # `zpool list ...`, `zpool status [-p] POOL` or `zpool status`
+        ('zpool', 'if [ "$1" = list ]; then exec cat {}; fi\n'
+                  'for pool; do :; done\n'
+                  'if [ -f {}-"$pool".out ]; then exec cat {}-"$pool".out; fi\n'
+                  'exec cat {}\n'.format(tree.path('zpool-list.out'), tree.path('zpool-status'),
+                                         tree.path('zpool-status'), tree.path('zpool-status.out'))),
+    )
+    for command, body in scripts:
+        script = tree.path('bin', command)
+        tree.put(script, '#!/bin/sh\n' + body)
+        os.chmod(script, os.stat(script).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+    params['entities'] = len(tree.entities)
+    params['layout'] = LAYOUT
+    tree.put(tree.path('params.json'), json.dumps(params, sort_keys=True) + '\n')
+    return params
+
+def data_queue_files():
+    """(value, filename) for the queue/ attributes lsblk reads"""
+    return (
+        (128, 'read_ahead_kb'), (256, 'nr_requests'), (1, 'rotational'), (0, 'add_random'),
+        (4096, 'physical_block_size'), (512, 'logical_block_size'), (4096, 'minimum_io_size'),
+        (0, 'optimal_io_size'), (0, 'discard_granularity'), (0, 'discard_max_bytes'),
+        (0, 'discard_zeroes_data'), (0, 'write_same_max_bytes'),
+    )
+
+def write_mountinfo(tree):
+    lines = ['22 1 0:21 / / rw,relatime shared:1 - tmpfs tmpfs rw']
+    for ii, (major, minor, mountpoint) in enumerate(tree.mounts):
+        lines.append('{} 22 {}:{} / {} rw,relatime shared:{} - ext4 /dev/x rw'.format(
+            100 + ii, major, minor, mountpoint, ii + 2))
+    tree.put(tree.path('proc', 'self', 'mountinfo'), '\n'.join(lines) + '\n')
+
+def write_kstat(tree, pool):
+    """the world-readable bits of /proc/spl/kstat/zfs/POOL that zpool.kstat reads"""
+    path = tree.path('proc', 'spl', 'kstat', 'zfs', pool)
+    tree.put(os.path.join(path, 'state'), 'ONLINE\n')
+    tree.put(os.path.join(path, 'io'), '\n'.join([
+        '12 3 0x00 1 80 2226421960 25393407734560',
+        'nread    nwritten reads    writes   wtime    wlentime wupdate  rtime    rlentime rupdate  wcnt     rcnt',
+        '2143141376 1380777472 35339    85773    4031219963 136208493776 25393405588126 4059934543 '
+        '31785347013 25393405626862 0        0',
+    ]) + '\n')
+
+def diskstats_output(records):
+    """/proc/diskstats with made-up counters (the same every time it's read)"""
+    lines = []
+    for ii, rec in enumerate(records):
+        major, minor = rec['MAJ:MIN'].split(':')
+        counters = [ii * 100, ii, ii * 800, ii * 50, ii * 40, ii, ii * 640, ii * 30, 0, ii * 60, ii * 80,
+                    0, 0, 0, 0, 0, 0]
+        lines.append('{:>4} {:>7} {} {}'.format(major, minor, rec['KNAME'], ' '.join(map(str, counters))))
+    return '\n'.join(lines) + '\n'
+
+def lsblk_output(records):
+    return ''.join(' '.join('{}="{}"'.format(key, rec[key]) for key in data.LSBLK_COLUMNS) + '\n'
+                   for rec in records)
+
+def zpool_status_output(pools):
+    out = []
+    for pool, groups in pools:
+        out.extend([
+            '  pool: {}'.format(pool),
+            ' state: ONLINE',
+            '  scan: scrub repaired 0 in 10h46m with 0 errors on Mon Aug  3 08:17:17 2015',
+            'config:',
+            '',
+            '\tNAME        STATE     READ WRITE CKSUM',
+            '\t{:<12}ONLINE       0     0     0'.format(pool),
+        ])
+        for group, vdevs in groups:
+            out.append('\t  {:<10}ONLINE       0     0     0'.format(group))
+            out.extend('\t    {:<8}ONLINE       0     0     0'.format(vdev) for vdev in vdevs)
+        out.extend(['', 'errors: No known data errors', ''])
+    return '\n'.join(out) + '\n'
+
+def configure(root):
+    """point lsblkpro's collectors at the fake host under `root`"""
+    data.SYSFS = os.path.join(root, 'sys')
+    data.DEV = os.path.join(root, 'dev')
+    data.UDEV_DATA = os.path.join(root, 'run', 'udev', 'data')
+    data.PROC = os.path.join(root, 'proc')
+    data.LSBLK = [os.path.join(root, 'bin', 'lsblk')]
+    data.ZPOOL_STATUS = [os.path.join(root, 'bin', 'zpool'), 'status']
+    data.ZPOOL_LIST = [os.path.join(root, 'bin', 'zpool'), 'list', '-H', '-o', 'name']
+
+def ensure(root, **params):
+    """`root` generated with `params`, reusing it if an earlier run already made it"""
+    try:
+        with open(os.path.join(root, 'params.json')) as f:
+            existing = json.load(f)
+        existing.pop('entities', None)
+        layout = existing.pop('layout', 1)
+        if existing == params:
+            if layout == LAYOUT:
+                return
+            shutil.rmtree(root)  # ours, but missing something generate() writes now
+    except (IOError, OSError, ValueError):
+        pass
+    if os.path.exists(root):
+        raise RuntimeError("'{}' exists but wasn't generated with {}".format(root, params))
+    generate(root, **params)
+
+def main():
+    parser = argparse.ArgumentParser(description="generate a fake host for benchmarking lsblkpro")
+    parser.add_argument("root", help="directory to create")
+    parser.add_argument("--disks", type=int, default=10)
+    parser.add_argument("--partitions", type=int, default=2, help="per disk not in a pool (at most 15)")
+    parser.add_argument("--md-every", type=int, default=8, help="mirror every Nth pair of disks (0: never)")
+    parser.add_argument("--dm-every", type=int, default=0, help="LVM on every Nth disk (0: never)")
+    parser.add_argument("--pools", type=int, default=2)
+    parser.add_argument("--vdev-width", type=int, default=6, help="disks per raidz2 group")
+    parser.add_argument("--zfs-fraction", type=float, default=0.5, help="share of disks in pools")
+    args = parser.parse_args()
+    params = generate(args.root, disks=args.disks, partitions=args.partitions, md_every=args.md_every,
+                      dm_every=args.dm_every, pools=args.pools, vdev_width=args.vdev_width,
+                      zfs_fraction=args.zfs_fraction)
+    print(json.dumps(params, sort_keys=True))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+from builtins import *
+
+import io
+import os
+import sys
+import time
+import select
+import signal
+import socket
+import threading
+
+from . import lsblkpro
+from . import watch
+
+DEFAULT_SOCKET = os.path.join('/run', 'lsblkpro.sock')
+
+# how often the daemon re-runs `zpool status`, which no uevent tells us about
+ZPOOL_REFRESH = 10.0
+
+# seconds a client waits for an answer
+CLIENT_TIMEOUT = 10.0
+
+# seconds a request gets to lay out its table before it's killed: a `--where` regexp can take
+# as long as it likes, and re doesn't let go of the GIL meanwhile
+REQUEST_TIMEOUT = 5.0
+
+# who may connect without --socket-group: the ones who can read the disks anyway
+DEFAULT_SOCKET_GROUP = 'disk'
+
+class DaemonError(Exception):
+    pass
+
+class Daemon(object):
+    """Keeps a Host up to date from uevents (like --watch) and lays out tables from it for
+    clients. Each request is laid out in a child forked for it, which sees the host as it was
+    and keeps the table code's module globals to itself, and is killed if it takes longer
+    than REQUEST_TIMEOUT.
+    """
+    def __init__(self, host, args):
+        self.host = host
+        self.args = args
+        self.lock = threading.Lock()
+        self.rows = {}  # entity -> Row, kept between requests for the cells they've worked out
+
+    def refresh_forever(self):
+        monitor = watch.UeventMonitor()
+        while True:
+            names = monitor.wait(ZPOOL_REFRESH)
+            with self.lock:
+                if names is None:
+                    changed = self.host.refresh(self.args)
+                elif names:
+                    changed = self.host.refresh(self.args, names)
+                else:
+                    changed = self.host.refresh_zpool_status(self.args.zpool_status)
+                if changed:
+                    self.rows = {ent: row for ent, row in self.rows.items() if ent.name not in changed}
+                    self.warm()
+
+    def warm(self):
+        """work out the usual cells here, for the children to reuse (what they work out goes
+        with them); under the lock"""
+        args = lsblkpro.parse_args([])
+        args.width_limit = lsblkpro.INF
+        table = lsblkpro.Table(self.host, args, reuse=self.rows)
+        self.rows.update((row.ent, row) for row in table.rows)
+
+    def render(self, request):
+        """{'output': text} for a client's request, or {'error': message}; in the child"""
+        argv = list(request.get('argv', []))
+        if request.get('ascii'):
+            argv.append('--ascii')
+        try:
+            args = lsblkpro.parse_args(argv)
+        except SystemExit:
+            return {'error': "bad arguments: {}".format(' '.join(argv))}
+        args.width_limit = request.get('width') or lsblkpro.INF
+        args.color = bool(request.get('color'))
+        # parse_args went by the daemon's own stdout; the client's is what counts
+        lsblkpro.use_box_characters(request.get('encoding'), args.ascii)
+        # rows' size cells are formatted for --bytes or not; keep the usual ones
+        reuse = self.rows if args.bytes is None else None
+        out = io.StringIO()
+        lsblkpro.show(self.host, args, out=out, reuse=reuse)
+        return {'output': out.getvalue()}
+
+    def answer(self, request, timeout=REQUEST_TIMEOUT):
+        """render(`request`) in a child, or {'error': message} if it fails or takes longer than
+        `timeout` seconds"""
+        import json
+        read_fd, write_fd = os.pipe()
+        with self.lock:
+            # (not while a refresh is half done)
+            pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                os.close(read_fd)
+                try:
+                    reply = self.render(request)
+                    status = 0
+                except Exception as ex:
+                    reply = {'error': "failed: {}".format(ex)}
+                with os.fdopen(write_fd, 'wb') as f:
+                    f.write(json.dumps(reply).encode('utf-8'))
+            finally:
+                os._exit(status)
+
+        os.close(write_fd)
+        deadline = time.monotonic() + timeout
+        chunks = []
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not select.select([read_fd], [], [], remaining)[0]:
+                    os.kill(pid, signal.SIGKILL)
+                    return {'error': "gave up on the request after {:g}s".format(timeout)}
+                chunk = os.read(read_fd, 65536)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+        finally:
+            os.close(read_fd)
+            os.waitpid(pid, 0)
+        try:
+            return json.loads(b''.join(chunks).decode('utf-8'))
+        except ValueError:
+            return {'error': "the request died"}
+
+    def handle(self, conn):
+        import json
+        try:
+            with conn, conn.makefile('rwb') as f:
+                try:
+                    request = json.loads(f.readline().decode('utf-8'))
+                    reply = self.answer(request)
+                except ValueError as ex:
+                    reply = {'error': "bad request: {}".format(ex)}
+                f.write(json.dumps(reply).encode('utf-8') + b'\n')
+        except (IOError, OSError):
+            pass  # the client went away
+
+    def serve(self, path):
+        if os.path.exists(path):
+            # left over from a daemon that's gone, unless one is still answering
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(path)
+            except (IOError, OSError):
+                os.unlink(path)
+            else:
+                raise DaemonError("another daemon is already listening on '{}'".format(path))
+            finally:
+                probe.close()
+
+        group = self.args.socket_group
+        try:
+            import grp
+            gid = grp.getgrnam(group or DEFAULT_SOCKET_GROUP).gr_gid
+        except KeyError:
+            if group is not None:
+                raise DaemonError("no group '{}' for the socket".format(group))
+            gid = -1
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(path)
+        os.chown(path, -1, gid)
+        os.chmod(path, self.args.socket_mode)
+        sock.listen(16)
+        with self.lock:
+            self.warm()
+
+        refresher = threading.Thread(target=self.refresh_forever, name='refresh')
+        refresher.daemon = True
+        refresher.start()
+        print("lsblkpro: serving {} devices on {}".format(len(self.host.devices), path))
+        sys.stdout.flush()
+        try:
+            while True:
+                conn, _ = sock.accept()
+                thread = threading.Thread(target=self.handle, args=(conn,))
+                thread.daemon = True
+                thread.start()
+        finally:
+            sock.close()
+            os.unlink(path)
+
+def serve(host, args, path):
+    """`--daemon`: answer clients on the Unix socket at `path` until killed"""
+    Daemon(host, args).serve(path)
+
+def ask(path, argv, width=None, color=False, ascii=False, encoding=None, timeout=CLIENT_TIMEOUT):
+    """the output of lsblkpro `argv`, from the daemon listening at `path`, for a terminal in
+    `encoding`"""
+    import json
+    request = {'argv': list(argv), 'width': width, 'color': color, 'ascii': ascii, 'encoding': encoding}
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(path)
+        with sock, sock.makefile('rwb') as f:
+            f.write(json.dumps(request).encode('utf-8') + b'\n')
+            f.flush()
+            reply = json.loads(f.readline().decode('utf-8'))
+    except (IOError, OSError, ValueError) as ex:
+        raise DaemonError("no answer from the daemon at '{}': {}".format(path, ex))
+    if 'error' in reply:
+        raise DaemonError(reply['error'])
+    return reply['output']
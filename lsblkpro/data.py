@@ -5,38 +5,268 @@ import os
 import sys
 import re
 import string
-import operator
+import itertools
+import time
 import subprocess
+import threading
 import collections
 
+from . import timing
+
 CLI_UTILS_ENCODING = sys.stdout.encoding
-PRIMARY_KEY = 'NAME'
+
+# what lsblk records are matched to entities by: the kernel name, which is what sysfs calls them
+# (NAME is the device-mapper name for dm devices)
+PRIMARY_KEY = 'KNAME'
+
+# the kind of the pseudo-link from a ZFS member's vdev GUID, which `zpool status` shows in place
+# of a device it can't open by its usual name (see Host.fetch_dev_disk)
+ZFS_GUID = 'zfs-guid'
+
+# filesystem roots the collectors read from
+SYSFS = '/sys'
+DEV = '/dev'
+UDEV_DATA = os.path.join('/run', 'udev', 'data')
+PROC = '/proc'
+
+# external commands
+LSBLK = ['lsblk']
+ZPOOL_STATUS = ['sudo', '-n', 'zpool', 'status']
+ZPOOL_LIST = ['zpool', 'list', '-H', '-o', 'name']
+
+# seconds each collector may take before the table is rendered without it (None = wait forever)
+COLLECTOR_TIMEOUTS = collections.OrderedDict([
+    ('sysfs', None),
+    ('lsblk', 10.0),
+    ('dev_disk', 5.0),
+    ('zpool', 5.0),
+    ('iostat', None),  # only with --iostat, which takes as long as its interval anyway
+    ('smart', 30.0),  # only with --smart
+])
+
+# kernel device name prefixes (https://www.kernel.org/doc/Documentation/devices.txt), then
+# runs of letters or digits
+NAME_PARTS = re.compile(r'(?:^(?:dm-|zd|ram|fd|hd|loop|sd|n?st|md|scd|n?tpqic|xd|sonycd|gscd|optcd|sjcd|c?double|hitcd|sg|mfm|hd|mcd|cdu535|sbpcd|qft|nqft|zqft|nzqft|rawqft|nrawqft|ad|aztcd|cm205cd|r?rom|r?flash|cm206cd|slram|n?ht|z2ram|nb|ft|pd|pcd|pf|r?pda|sch|mtdr?|ppdd|nft|dasd|n?pt|inft|pg|ubd|jsfd|nnpfs|ub|xvd|n?osst|rfd|ssfdc|blockrom|osd)|^[a-z]-?|[a-z]+|\d+)')
+
+# every column `lsblk -O` knows about (util-linux 2.38)
+LSBLK_COLUMNS = (
+    'ALIGNMENT', 'DISC-ALN', 'DAX', 'DISC-GRAN', 'DISC-MAX', 'DISC-ZERO', 'FSAVAIL', 'FSROOTS',
+    'FSSIZE', 'FSTYPE', 'FSUSED', 'FSUSE%', 'FSVER', 'GROUP', 'HCTL', 'HOTPLUG', 'KNAME', 'LABEL',
+    'LOG-SEC', 'MAJ:MIN', 'MIN-IO', 'MODE', 'MODEL', 'NAME', 'OPT-IO', 'OWNER', 'PARTFLAGS',
+    'PARTLABEL', 'PARTTYPE', 'PARTTYPENAME', 'PARTUUID', 'PATH', 'PHY-SEC', 'PKNAME', 'PTTYPE',
+    'PTUUID', 'RA', 'RAND', 'REV', 'RM', 'RO', 'ROTA', 'RQ-SIZE', 'SCHED', 'SERIAL', 'SIZE',
+    'START', 'STATE', 'SUBSYSTEMS', 'MOUNTPOINT', 'MOUNTPOINTS', 'TRAN', 'TYPE', 'UUID', 'VENDOR',
+    'WSAME', 'WWN', 'ZONED', 'ZONE-SZ', 'ZONE-WGRAN', 'ZONE-APP', 'ZONE-NR', 'ZONE-OMAX', 'ZONE-AMAX',
+)
+
+class Schema(object):
+    """Column names and their indices, kept once for every Record rather than in each one.
+    Columns only ever get added, so an index stays good for the life of the process.
+    """
+    def __init__(self, keys):
+        self.keys = []
+        self.index = {}
+        for key in keys:
+            self.add(key)
+
+    def add(self, key):
+        ii = self.index.get(key)
+        if ii is None:
+            key = sys.intern(key)
+            ii = self.index[key] = len(self.keys)
+            self.keys.append(key)
+        return ii
+
+# the columns of every lsblk record: LSBLK_COLUMNS, then any a newer lsblk or snapshot has
+LSBLK_SCHEMA = Schema(LSBLK_COLUMNS)
+
+class Record(object):
+    """An entity's lsblk columns, as a read-only mapping: a tuple of values in LSBLK_SCHEMA
+    order, None for the columns it doesn't have. The values are interned, since most of them
+    ('0', '512', 'disk', a model name, ...) repeat from entity to entity.
+    """
+    __slots__ = ('fields',)
+
+    def __init__(self, items=()):
+        schema = LSBLK_SCHEMA
+        fields = [None] * len(schema.keys)
+        for key, value in items:
+            ii = schema.index.get(key)
+            if ii is None:
+                ii = schema.add(key)
+            if ii >= len(fields):
+                fields.extend([None] * (ii + 1 - len(fields)))
+            fields[ii] = sys.intern(value) if isinstance(value, str) else value
+        while fields and fields[-1] is None:
+            fields.pop()
+        self.fields = tuple(fields)
+
+    def get(self, key, default=None):
+        ii = LSBLK_SCHEMA.index.get(key)
+        if ii is None or ii >= len(self.fields):
+            return default
+        value = self.fields[ii]
+        return default if value is None else value
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __iter__(self):
+        keys = LSBLK_SCHEMA.keys
+        return (keys[ii] for ii, value in enumerate(self.fields) if value is not None)
+
+    def __len__(self):
+        return sum(1 for value in self.fields if value is not None)
+
+    def __bool__(self):
+        return bool(self.fields)  # (no trailing Nones)
+    __nonzero__ = __bool__
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        return [value for value in self.fields if value is not None]
+
+    def items(self):
+        keys = LSBLK_SCHEMA.keys
+        return [(keys[ii], value) for ii, value in enumerate(self.fields) if value is not None]
+
+    def __eq__(self, other):
+        return dict(self.items()) == dict(other.items())
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'Record({!r})'.format(dict(self.items()))
+
+    @staticmethod
+    def columns(records):
+        """(key, cells, present) for every column any of `records` has, a column at a time by
+        index; cells are '' where a record hasn't the column, and present is None if they all do"""
+        if not records:
+            return
+        width = max(len(record.fields) for record in records)
+        padded = [record.fields if len(record.fields) == width else
+                  record.fields + (None,) * (width - len(record.fields)) for record in records]
+        for key, values in zip(LSBLK_SCHEMA.keys, zip(*padded)):
+            if None not in values:
+                yield key, list(values), None
+                continue
+            present = [value is not None for value in values]
+            if any(present):
+                yield key, ['' if value is None else value for value in values], present
+
+    @staticmethod
+    def maker(keys):
+        """a function from a row of values for `keys` (None where there's no value) to a
+        Record, for making many with the same keys"""
+        indices = [LSBLK_SCHEMA.add(key) for key in keys]
+        width = max(indices) + 1 if indices else 0
+        intern = sys.intern
+
+        def make(values):
+            fields = [None] * width
+            for ii, value in zip(indices, values):
+                if value is not None:
+                    fields[ii] = intern(value) if isinstance(value, str) else value
+            while fields and fields[-1] is None:
+                fields.pop()
+            record = Record.__new__(Record)
+            record.fields = tuple(fields)
+            return record
+        return make
+
+# an entity's lsblk before lsblk has run, or when it skips the entity
+NO_RECORD = Record()
+
+class Projection(object):
+    """The fields a view can show, so collectors can skip the rest.
+    Collectors take None to mean every field.
+    """
+    # lsblk columns the model itself depends on, whatever is shown
+    LSBLK_REQUIRED = ('NAME', 'KNAME', 'MAJ:MIN', 'PKNAME', 'TYPE', 'SIZE', 'MOUNTPOINT', 'FSTYPE')
+
+    # synthesized fields -> the fields they're made from
+    DERIVED = {
+        'display_name': ('NAME', 'KNAME', 'TYPE', 'vdev'),
+        'location': ('MOUNTPOINT', 'zpath'),
+        'size': ('SIZE',),
+        # any name a pool can use (see Host.identify), and the ZFS label naming the pool
+        'zpath': ('vdev', 'id', 'path', 'partuuid', 'partlabel', 'LABEL'),
+    }
+
+    def __init__(self, fields):
+        todo = list(fields)
+        self.fields = set()
+        while todo:
+            field = todo.pop()
+            if field not in self.fields:
+                self.fields.add(field)
+                todo.extend(Projection.DERIVED.get(field, ()))
+
+    def __repr__(self):
+        return 'Projection({})'.format(sorted(self.fields))
+
+    def lsblk_columns(self):
+        columns = set(Projection.LSBLK_REQUIRED) | (self.fields & set(LSBLK_COLUMNS))
+        return [col for col in LSBLK_COLUMNS if col in columns]
+
+    def wants_link_kind(self, kind):
+        """whether to read /dev/disk/`kind`, e.g. 'by-id'"""
+        return kind.startswith('by-') and kind[3:] in self.fields
+
+    @property
+    def wants_zpool(self):
+        return 'zpath' in self.fields
 
 class Entity(object):
+    # thousands of them on a big host, each with the same attributes
+    __slots__ = ('name', 'lsblk', 'by', 'zpath', 'zfs', 'holder_names', 'host', 'iostat', 'smart',
+                 'major', 'minor')
+
     def __init__(self, name):
         self.name = name
-        self.lsblk = {}
+        self.lsblk = NO_RECORD  # a Record
         self.by = {}
         self.zpath = None
+        self.zfs = {}  # column -> value from `zpool status`, with zpath (see zpool.COLUMNS)
         self.holder_names = None
+        self.host = None  # hostname, for entities in a fleet (see fleet.py)
+        self.iostat = {}  # column -> rate, with --iostat (see iostat.py)
+        self.smart = {}  # column -> reading, for drives with --smart (see smart.py)
+        self.major = None
+        self.minor = None
 
 class Device(Entity):
+    __slots__ = ('partitions', 'depth')
+    _name_parts_cache = {}  # name -> Device.name_parts_for(name)
+    _sortable_smart_cache = {}  # name -> Device._sortable_smart_for(name)
+
     def __init__(self, name):
         super().__init__(name)
         self.partitions = None
-        self.major = None
-        self.minor = None
+        self.depth = 0  # levels of holders it's built on, e.g. 1 for md over disks (see Host.holder_graph)
 
     @staticmethod
     def from_sysfs(device_name):
         dev = Device(device_name)
-        path = os.path.join('/sys', 'block', device_name)
+        path = os.path.join(SYSFS, 'block', device_name)
         partition_names = []
         for entry in os.listdir(path):
             if is_partition_dirent(device_name, entry):
                 partition_names.append(entry)
             elif entry == 'holders':
-                dev.holder_names = os.listdir(os.path.join('/sys', 'block', device_name, 'holders'))
+                dev.holder_names = os.listdir(os.path.join(path, 'holders'))
             elif entry == 'dev':
                 dev.major, dev.minor = parse_maj_min(read_sysfs(path, entry))
 
@@ -44,6 +274,67 @@ class Device(Entity):
                           for part_name in sorted(partition_names, key=Device._sortable_smart_for)]
         return dev
 
+    @staticmethod
+    def all_from_sysfs(names=None):
+        """Every device (or those of `names` that exist) with its partitions, from one pass
+        over /sys/dev/block. Each entry there is named for a device's MAJ:MIN and links to its
+        directory, which for a partition is inside its disk's, so one readlink says whose it
+        is. Whether it's a partition is whether /sys/block leaves it out: a directory inside a
+        disk's isn't always a partition (mmcblk0boot0 is in mmcblk0's). That leaves only
+        holders/ to list: nothing is opened or stat'ed, where Device.from_sysfs lists every
+        directory and stats every entry in it. None without /sys/dev/block (before Linux
+        2.6.27).
+        """
+        root = os.path.join(SYSFS, 'dev', 'block')
+        try:
+            with os.scandir(root) as it:
+                entries = list(it)
+            device_names = set(os.listdir(os.path.join(SYSFS, 'block')))
+        except OSError:
+            return None
+        timing.count('sysfs_entries', len(entries))
+
+        found = []  # (kernel name, name of the directory it's in, MAJ:MIN, path)
+        for entry in entries:
+            try:
+                target = os.readlink(entry.path)
+            except OSError:
+                continue  # gone since, or not a link
+            parent, name = target.split('/')[-2:]
+            found.append((name, parent, entry.name, entry.path))
+
+        devices = {}
+        partitions = []
+        for name, parent, maj_min, path in found:
+            if name not in device_names:
+                partitions.append((name, parent, maj_min, path))
+            elif names is None or name in names:
+                try:
+                    holder_names = os.listdir(os.path.join(path, 'holders'))
+                except OSError:
+                    continue  # gone since
+                dev = devices[name] = Device(name)
+                dev.major, dev.minor = parse_maj_min(maj_min)
+                dev.holder_names = holder_names
+                dev.partitions = []
+
+        for name, parent, maj_min, path in partitions:
+            dev = devices.get(parent)
+            if dev is None:
+                continue
+            try:
+                holder_names = os.listdir(os.path.join(path, 'holders'))
+            except OSError:
+                continue
+            part = Partition(name, dev)
+            part.major, part.minor = parse_maj_min(maj_min)
+            part.holder_names = holder_names
+            dev.partitions.append(part)
+
+        for dev in devices.values():
+            dev.partitions.sort(key=lambda part: Device._sortable_smart_for(part.name))
+        return list(devices.values())
+
     @property
     def name_parts(self):
         return Device.name_parts_for(self.name)
@@ -54,9 +345,12 @@ class Device(Entity):
 
     @staticmethod
     def name_parts_for(name):
-        #XXX
-        #if name.startswith('dm-'):
-        #    return name
+        """`name` split at kernel device prefixes, letters and numbers, e.g. 'sdab12' ->
+        ('sd', 'ab', 12); memoized since every sort asks again"""
+        try:
+            return Device._name_parts_cache[name]
+        except KeyError:
+            pass
 
         def to_int_maybe(p):
             try:
@@ -64,16 +358,21 @@ class Device(Entity):
             except ValueError:
                 return p
 
-        # https://www.kernel.org/doc/Documentation/devices.txt
-        tup = tuple(to_int_maybe(part) for part in re.findall(r'(?:^(?:dm-|zd|ram|fd|hd|loop|sd|n?st|md|scd|n?tpqic|xd|sonycd|gscd|optcd|sjcd|c?double|hitcd|sg|mfm|hd|mcd|cdu535|sbpcd|qft|nqft|zqft|nzqft|rawqft|nrawqft|ad|aztcd|cm205cd|r?rom|r?flash|cm206cd|slram|n?ht|z2ram|nb|ft|pd|pcd|pf|r?pda|sch|mtdr?|ppdd|nft|dasd|n?pt|inft|pg|ubd|jsfd|nnpfs|ub|xvd|n?osst|rfd|ssfdc|blockrom|osd)|^[a-z]-?|[a-z]+|\d+)', name))
+        tup = tuple(to_int_maybe(part) for part in NAME_PARTS.findall(name))
         assert ''.join(str(part) for part in tup) == name
+        Device._name_parts_cache[name] = tup
         return tup
 
     @staticmethod
     def _sortable_smart_for(name):
+        try:
+            return Device._sortable_smart_cache[name]
+        except KeyError:
+            pass
         tup = list(Device.name_parts_for(name))
-        if isinstance(tup[1], str):
+        if len(tup) > 1 and isinstance(tup[1], str):
             tup[1] = Device.device_letters_to_int(tup[1])
+        tup = Device._sortable_smart_cache[name] = tuple(tup)
         return tup
 
     @staticmethod
@@ -87,6 +386,8 @@ class Device(Entity):
         return num - 1
 
 class Partition(Entity):
+    __slots__ = ('device',)
+
     def __init__(self, name, device):
         super().__init__(name)
         self.device = device
@@ -94,64 +395,203 @@ class Partition(Entity):
     @staticmethod
     def from_sysfs(name, device):
         part = Partition(name, device)
-        path = os.path.join('/sys', 'block', device.name, part.name)
+        path = os.path.join(SYSFS, 'block', device.name, part.name)
         entries = os.listdir(path)
         for entry in entries:
             if entry == 'holders':
-                part.holder_names = os.listdir(os.path.join('/sys', 'block',
-                                                            device.name, part.name, 'holders'))
+                part.holder_names = os.listdir(os.path.join(path, 'holders'))
             elif entry == 'dev':
                 part.major, part.minor = parse_maj_min(read_sysfs(path, entry))
         return part
 
+class Probe(object):
+    """The fields of an entity a --where can be decided on while walking /sys/block, before
+    lsblk or anything else has run (see query.PUSHDOWN_FIELDS). Each is read on first use.
+    """
+    def __init__(self, entity, parent=None):
+        self.entity = entity
+        self.parent = parent
+        self.values = {}
+
+    def __getitem__(self, key):
+        try:
+            return self.values[key]
+        except KeyError:
+            value = self.values[key] = self.read(key)
+            return value
+
+    def read(self, key):
+        from . import native
+
+        if self.parent is None:
+            path = device_path = os.path.join(SYSFS, 'block', self.entity.name)
+        else:
+            path = os.path.join(SYSFS, 'block', self.parent.name, self.entity.name)
+            device_path = os.path.join(SYSFS, 'block', self.parent.name)
+
+        if key == 'KNAME':
+            return self.entity.name
+        elif key == 'NAME':
+            return native.read_attribute(path, os.path.join('dm', 'name')) or self.entity.name
+        elif key == 'TYPE':
+            return native.entity_type(self.entity, path, self.parent)
+        elif key == 'TRAN':
+            return native.hctl_and_transport(device_path)[1] if self.parent is None else ''
+        raise KeyError(key)
+
 class Host(object):
     def __init__(self):
         self.devices = None
         self.partitions = None
         self.missing_from_lsblk = None
+        self.skipped = []  # (collector, reason) for collectors that didn't finish
+        self.pruned = set()  # entities --where ruled out while walking sysfs
+        self.zpool_states = {}  # pool -> state, from `zpool status` or /proc/spl/kstat/zfs
+        self.zpool_io = {}  # pool -> {counter: value}, from /proc/spl/kstat/zfs (see zpool.kstat)
+        self.identities = {}  # any name an entity goes by -> entity, or None if it's ambiguous
+        self.holders = None  # holders.HolderGraph, built on first use
 
         # True = success, False = need sudoers
         # None = not attempted, Exception = something else
         ##self.zpool_status_result = None
 
     def entity(self, name):
-        if name in self.devices:
-            return self.devices[name]
-        elif name in self.partitions:
-            return self.partitions[name]
-        else:
-            raise KeyError()
+        """the device or partition known as `name`: its kernel name, device-mapper name, any
+        /dev/disk/by-* link, WWN, serial number, PARTUUID or ZFS vdev GUID"""
+        entity = self.identities.get(name)
+        if entity is None:
+            raise KeyError(name)
+        return entity
 
-    def devices_smart_order(self):
-        todo = set(self.devices.keys())
+    def identify(self, entity, names):
+        """make `entity` known by each of `names` too. A name two entities claim belongs to
+        neither (e.g. the WWN of a multipathed drive), unless it's one's kernel name."""
+        identities = self.identities
+        for name in names:
+            if not name:
+                continue
+            known = identities.get(name, entity)
+            if known is entity:
+                identities[name] = entity
+            elif known is not None and known.name != name:
+                identities[name] = None
 
-        held_by = collections.defaultdict(list)
-        for device in sorted(self.devices.values(), key=operator.attrgetter('_sortable_smart')):
-            for holder_name in device.holder_names:
-                held_by[holder_name].append(device.name)
-                todo.discard(holder_name)
-                todo.discard(device.name) # only remove if this device has holders
+    def identify_lsblk(self, entity):
+        lsblk = entity.lsblk
+        if isinstance(entity, Device):
+            # (partitions inherit their drive's)
+            self.identify(entity, (lsblk.get('NAME'), lsblk.get('WWN'), lsblk.get('SERIAL')))
+        else:
+            self.identify(entity, (lsblk.get('NAME'), lsblk.get('PARTUUID')))
+
+    def reindex(self):
+        """rebuild identities from the entities alone, which remember one link of each kind"""
+        self.identities = {}
+        entities = list(itertools.chain(self.devices.values(), self.partitions.values()))
+        for entity in entities:
+            self.identities[entity.name] = entity
+        for entity in entities:
+            self.identify_lsblk(entity)
+            self.identify(entity, entity.by.values())
 
-        holder_groups = [(tuple(group), holder) for holder, group in held_by.items()]
-        holder_groups.extend(((device_name,), ()) for device_name in todo)
+    def holder_graph(self):
+        """the holders.HolderGraph of this host's devices, which also sets each one's depth"""
+        if self.holders is None:
+            from . import holders
+            self.holders = holders.HolderGraph(self.devices)
+            for name, depth in self.holders.depth.items():
+                self.devices[name].depth = depth
+        return self.holders
 
-        for group, holder_name in sorted(holder_groups, key=lambda elt: Device._sortable_smart_for(elt[0][0])):
-            for name in group:
-                yield self.devices[name]
-            if holder_name:
-                yield self.devices[holder_name]
+    def devices_smart_order(self):
+        """devices in natural order of their names, each stack of holders (md, dm, multipath,
+        ...) right after the devices it's built on"""
+        for name in self.holder_graph().order:
+            yield self.devices[name]
 
     @staticmethod
+    @timing.timed('collect')
     def go(args):
-        host = Host.from_sysfs(args)
-        results = list(Host.from_lsblk(args))
+        import concurrent.futures
+
+        timeouts = dict(COLLECTOR_TIMEOUTS)
+        timeouts.update(args.timeouts)
+        started = time.time()
 
+        def deadline_for(source):
+            if timeouts[source] is None:
+                return None
+            return max(0, started + timeouts[source] - time.time())
+
+        # the udev database entries the native collector and the links both read, each once
+        udev = {}
+
+        # run the collectors concurrently, then punch up the host with whatever finished in time
+        executor = DaemonExecutor(max_workers=len(timeouts))
+        try:
+            sysfs = executor.submit(Host.from_sysfs, args)
+            def collect_lsblk():
+                walked = sysfs.result()
+                if not walked.pruned:
+                    return Host.collect_lsblk(walked, args, timeout=deadline_for('lsblk'), udev=udev)
+                # --where ruled some devices out; only ask about the rest
+                present = sorted(walked.devices)
+                return Host.collect_lsblk(walked, args, timeout=deadline_for('lsblk'),
+                                          devices=present, udev=udev) if present else []
+            def fetch_dev_disk():
+                return Host.fetch_dev_disk(sysfs.result(), args.projection, udev=udev)
+            futures = collections.OrderedDict([
+                ('lsblk', executor.submit(collect_lsblk)),
+                ('dev_disk', executor.submit(fetch_dev_disk)),
+            ])
+            if args.projection is None or args.projection.wants_zpool:
+                from . import zpool
+                futures['zpool'] = executor.submit(zpool.collect, args.zpool_status, timeout=deadline_for('zpool'))
+            if args.iostat is not None:
+                from . import iostat
+                futures['iostat'] = executor.submit(iostat.sample, args.iostat)
+
+            host = sysfs.result(timeout=deadline_for('sysfs'))
+            fetched = {}
+            for source, future in futures.items():
+                try:
+                    fetched[source] = future.result(timeout=deadline_for(source))
+                except (concurrent.futures.TimeoutError, subprocess.TimeoutExpired):
+                    host.skipped.append((source, 'timed out after {}s'.format(timeouts[source])))
+        finally:
+            executor.shutdown(wait=False)
+
+        host._assemble(args, fetched)
+        if args.smart is not None:
+            # keyed by WWN or serial, so it needs lsblk's results
+            from . import smart
+            smart.punch_up(host, args, timeout=deadline_for('smart'))
+        return host
+
+    @timing.timed('assemble')
+    def _assemble(self, args, fetched):
+        """punch up freshly walked devices with `fetched` collector results, and drop the ones
+        lsblk wouldn't show"""
+        host = self
+        results = fetched.get('lsblk')
         sysfs_items = set(host.devices.keys()) | set(host.partitions.keys())
-        lsblk_items = set(result[PRIMARY_KEY] for result in results)
+        if results is None:
+            # no lsblk; don't hide everything as missing from it
+            results = []
+            lsblk_items = sysfs_items
+        else:
+            results = [result for result in results if result[PRIMARY_KEY] not in host.pruned]
+            lsblk_items = set(result[PRIMARY_KEY] for result in results)
 
         host._punch_up_lsblk(results)
-        host._punch_up_dev_disk()
-        host._punch_up_zpool_status()
+        if 'dev_disk' in fetched:
+            host._punch_up_dev_disk([link for link in fetched['dev_disk'] if link[2] not in host.pruned])
+        if 'zpool' in fetched:
+            host._punch_up_zpool(*fetched['zpool'])
+        if 'iostat' in fetched:
+            for name, rates in fetched['iostat'].items():
+                if name in host.devices or name in host.partitions:
+                    host.entity(name).iostat = rates
 
         if args.all_devices:
             excluded = set()
@@ -167,35 +607,194 @@ class Host(object):
         host.devices = {kk: vv for (kk, vv) in host.devices.items() if kk in lsblk_items and kk not in excluded}
         host.partitions = {kk: vv for (kk, vv) in host.partitions.items() if kk in lsblk_items and kk not in excluded}
         host.missing_from_lsblk = sorted(sysfs_items - lsblk_items - excluded, key=Device._sortable_smart_for)
+        host.identities = {name: entity for name, entity in host.identities.items()
+                           if entity is None or entity.name in host.devices or entity.name in host.partitions}
+        host.holders = None
 
-        return host
+    def refresh(self, args, names=None):
+        """Re-collect devices `names` (and their partitions) in place, or everything if None,
+        along with the devices an md/dm among them is built on. Returns the names of entities
+        that were added, removed or changed.
+        """
+        before = set(self.devices) | set(self.partitions)
+        if names is None:
+            fresh = Host.go(args)
+            self.__dict__.update(fresh.__dict__)
+            return before | set(self.devices) | set(self.partitions)
+
+        # a holder coming or going changes its members' holders/ too
+        names = set(names) | self.members_of(names)
+        sub = Host.from_sysfs(args, names=names)
+        present = sorted(sub.devices)
+        def ours(name):
+            return name in sub.devices or name in sub.partitions
+        udev = {}
+        results = Host.collect_lsblk(sub, args, devices=present, udev=udev) if present else []
+        sub._assemble(args, {
+            # `lsblk /dev/X` also lists X's holders, which aren't being refreshed
+            'lsblk': [result for result in results if ours(result[PRIMARY_KEY])],
+            'dev_disk': [link for link in Host.fetch_dev_disk(sub, args.projection, udev=udev) if ours(link[2])],
+        })
+        if args.smart is not None:
+            from . import smart
+            smart.punch_up(sub, args, timeout=COLLECTOR_TIMEOUTS['smart'])
+
+        gone = set(names)
+        for name in names:
+            old = self.devices.get(name)
+            if old is not None:
+                gone.update(part.name for part in old.partitions)
+        changed = gone | set(sub.devices) | set(sub.partitions)
+
+        self.devices = {k: v for k, v in self.devices.items() if k not in gone}
+        self.devices.update(sub.devices)
+        self.partitions = {k: v for k, v in self.partitions.items() if k not in gone}
+        self.partitions.update(sub.partitions)
+        self.missing_from_lsblk = sorted((set(self.missing_from_lsblk) - gone) | set(sub.missing_from_lsblk),
+                                         key=Device._sortable_smart_for)
+        # names that were ambiguous stay so: the other claimants weren't refreshed
+        self.identities = {name: entity for name, entity in self.identities.items()
+                           if entity is None or entity.name not in gone}
+        for entity in itertools.chain(sub.devices.values(), sub.partitions.values()):
+            self.identities[entity.name] = entity
+        for name, entity in sub.identities.items():
+            if entity is not None:
+                self.identify(entity, (name,))
+            elif self.identities.get(name) is None or self.identities[name].name != name:
+                self.identities[name] = None
+        self.holders = None
+        changed |= self.refresh_zpool_status(args.zpool_status)
+        return changed
+
+    def members_of(self, names):
+        """the devices that holders `names` are built on, now (by their slaves/) or as last seen"""
+        members = set()
+        for name in names:
+            try:
+                members.update(os.listdir(os.path.join(SYSFS, 'block', name, 'slaves')))
+            except OSError:
+                pass
+        members.update(entity.name for entity in itertools.chain(self.devices.values(), self.partitions.values())
+                       if entity.holder_names and not set(entity.holder_names).isdisjoint(names))
+        # a partition is re-walked with its device
+        return set(self.partitions[name].device.name if name in self.partitions else name for name in members)
+
+    def refresh_zpool_status(self, mode='auto'):
+        """re-read the pools as zpool.collect does for `mode`; returns the names of entities
+        whose zpath, state or error counts changed"""
+        from . import zpool
+
+        if not hasattr(self, 'zpool_status_result'):
+            # the view never wanted them
+            return set()
+        if self.zpool_status_result not in (True, None):
+            # `zpool status` didn't work the first time; don't nag again
+            mode = 'never'
+        entities = list(itertools.chain(self.devices.values(), self.partitions.values()))
+        old = {ent.name: (ent.zpath, ent.zfs) for ent in entities}
+        for ent in entities:
+            ent.zpath, ent.zfs = None, {}
+        self.zpool_states = {}
+        self._punch_up_zpool(*zpool.collect(mode, timeout=COLLECTOR_TIMEOUTS['zpool']))
+        return set(ent.name for ent in entities if (ent.zpath, ent.zfs) != old[ent.name])
 
     @staticmethod
-    def from_sysfs(args):
+    @timing.timed('sysfs')
+    def from_sysfs(args, names=None):
+        """every block device in sysfs, or just the devices `names` that still exist"""
         host = Host()
         host.devices = {}
         host.partitions = {}
 
-        for dev_name in os.listdir(os.path.join('/sys', 'block')):
-            dev = Device.from_sysfs(dev_name)
+        query = args.query if args.query is not None and args.query.pushable and args.pushdown else None
+
+        devices = Device.all_from_sysfs(names)
+        if devices is None:
+            dev_names = os.listdir(os.path.join(SYSFS, 'block'))
+            if names is not None:
+                dev_names = set(dev_names) & set(names)
+            devices = (Device.from_sysfs(dev_name) for dev_name in dev_names)
+        for dev in devices:
+            if query is not None:
+                # leave out whatever --where rules out already; keep a device whose
+                # partitions might match, for context
+                partitions = [part for part in dev.partitions if query.decide(Probe(part, dev)) is not False]
+                host.pruned.update(part.name for part in dev.partitions if part not in partitions)
+                dev.partitions = partitions
+                if not partitions and query.decide(Probe(dev)) is False:
+                    host.pruned.add(dev.name)
+                    continue
             host.devices[dev.name] = dev
+            host.identities[dev.name] = dev
 
             for part in dev.partitions:
                 host.partitions[part.name] = part
+                host.identities[part.name] = part
 
         return host
 
     @staticmethod
-    def from_lsblk(args):
-        cmd = ['lsblk']
+    @timing.timed('lsblk')
+    def collect_lsblk(host, args, timeout=None, devices=None, udev=None):
+        """lsblk records for every entity, from the native collector or `lsblk` itself; `udev`
+        is as for native.udev_entry"""
+        from . import native
+
+        collector = args.collector
+        if collector == 'auto':
+            # without the udev database there's no FSTYPE, UUID, etc.; let lsblk sort it out.
+            # same goes for columns only lsblk can fill in, like FSUSE%
+            columns = LSBLK_COLUMNS if args.projection is None else args.projection.lsblk_columns()
+            if os.path.isdir(UDEV_DATA) and set(columns) <= set(native.COLUMNS):
+                collector = 'native'
+            else:
+                collector = 'lsblk'
+
+        if collector == 'native':
+            try:
+                return list(native.Collector(args, udev=udev).records(host))
+            except (IOError, OSError) as ex:
+                print("warning: native collector failed ({}), falling back to lsblk".format(ex))
+                return list(Host.from_lsblk(args, timeout=timeout, devices=devices))
+
+        results = list(Host.from_lsblk(args, timeout=timeout, devices=devices))
+        if collector == 'check':
+            native_results = list(native.Collector(args, udev=udev).records(host))
+            for name, key, mine, theirs in native.cross_check(native_results, results):
+                if key is None and mine is None:
+                    print("warning: native collector has no record for '{}'".format(name))
+                elif key is None:
+                    print("warning: native collector has a record for '{}', lsblk doesn't".format(name))
+                else:
+                    print("warning: native collector disagrees with lsblk for '{}': "
+                          "{} = '{}', lsblk says '{}'".format(name, key, mine, theirs))
+        return results
+
+    @staticmethod
+    def from_lsblk(args, timeout=None, devices=None):
+        cmd = list(LSBLK)
         if args.all_devices:
             cmd.append('--all')
-        cmd.extend(['-P', '-O', '-b'])
-        out = subprocess.check_output(cmd)
+        cmd.extend(['-P', '-b'])
+        if args.projection is None:
+            cmd.append('-O')
+        else:
+            cmd.extend(['-o', ','.join(args.projection.lsblk_columns())])
+        if devices:
+            cmd.extend(os.path.join(DEV, name) for name in devices)
+        try:
+            out = run_command(cmd, timeout=timeout)
+        except subprocess.CalledProcessError:
+            if args.projection is None:
+                raise
+            # an older lsblk that doesn't know some column; ask for everything instead
+            cmd[cmd.index('-o'):cmd.index('-o') + 2] = ['-O']
+            out = run_command(cmd, timeout=timeout)
 
         for l in out.decode(CLI_UTILS_ENCODING).splitlines():
-            yield {k: v for k, v in re.findall(r'(.*?)="(.*?)" ?', l)}
+            yield Record(re.findall(r'(.*?)="(.*?)" ?', l))
 
+    @timing.timed('punch_up_lsblk')
     def _punch_up_lsblk(self, results):
         for entry in results:
             name = entry[PRIMARY_KEY]
@@ -209,63 +808,197 @@ class Host(object):
             entity.lsblk = entry
             assert '{}:{}'.format(entity.major, entity.minor) == entity.lsblk['MAJ:MIN']
             assert entity.name == entity.lsblk[PRIMARY_KEY]
+            self.identify_lsblk(entity)
 
-    def _punch_up_dev_disk(self):
-        for kind in os.listdir(os.path.join('/dev', 'disk')):
-            path = os.path.join('/dev', 'disk', kind)
-            for entry in os.listdir(path):
-                entity_name = os.path.basename(os.readlink(os.path.join(path, entry)))
+    @staticmethod
+    @timing.timed('dev_disk')
+    def fetch_dev_disk(host, projection=None, udev=None):
+        """(kind, entry, target name) for every link under /dev/disk/by-* to an entity of `host`
+        that `projection` wants, and (ZFS_GUID, guid, name) for ZFS members. They come from the
+        udev database, one file per entity (`udev` is as for native.udev_entry); without a
+        database, from the links themselves."""
+        from . import native
 
-                try:
-                    entity = self.entity(entity_name)
-                except KeyError:
-                    raise RuntimeError("device '{}' (linked from /dev/disk/{}/{}) "
-                                       "not in /sys/block/*/*".format(name, kind, entry))
-
-                if kind == 'by-partuuid':
-                    assert entity.lsblk['PARTUUID'] == entry
-                elif kind == 'by-uuid':
-                    if 'UUID' in entity.lsblk:
-                        assert entity.lsblk['UUID'] == entry
-                    else:
-                        print("warning: incomplete lsblk for {}: {}".format(entity.name, entity.lsblk))
-                else:
-                    assert kind.startswith('by-')
-                    entity.by[kind[3:]] = entry
+        if not os.path.isdir(UDEV_DATA):
+            return Host.read_dev_disk_links(projection)
+        links = []
+        wants_guid = projection is None or projection.wants_zpool
+        for entity in itertools.chain(host.devices.values(), host.partitions.values()):
+            props, devlinks = native.udev_entry(entity, udev)
+            for devlink in devlinks:
+                top, _, link = devlink.partition('/')
+                kind, _, entry = link.partition('/')
+                if top == 'disk' and entry and (projection is None or projection.wants_link_kind(kind)):
+                    links.append((kind, entry, entity.name))
+            if wants_guid and props.get('ID_FS_TYPE') == 'zfs_member' and props.get('ID_FS_UUID_SUB'):
+                links.append((ZFS_GUID, props['ID_FS_UUID_SUB'], entity.name))
+        return links
 
-    def _punch_up_zpool_status(self):
-        # punch up with zpool status, if we can get it without prompting for a password
-        try:
-            zpool_status = subprocess.check_output(['sudo', '-n', 'zpool', 'status'],
-                                                   stderr=subprocess.STDOUT)
-        except subprocess.CalledProcessError as ex:
-            if ex.returncode == 1:
+    @staticmethod
+    def read_dev_disk_links(projection=None):
+        """fetch_dev_disk by listing /dev/disk/by-* and reading every link"""
+        links = []
+        root = os.path.join(DEV, 'disk')
+        if not os.path.isdir(root):
+            return links
+        for kind in os.listdir(root):
+            if projection is not None and not projection.wants_link_kind(kind):
+                continue
+            path = os.path.join(root, kind)
+            entries = os.listdir(path)
+            for entry in entries:
+                links.append((kind, entry, os.path.basename(os.readlink(os.path.join(path, entry)))))
+            timing.count('dev_disk_links_read', len(entries))
+        return links
+
+    @timing.timed('punch_up_dev_disk')
+    def _punch_up_dev_disk(self, links):
+        for kind, entry, entity_name in links:
+            try:
+                entity = self.entity(entity_name)
+            except KeyError:
+                # e.g. a link left behind by a device that's gone
+                print("warning: device '{}' (linked from /dev/disk/{}/{}) "
+                      "not in /sys/block/*/*".format(entity_name, kind, entry))
+                continue
+
+            self.identify(entity, (entry,))
+            if kind == ZFS_GUID:
+                continue
+            elif kind == 'by-partuuid':
+                # (lsblk may have been skipped or not asked for PARTUUID)
+                assert entity.lsblk.get('PARTUUID', entry) == entry
+            elif kind == 'by-uuid':
+                if 'UUID' in entity.lsblk:
+                    assert entity.lsblk['UUID'] == entry
+                elif entity.lsblk:
+                    print("warning: incomplete lsblk for {}: {}".format(entity.name, entity.lsblk))
+            else:
+                assert kind.startswith('by-')
+                entity.by[sys.intern(kind[3:])] = entry
+
+    def _punch_up_zpool(self, kstats, pools):
+        """punch up with zpool.collect's kstats and pools; members get just their pool, from
+        their ZFS labels, when `zpool status` wasn't run or didn't work"""
+        if kstats is not None:
+            self.zpool_states.update((pool, state) for pool, (state, _) in kstats.items() if state)
+            self.zpool_io = {pool: io for pool, (_, io) in kstats.items() if io}
+        if pools is not None:
+            self._punch_up_zpool_status(pools, labels=bool(kstats))
+        elif not hasattr(self, 'zpool_status_result'):
+            self.zpool_status_result = None
+        if self.zpool_status_result is not True and kstats:
+            self._punch_up_zpool_labels(kstats)
+
+    def _punch_up_zpool_labels(self, pools):
+        """zpath for the devices and partitions whose ZFS label (from blkid, via lsblk or udev)
+        names one of the imported `pools`; the label doesn't say which vdev"""
+        for ent in itertools.chain(self.devices.values(), self.partitions.values()):
+            if ent.lsblk.get('FSTYPE') == 'zfs_member' and ent.lsblk.get('LABEL') in pools:
+                ent.zpath = ent.lsblk['LABEL']
+
+    @timing.timed('punch_up_zpool_status')
+    def _punch_up_zpool_status(self, pools, labels=False):
+        """punch up with zpool.fetch's pools, or its exception; `labels` if the members will
+        get their pools from their labels anyway"""
+        from . import zpool
+
+        if isinstance(pools, Exception):
+            ex = pools
+            if isinstance(ex, subprocess.CalledProcessError) and ex.returncode == 1 and labels:
+                self.zpool_status_result = False
+                print("note: `zpool status` needs sudoers (see README), so no vdevs or error counts; "
+                      "--zpool-status never skips it")
+            elif isinstance(ex, subprocess.CalledProcessError) and ex.returncode == 1:
                 # xxx check if zpool is even installed
                 self.zpool_status_result = False
                 print("\nWARNING: couldn't get zpool status non-interactively:")
                 print(ex.output)
                 print("\nconsider adding this to sudoers:\n")
                 print("    {} ALL=NOPASSWD: /sbin/zpool status\n".format(os.environ['USER']))
+                print("or pass --zpool-status never to make do with pool names and states\n")
             else:
                 self.zpool_status_result = ex
             return
 
-        zpaths = parse_zpool_status(zpool_status)
-        if all(v.endswith('-0') for v in zpaths.values()):
-            # trim off the -0
-            zpaths = {k: v[0:-2] for k, v in zpaths.items()}
+        self.zpool_states.update((pool.name, pool.state) for pool in pools)
 
-        for dev in self.devices.values():
-            vdev = dev.by.get('vdev')
-            idd = dev.by.get('id')
-            if vdev and vdev in zpaths:
-                dev.zpath = zpaths[vdev]
-            elif idd and idd in zpaths:
-                dev.zpath = zpaths[idd]
+        # members are named however the pool was created or imported: by-vdev, by-id, by-path
+        # or by-partuuid links, kernel names, or a GUID when ZFS can't open the device
+        for member, (zpath, values) in zpool.members(pools).items():
+            entity = self.identities.get(member)
+            if entity is not None:
+                entity.zpath, entity.zfs = zpath, values
 
         self.zpool_status_result = True
 
 
+class DaemonExecutor(object):
+    """Enough of concurrent.futures.ThreadPoolExecutor (submit, shutdown) for the collectors,
+    on daemon threads. The interpreter joins ThreadPoolExecutor's threads at exit, so a read
+    stuck past its collector's deadline would hold the process up anyway; these it leaves
+    behind. Work still queued at shutdown is never started.
+    """
+    def __init__(self, max_workers):
+        import queue
+        self.max_workers = max_workers
+        self.queue = queue.Queue()
+        self.threads = []
+
+    def submit(self, fn, *args, **kwargs):
+        import concurrent.futures
+        future = concurrent.futures.Future()
+        self.queue.put((future, fn, args, kwargs))
+        if len(self.threads) < self.max_workers:
+            thread = threading.Thread(target=self.work, name='collector')
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+        return future
+
+    def work(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            future, fn, args, kwargs = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException as ex:
+                future.set_exception(ex)
+            else:
+                future.set_result(result)
+
+    def shutdown(self, wait=False):
+        import queue
+        while True:
+            try:
+                future, _, _, _ = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            future.cancel()
+        for _ in self.threads:
+            self.queue.put(None)
+        if wait:
+            for thread in self.threads:
+                thread.join()
+
+def run_command(cmd, timeout=None, **kwargs):
+    """check_output, killing the command if it runs past `timeout` seconds"""
+    started = time.time()
+    returncode = None
+    try:
+        out = subprocess.check_output(cmd, timeout=timeout, **kwargs)
+        returncode = 0
+        return out
+    except subprocess.CalledProcessError as ex:
+        returncode = ex.returncode
+        raise
+    finally:
+        timing.command(cmd, time.time() - started, returncode)
+
 def parse_maj_min(s):
     m = re.match(r'(\d*):(\d*)', s)
     assert m
@@ -274,9 +1007,10 @@ def parse_maj_min(s):
 def is_partition_dirent(device_name, entry):
     if not entry.startswith(device_name):
         return False
-    return os.path.exists(os.path.join('/sys', 'block', device_name, entry, 'start'))
+    return os.path.exists(os.path.join(SYSFS, 'block', device_name, entry, 'start'))
 
 def read_sysfs(path, filename):
+    timing.count('sysfs_files_read')
     with open(os.path.join(path, filename), 'r') as f:
         data = f.read()
     try:
@@ -284,37 +1018,17 @@ def read_sysfs(path, filename):
     except ValueError:
         return data
 
-def parse_zpool_status(status):
-    config = False
+def parse_zpool_status(status, pool_states=None, device_states=None):
+    """member device -> 'pool.vdev' from `zpool status`; fills in the STATE column for each
+    pool and member device in `pool_states` and `device_states` if given (see zpool.parse)"""
+    from . import zpool
+
+    pools = list(zpool.parse(status.decode(CLI_UTILS_ENCODING).splitlines()))
+    if pool_states is not None:
+        pool_states.update((pool.name, pool.state) for pool in pools)
     rv = {}
-    for l in status.decode(CLI_UTILS_ENCODING).splitlines():
-        if config:
-            if l == '':
-                config = False
-                continue
-            #
-            l = l.lstrip('\t')
-            pos = len(l) - len(l.lstrip(' '))
-            assert pos % 2 == 0
-            pos //= 2
-            part = l.lstrip(' ').split()[0]
-            if part == 'spares' or (len(path) > 1 and path[1] == 'spares'):
-                pos += 1
-            path = path[0:pos]
-            path.append(None)
-            path[pos] = part
-
-            #
-            if len(path) == 3:
-                if (path[2] in rv and
-                    rv[path[2]].endswith('spares')):
-                    rv[path[2]] = '*.spares'
-                else:
-                    assert path[2] not in rv
-                    rv[path[2]] = path[0] + '.' + path[1]
-        else:
-            if re.match(r'\s*NAME\s*STATE\s*READ\s*WRITE\s*CKSUM', l):
-                config = True
-                path = []
-            continue
+    for member, (zpath, values) in zpool.members(pools).items():
+        rv[member] = zpath
+        if device_states is not None and 'zstate' in values:
+            device_states[member] = values['zstate']
     return rv
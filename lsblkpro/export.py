@@ -0,0 +1,172 @@
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+from builtins import *
+
+import os
+import sys
+import time
+
+from . import data
+
+FORMATS = ('prometheus',)
+
+# what the export reads, so the collectors can skip the rest (see data.Projection)
+FIELDS = ('NAME', 'KNAME', 'TYPE', 'PKNAME', 'SIZE', 'MOUNTPOINT', 'FSTYPE', 'MODEL', 'SERIAL', 'WWN',
+          'vdev', 'zpath')
+
+# (metric, help) in the order they're written
+FAMILIES = (
+    ('lsblkpro_device_info', "Block devices and partitions and what they're used for; always 1."),
+    ('lsblkpro_device_size_bytes', "Capacity of the device or partition."),
+    ('lsblkpro_device_holder', "1 for each device (holder) built on top of another (device), e.g. md or dm."),
+    ('lsblkpro_zpool_state', "1 for each zpool, labelled with its state."),
+    ('lsblkpro_zpool_read_bytes', "Bytes read from the pool since it was imported, from /proc/spl/kstat/zfs."),
+    ('lsblkpro_zpool_written_bytes', "Bytes written to the pool since it was imported, from /proc/spl/kstat/zfs."),
+    ('lsblkpro_zpool_reads', "Reads from the pool since it was imported, from /proc/spl/kstat/zfs."),
+    ('lsblkpro_zpool_writes', "Writes to the pool since it was imported, from /proc/spl/kstat/zfs."),
+    ('lsblkpro_zpool_member', "1 for each device in a zpool, labelled with its vdev and state."),
+    ('lsblkpro_zpool_member_errors', "Read, write and checksum errors zpool status counts for the device."),
+    ('lsblkpro_reads_per_second', "Reads completed per second over the --iostat interval."),
+    ('lsblkpro_writes_per_second', "Writes completed per second over the --iostat interval."),
+    ('lsblkpro_read_bytes_per_second', "Bytes read per second over the --iostat interval."),
+    ('lsblkpro_written_bytes_per_second', "Bytes written per second over the --iostat interval."),
+    ('lsblkpro_io_await_seconds', "Average time a request took, queueing included, over the --iostat interval."),
+    ('lsblkpro_io_utilization_ratio', "Fraction of the --iostat interval the device was busy."),
+    ('lsblkpro_smart_temperature_celsius', "Drive temperature, from SMART."),
+    ('lsblkpro_smart_reallocated_sectors', "Reallocated sectors (ATA) or grown defects (SCSI), from SMART."),
+    ('lsblkpro_smart_power_on_hours', "Hours the drive has been powered on, from SMART."),
+    ('lsblkpro_smart_healthy', "1 if the drive's SMART self-assessment passed, 0 if it failed."),
+    ('lsblkpro_collector_skipped', "1 for each collector that didn't finish, so the rest are incomplete."),
+    ('lsblkpro_export_timestamp_seconds', "When this was written."),
+)
+
+# Entity.iostat and Entity.smart columns -> (metric, factor to base units)
+ENTITY_STATS = (
+    ('iostat', 'r/s', 'lsblkpro_reads_per_second', 1),
+    ('iostat', 'w/s', 'lsblkpro_writes_per_second', 1),
+    ('iostat', 'rMB/s', 'lsblkpro_read_bytes_per_second', 1024 * 1024),
+    ('iostat', 'wMB/s', 'lsblkpro_written_bytes_per_second', 1024 * 1024),
+    ('iostat', 'await', 'lsblkpro_io_await_seconds', 0.001),
+    ('iostat', 'util', 'lsblkpro_io_utilization_ratio', 0.01),
+    ('smart', 'temp', 'lsblkpro_smart_temperature_celsius', 1),
+    ('smart', 'realloc', 'lsblkpro_smart_reallocated_sectors', 1),
+    ('smart', 'hours', 'lsblkpro_smart_power_on_hours', 1),
+)
+
+SMART_HEALTH = {'PASSED': 1, 'FAILED': 0}
+
+# zpool.KSTAT_IO counters -> metric
+ZPOOL_IO = (
+    ('nread', 'lsblkpro_zpool_read_bytes'),
+    ('nwritten', 'lsblkpro_zpool_written_bytes'),
+    ('reads', 'lsblkpro_zpool_reads'),
+    ('writes', 'lsblkpro_zpool_writes'),
+)
+
+# zpool.COLUMNS error counts -> the type label; counts are exact with `zpool status -p`
+ZPOOL_ERRORS = (('zread', 'read'), ('zwrite', 'write'), ('zcksum', 'cksum'))
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def sample(metric, labels, value):
+    return '{}{{{}}} {}'.format(metric, ','.join('{}="{}"'.format(key, escape(labels[key]))
+                                                 for key in sorted(labels)), value)
+
+def hosts_of(host):
+    """(hostname, Host) for a fleet's hosts, or (None, host) for this one"""
+    return getattr(host, 'hosts', [(None, host)])
+
+def entities_of(host):
+    for device in host.devices_smart_order():
+        yield device
+        for part in device.partitions:
+            yield part
+
+def samples(host, now=None):
+    """metric -> [line] for everything known about `host` (a Host or a fleet.Fleet)"""
+    lines = {metric: [] for metric, _ in FAMILIES}
+    for hostname, one in hosts_of(host):
+        base = {'host': hostname} if hostname else {}
+
+        for pool, state in sorted(one.zpool_states.items()):
+            lines['lsblkpro_zpool_state'].append(sample('lsblkpro_zpool_state', dict(base, pool=pool, state=state), 1))
+        for pool, counters in sorted(one.zpool_io.items()):
+            for key, metric in ZPOOL_IO:
+                if key in counters:
+                    lines[metric].append(sample(metric, dict(base, pool=pool), counters[key]))
+
+        for ent in entities_of(one):
+            device = dict(base, device=ent.name)
+            lsblk = ent.lsblk
+            pool, _, vdev = (ent.zpath or '').partition('.')
+            lines['lsblkpro_device_info'].append(sample('lsblkpro_device_info', dict(
+                device,
+                name=lsblk.get('NAME', ent.name),
+                type=lsblk.get('TYPE', ''),
+                parent=ent.device.name if isinstance(ent, data.Partition) else '',
+                vdev=ent.by.get('vdev', ''),
+                zpool=pool,
+                mountpoint=lsblk.get('MOUNTPOINT', ''),
+                fstype=lsblk.get('FSTYPE', ''),
+                model=lsblk.get('MODEL', ''),
+                serial=lsblk.get('SERIAL', ''),
+                wwn=lsblk.get('WWN', ''),
+            ), 1))
+            if lsblk.get('SIZE'):
+                lines['lsblkpro_device_size_bytes'].append(sample('lsblkpro_device_size_bytes', device, lsblk['SIZE']))
+            for holder in ent.holder_names or ():
+                lines['lsblkpro_device_holder'].append(sample('lsblkpro_device_holder', dict(device, holder=holder), 1))
+            if ent.zpath:
+                lines['lsblkpro_zpool_member'].append(sample('lsblkpro_zpool_member', dict(
+                    device, pool=pool, vdev=vdev, state=ent.zfs.get('zstate', '')), 1))
+                for key, kind in ZPOOL_ERRORS:
+                    if ent.zfs.get(key, '').isdigit():
+                        lines['lsblkpro_zpool_member_errors'].append(sample(
+                            'lsblkpro_zpool_member_errors', dict(device, pool=pool, type=kind), ent.zfs[key]))
+
+            for source, key, metric, factor in ENTITY_STATS:
+                value = getattr(ent, source).get(key)
+                if value:
+                    lines[metric].append(sample(metric, device, float(value) * factor))
+            if ent.smart.get('smart') in SMART_HEALTH:
+                lines['lsblkpro_smart_healthy'].append(sample('lsblkpro_smart_healthy', device,
+                                                             SMART_HEALTH[ent.smart['smart']]))
+
+    for source, reason in host.skipped:
+        lines['lsblkpro_collector_skipped'].append(sample('lsblkpro_collector_skipped', {'source': source}, 1))
+    lines['lsblkpro_export_timestamp_seconds'].append('lsblkpro_export_timestamp_seconds {}'.format(
+        now if now is not None else time.time()))
+    return lines
+
+def prometheus(host):
+    """`host` in the Prometheus text exposition format"""
+    lines = samples(host)
+    out = []
+    for metric, help in FAMILIES:
+        if lines[metric]:
+            out.append('# HELP {} {}'.format(metric, help))
+            out.append('# TYPE {} gauge'.format(metric))
+            out.extend(lines[metric])
+    return '\n'.join(out) + '\n'
+
+def write(host, fmt, path):
+    """write `host` in format `fmt` to `path` ('-' for stdout) atomically, so a collector
+    reading the directory (e.g. node_exporter's textfile collector) never sees half of it"""
+    import tempfile
+    text = {'prometheus': prometheus}[fmt](host)
+    if path == '-':
+        sys.stdout.write(text)
+        sys.stdout.flush()
+        return
+
+    # a name the collector ignores until it's renamed (node_exporter only reads *.prom)
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.lsblkpro-export-')
+    try:
+        os.fchmod(fd, 0o644)
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+        os.rename(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
@@ -0,0 +1,77 @@
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+from builtins import *
+
+import os
+
+from . import sorting
+from . import snapshot
+from . import timing
+
+class Fleet(object):
+    """Snapshots of many hosts, shown as one table: each host's devices in its usual order,
+    hosts in natural order of their names. Every entity knows its host (Entity.host), which
+    is the table's 'host' column.
+    """
+    def __init__(self, hosts, skipped=None):
+        self.hosts = sorted(hosts, key=lambda pair: sorting.natural_key(pair[0]))  # (hostname, Host)
+        self.skipped = list(skipped or [])
+        self.missing_from_lsblk = []
+        for hostname, host in self.hosts:
+            self.skipped.extend(('{}: {}'.format(hostname, source), reason) for source, reason in host.skipped)
+            self.missing_from_lsblk.extend('{}:{}'.format(hostname, name) for name in host.missing_from_lsblk)
+
+    def devices_smart_order(self):
+        for _, host in self.hosts:
+            for device in host.devices_smart_order():
+                yield device
+
+def snapshot_paths(directory):
+    """every snapshot in `directory`, leaving out the temporary files of ones being written"""
+    try:
+        names = os.listdir(directory)
+    except OSError as ex:
+        raise snapshot.SnapshotError("can't read fleet directory '{}': {}".format(directory, ex.strerror))
+    paths = (os.path.join(directory, name) for name in names if not name.startswith('.'))
+    return sorted(path for path in paths if os.path.isfile(path))
+
+def load_one(path):
+    """(path, hostname, Host), or (path, None, reason) if it isn't a snapshot we can read;
+    runs in a worker process"""
+    try:
+        obj = snapshot.read(path)
+    except snapshot.SnapshotError as ex:
+        return path, None, str(ex)
+    hostname = obj.get('hostname') or os.path.basename(path)
+    host = snapshot.decode_host(obj['host'])
+    for ent in snapshot.entities_of(host):
+        ent.host = hostname
+    return path, hostname, host
+
+@timing.timed('fleet')
+def load(directory, workers=None):
+    """a Fleet of every snapshot in `directory`, read and decoded in parallel; unreadable
+    ones are reported as skipped"""
+    import concurrent.futures
+
+    paths = snapshot_paths(directory)
+    if not paths:
+        raise snapshot.SnapshotError("no snapshots in fleet directory '{}'".format(directory))
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(paths) == 1:
+        loaded = [load_one(path) for path in paths]
+    else:
+        # a few chunks per worker: big enough to amortize the round trips, small enough to
+        # even out hosts of different sizes
+        chunksize = max(1, len(paths) // (workers * 4))
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            loaded = list(executor.map(load_one, paths, chunksize=chunksize))
+
+    hosts, skipped = [], []
+    for path, hostname, host in loaded:
+        if hostname is None:
+            skipped.append((os.path.basename(path), host))
+        else:
+            hosts.append((hostname, host))
+    timing.count('fleet_snapshots_read', len(hosts))
+    return Fleet(hosts, skipped)
@@ -0,0 +1,84 @@
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+from builtins import *
+
+import collections
+
+from . import data
+
+class HolderGraph(object):
+    """Which devices are built on which (md arrays, device-mapper volumes, multipath maps,
+    ...), from the holders/ directories sysfs lists for each device and its partitions: a DAG
+    from member devices up to the holders built on them, possibly several levels deep, e.g.
+    multipath legs -> dm-crypt -> LVM. Built once per Host (see Host.holder_graph).
+
+    `order` puts each stack right after the devices at the bottom of it, every holder after
+    all of its members; `depth` is how many levels of holders a device sits on (0 for one
+    built on nothing).
+    """
+    def __init__(self, devices):
+        key = data.Device._sortable_smart_for
+
+        self.holders = {}  # device name -> names of the devices holding it or its partitions
+        self.members = collections.defaultdict(list)  # holder name -> names of its members
+        for dev in devices.values():
+            names = set(dev.holder_names or ())
+            for part in dev.partitions or ():
+                names.update(part.holder_names or ())
+            names.discard(dev.name)
+            self.holders[dev.name] = sorted((name for name in names if name in devices), key=key)
+            for name in self.holders[dev.name]:
+                self.members[name].append(dev.name)
+
+        # bottom up: depth, and the lowest-sorting device each stack stands on, which is
+        # where the stack goes among the rest
+        self.depth = {}
+        lowest = {}
+        waiting = {name: len(self.members.get(name, ())) for name in devices}
+        ready = [name for name, count in waiting.items() if count == 0]
+        while ready:
+            name = ready.pop()
+            members = self.members.get(name)
+            if members:
+                self.depth[name] = 1 + max(self.depth[member] for member in members)
+                lowest[name] = min(lowest[member] for member in members)
+            else:
+                self.depth[name] = 0
+                lowest[name] = key(name)
+            for holder in self.holders[name]:
+                waiting[holder] -= 1
+                if waiting[holder] == 0:
+                    ready.append(holder)
+        for name in devices:
+            if name not in self.depth:
+                # in a cycle, which sysfs shouldn't have; list it on its own
+                self.depth[name] = 0
+                lowest[name] = key(name)
+
+        def order_key(name):
+            return (lowest[name], key(name))
+
+        # top down, depth first: each holder after the subtrees of its members, each device
+        # once, under the first stack that reaches it
+        self.order = []
+        seen = set()
+
+        def visit(top):
+            seen.add(top)
+            stack = [(top, iter(sorted(self.members.get(top, ()), key=order_key)))]
+            while stack:
+                name, members = stack[-1]
+                for member in members:
+                    if member not in seen:
+                        seen.add(member)
+                        stack.append((member, iter(sorted(self.members.get(member, ()), key=order_key))))
+                        break
+                else:
+                    stack.pop()
+                    self.order.append(name)
+
+        for top in sorted((name for name in devices if not self.holders[name]), key=order_key):
+            if top not in seen:
+                visit(top)
+        for name in sorted(set(devices) - seen, key=key):
+            if name not in seen:
+                visit(name)  # (cycles again)
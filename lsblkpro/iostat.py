@@ -0,0 +1,59 @@
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+from builtins import *
+
+import os
+import time
+
+from . import data
+from . import timing
+
+# the columns --iostat adds, like `iostat -x -m`; util is %util
+COLUMNS = ('r/s', 'w/s', 'rMB/s', 'wMB/s', 'await', 'util')
+
+# /proc/diskstats counts sectors of 512 bytes, whatever the device's own sector size
+SECTOR = 512
+MB = 1024 * 1024
+
+# fields of a /proc/diskstats line after major, minor and name (Documentation/admin-guide/iostats.rst)
+READS, SECTORS_READ, MS_READING = 0, 2, 3
+WRITES, SECTORS_WRITTEN, MS_WRITING = 4, 6, 7
+MS_DOING_IO = 9
+
+def read_diskstats():
+    """kernel name -> counters, from one read of /proc/diskstats"""
+    timing.count('proc_files_read')
+    with open(os.path.join(data.PROC, 'diskstats'), 'r') as f:
+        text = f.read()
+    stats = {}
+    for line in text.splitlines():
+        fields = line.split()
+        if len(fields) >= 14:
+            stats[fields[2]] = [int(field) for field in fields[3:14]]
+    return stats
+
+@timing.timed('iostat')
+def sample(interval):
+    """kernel name -> {column: value} for every device and partition, from /proc/diskstats
+    read twice, `interval` seconds apart"""
+    before, started = read_diskstats(), time.time()
+    time.sleep(interval)
+    after, elapsed = read_diskstats(), time.time() - started
+    return {name: rates(before[name], counters, elapsed)
+            for name, counters in after.items() if name in before}
+
+def rates(before, after, elapsed):
+    """the columns for one device whose counters went from `before` to `after` in `elapsed`
+    seconds, formatted like lsblk's values (strings)"""
+    # (a device that went away and came back in between starts again from zero)
+    delta = [max(0, a - b) for a, b in zip(after, before)]
+    ios = delta[READS] + delta[WRITES]
+    waited = delta[MS_READING] + delta[MS_WRITING]
+    util = min(100.0, 100.0 * delta[MS_DOING_IO] / (elapsed * 1000))
+    return {
+        'r/s': '{:.1f}'.format(delta[READS] / elapsed),
+        'w/s': '{:.1f}'.format(delta[WRITES] / elapsed),
+        'rMB/s': '{:.2f}'.format(delta[SECTORS_READ] * SECTOR / MB / elapsed),
+        'wMB/s': '{:.2f}'.format(delta[SECTORS_WRITTEN] * SECTOR / MB / elapsed),
+        'await': '{:.2f}'.format(waited / ios if ios else 0.0),
+        'util': '{:.1f}'.format(util),
+    }
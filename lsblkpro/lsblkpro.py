@@ -7,7 +7,6 @@ import os
 import sys
 import re
 import argparse
-import collections
 import itertools
 import operator
 
@@ -16,11 +15,16 @@ import fcntl
 import termios
 
 from . import data
-
-import bytesize
+from . import query
+from . import smart
+from . import sorting
+from . import snapshot
+from . import timing
 
 INF = float('inf')
 BYTES_FORMATTER = None
+SIZE_FORMATTERS = None  # (partitions, devices), see size_formatter_for
+SIZE_UNITS = 'BKMGTPE'  # powers of 1000 or 1024, see short_formatter
 
 def bytes_formatter_for(separator=','):
     assert isinstance(separator, str)
@@ -32,6 +36,42 @@ def bytes_formatter_for(separator=','):
         return result
     return inner
 
+def roundness(value, base):
+    """how far `value`, in the largest power of `base` that leaves a whole part, is from a whole
+    number, relative to it"""
+    magnitude = float(value)
+    while magnitude >= base:
+        magnitude /= base
+    return abs(magnitude - round(magnitude)) / magnitude if magnitude else 0.0
+
+def short_formatter(base=1024, tolerance=None):
+    """sizes in at most four characters, like '512B', '4.0T' or '931G'. With `tolerance`,
+    powers of 1000 for sizes that are a whole number of them to within it and rounder that way
+    (as drives are sold: 4000787030016 bytes is '4.0T'), and of 1024 otherwise"""
+    def inner(value):
+        step = base
+        if tolerance is not None:
+            decimal = roundness(value, 1000)
+            if decimal <= tolerance and decimal <= roundness(value, 1024):
+                step = 1000
+        magnitude, unit = float(value), 0
+        while round(magnitude) >= 1000 and unit < len(SIZE_UNITS) - 1:
+            magnitude /= step
+            unit += 1
+        if unit == 0:
+            return '{}B'.format(value)
+        return '{:.{}f}{}'.format(magnitude, 1 if magnitude < 9.95 else 0, SIZE_UNITS[unit])
+    return inner
+
+def size_formatter_for(ent):
+    """always use binary for partitions, but guess base for devices"""
+    global SIZE_FORMATTERS
+    if BYTES_FORMATTER:
+        return BYTES_FORMATTER
+    if SIZE_FORMATTERS is None:
+        SIZE_FORMATTERS = (short_formatter(base=1024), short_formatter(tolerance=0.025))
+    return SIZE_FORMATTERS[0] if isinstance(ent, data.Partition) else SIZE_FORMATTERS[1]
+
 def pad_maj_min(text):
     try:
         v = ' ' * (3-text.index(':')) + text
@@ -46,6 +86,7 @@ def terminal_size():
     return h, w
 
 FORMAT_OPTIONS = {
+    'host': '<',
     'display_name': '<',
     'location': '<',
     'TRAN': '>',
@@ -66,6 +107,7 @@ ALWAYS_INTERESTING = {
 }
 
 IMPORTANCE_ORDER = {key: ii for ii, key in enumerate([
+    'host',
     'display_name',
     'location',
     'name',
@@ -73,9 +115,24 @@ IMPORTANCE_ORDER = {key: ii for ii, key in enumerate([
     'KNAME',
     'vdev',
     'zpath',
+    'zstate',
+    'znote',
     'MOUNTPOINT',
     'size',
     'SIZE',
+    'zcksum',
+    'zread',
+    'zwrite',
+    'util',
+    'await',
+    'r/s',
+    'w/s',
+    'rMB/s',
+    'wMB/s',
+    'smart',
+    'temp',
+    'realloc',
+    'hours',
     'FSTYPE',
     'HCTL',
     'MAJ:MIN',
@@ -116,16 +173,32 @@ IMPORTANCE_ORDER = {key: ii for ii, key in enumerate([
 ])}
 
 DISPLAY_ORDER = {key: ii for ii, key in enumerate([
+    'host',
     'display_name',
     'vdev',
     'location',
     'NAME',
     'KNAME',
     'zpath',
+    'zstate',
+    'zread',
+    'zwrite',
+    'zcksum',
+    'znote',
     'MOUNTPOINT',
     'FSTYPE',
     'size',
     'SIZE',
+    'r/s',
+    'w/s',
+    'rMB/s',
+    'wMB/s',
+    'await',
+    'util',
+    'smart',
+    'temp',
+    'realloc',
+    'hours',
     'TRAN',
     'HCTL',
     'MAJ:MIN',
@@ -136,6 +209,47 @@ DISPLAY_ORDER = {key: ii for ii, key in enumerate([
     'ROTA',
 ])}
 
+# typical cell widths, for guessing which columns could fit before anything is collected
+EXPECTED_WIDTHS = {
+    'display_name': 8,
+    'location': 12,
+    'MOUNTPOINT': 10,
+    'size': 6,
+    'SIZE': 13,
+    'MAJ:MIN': 7,
+    'HCTL': 7,
+    'MODEL': 16,
+    'id': 32,
+    'partlabel': 16,
+    'path': 32,
+    'UUID': 36,
+    'WWN': 18,
+    'PARTUUID': 36,
+    'PARTTYPE': 36,
+    'SERIAL': 16,
+}
+
+# columns with the same value in every row, or duplicating another column, aren't packed into
+# the table and leave room for later ones; collect whatever could fit in this many screens
+PROJECTION_SLACK = 2
+
+# widths for --widths schema, where nothing is sampled; falls back to EXPECTED_WIDTHS
+SCHEMA_WIDTHS = {
+    'display_name': 24,
+    'location': 24,
+    'MOUNTPOINT': 24,
+    'size': 7,
+    'SIZE': 15,
+    'MAJ:MIN': 7,
+    'MODEL': 24,
+    'SERIAL': 20,
+    'FSTYPE': 10,
+    'TYPE': 5,
+}
+
+# rows laid out before the rest are streamed, for --widths sample
+SAMPLE_ROWS = 200
+
 DUPLICATES = (
     ('KNAME', 'NAME'),
     ('partuuid', 'PARTUUID'),
@@ -144,40 +258,33 @@ DUPLICATES = (
 )
 
 class Table(object):
-    def __init__(self, host, args):
+    def __init__(self, host, args, reuse=None):
+        """`reuse` maps entities to rows from a previous table whose cells are still good"""
         ents = Table.entity_order_for(host, args)
-        self.rows = [Row(ent) for ent in ents]
-
-        if args.sorts:
-            self.rows.sort(
-                key=lambda row: tuple(row.sort_value(k) for k in args.sorts),
-                reverse=args.reverse)
-            self.recalculate_indentation()
+        self.rows = [Row.reused(reuse[ent]) if reuse and ent in reuse else Row(ent) for ent in ents]
+        self.skipped = host.skipped
+        self.color = args.color
 
         self.filter_log = []
-
-        filter_pairs = list(Table.filters(args))
-        if filter_pairs:
-            filters, self.filter_log = zip(*filter_pairs)
+        if args.query is not None:
+            self.filter_log = args.query.log
+            matches = args.query.matches
             for row in self.rows:
-                row.matching = all(f(row) for f in filters)
-
-        class DefaultDict(collections.defaultdict):
-            def __missing__(self, k):
-                col = Column(k)
-                self[k] = col
-                return col
-        cols = DefaultDict()
-        for row in self.rows:
-            for key in row:
-                col = cols[key]
-                col.update(row) # xxx don't update for non-matching rows
-        cols = dict(cols)  # un-defaultdict
+                row.matching = matches(row)
+
+        if args.top is not None:
+            # only the best `top` of the rows that passed --where
+            self.rows = sorting.sort_rows([row for row in self.rows if row.matching],
+                                          args.sorts, reverse=args.reverse, top=args.top)
+            Table.recalculate_indentation(self.rows)
+        elif args.sorts:
+            self.rows = sorting.sort_rows(self.rows, args.sorts, reverse=args.reverse)
+            Table.recalculate_indentation(self.rows)
+
+        cols = Table.build_columns(self.rows)
 
         def are_duplicates(a, b):
-            return (a in cols and b in cols and
-                    all(cols[a].cell_for(row) == cols[b].cell_for(row)
-                        for row in self.rows))
+            return a in cols and b in cols and cols[a].cells == cols[b].cells
         self.duplicates = {(a, b) for a, b in DUPLICATES if are_duplicates(a, b)}
 
         self.unique = {(key, col.unique_value) for key, col in cols.items()
@@ -212,26 +319,89 @@ class Table(object):
         self.columns = [cols[k] for k in sorted(columns, key=lambda k: DISPLAY_ORDER.get(k, INF))]
 
 
-    def recalculate_indentation(self):
+    @staticmethod
+    def build_columns(rows):
+        """Key -> Column, each holding the cells of every row (column-major), computed once.
+        Widths and uniqueness are worked out as each column is filled in.
+        """
+        lsblks = [row.ent.lsblk for row in rows]
+        bys = [row.ent.by for row in rows]
+        iostats = [row.ent.iostat for row in rows]
+        smarts = [row.ent.smart for row in rows]
+        zfss = [row.ent.zfs for row in rows]
+        show_fstype = None
+
+        attributes = Row.ATTRIBUTES
+        if any(row.ent.host for row in rows):
+            attributes += Row.FLEET_ATTRIBUTES
+
+        cols = {}
+        for key in attributes:
+            getter = operator.attrgetter(key)
+            cells = []
+            for row in rows:
+                cell = row.cells.get(key)
+                if cell is None:
+                    value = getter(row)
+                    cell = row.cells[key] = str(value) if value else ''
+                cells.append(cell)
+            cols[key] = Column(key, cells, rows)
+
+        for key, cells, present in itertools.chain(data.Record.columns(lsblks), Table.transposed(bys),
+                                                   Table.transposed(iostats), Table.transposed(smarts),
+                                                   Table.transposed(zfss)):
+            if key in cols:
+                continue
+            if key == 'FSTYPE':
+                if show_fstype is None:
+                    show_fstype = [row.show_fstype for row in rows]
+                cells = [cell if show else '' for cell, show in zip(cells, show_fstype)]
+            cols[key] = Column(key, cells, rows, present=present)
+
+        return cols
+
+    @staticmethod
+    def transposed(dicts):
+        """(key, cells, present) for every key in `dicts`, as for data.Record.columns. When
+        every dict has the same keys in the same order the cells come from a single transpose.
+        """
+        if dicts:
+            keys = tuple(dicts[0])
+            if all(tuple(d) == keys for d in dicts):
+                for key, cells in zip(keys, zip(*map(dict.values, dicts))):
+                    yield key, list(cells), None
+                return
+        for key in set().union(*dicts):
+            yield key, [d.get(key) or '' for d in dicts], [key in d for d in dicts]
+
+    @staticmethod
+    def recalculate_indentation(rows):
         """Scan the whole table to ensure each device is followed *only* by its partitions
         If not, remove indent for every row.
+
+        Rows that have been re-sorted no longer follow their stacks of holders, so holders
+        aren't indented by depth (see Row.level) either way.
         """
+        for row in rows:
+            row.level = 0
+
         class AbortException(Exception):
             pass
 
-        partition_names_in_table = set(row.ent.name for row in self.rows if isinstance(row.ent, data.Partition))
+        # entities rather than names, which repeat from host to host in a fleet
+        partitions_in_table = set(row.ent for row in rows if isinstance(row.ent, data.Partition))
 
         try:
             partitions = None
-            for row in self.rows:
+            for row in rows:
                 if partitions:
                     if isinstance(row.ent, data.Device):
                         # saw a device before we'd seen all the previous device's partitions. abort
                         raise AbortException()
                     else:
-                        if row.ent.name in partitions:
+                        if row.ent in partitions:
                             # good. we saw a partition we expected to see
-                            partitions.discard(row.ent.name)
+                            partitions.discard(row.ent)
                         else:
                             # bad. we saw a partition from some other device
                             raise AbortException()
@@ -240,7 +410,7 @@ class Table(object):
                     if isinstance(row.ent, data.Device):
                         # a new device. now expect to see all partitions in
                         # `partitions` before we see a new Device
-                        partitions = set(part.name for part in row.ent.partitions) & partition_names_in_table
+                        partitions = set(row.ent.partitions) & partitions_in_table
                     else:
                         # we saw a partition before its owning device. abort
                         raise AbortException()
@@ -251,7 +421,7 @@ class Table(object):
 
         except AbortException:
             # make everything flat
-            for row in self.rows:
+            for row in rows:
                 row.indent = False
 
     @staticmethod
@@ -264,80 +434,153 @@ class Table(object):
             if device.zpath and not args.all_devices:
                 continue
             for part in device.partitions:
-                assert part.lsblk['PKNAME'] == device.name
+                assert part.lsblk.get('PKNAME', device.name) == device.name
                 yield part
 
-    @staticmethod
-    def filters(args):
-        for expr in args.filters:
-            m = re.match(r'^([^ =~><!]*)([ =~><!]*)(.*?)$', expr)
-            if m:
-                lhs, op, rhs = m.groups()
-                op = op.strip()
-                if op == '=~':   yield Row.comparator_regexp(lhs, rhs)
-                elif op == '>=': yield Row.comparator_relative(lhs, operator.ge, op, rhs)
-                elif op == '>':  yield Row.comparator_relative(lhs, operator.gt, op, rhs)
-                elif op == '<=': yield Row.comparator_relative(lhs, operator.le, op, rhs)
-                elif op == '<':  yield Row.comparator_relative(lhs, operator.lt, op, rhs)
-                elif op == '!=': yield Row.comparator_direct(lhs, operator.ne, op, rhs)
-                elif op == '==': yield Row.comparator_direct(lhs, operator.eq, op, rhs)
-                elif op == '=':  yield Row.comparator_direct(lhs, operator.eq, '==', rhs)
-                elif op == '':   yield Row.comparator_direct(lhs, lambda a, b: bool(a), 'is set', None)
-                else:
-                    raise ValueError("couldn't parse filter expression '{}'".format(expr))
-            else:
-                raise ValueError("couldn't parse filter expression '{}'".format(expr))
+    def print_(self, out=None):
+        return write_lines(self.lines(), out)
+
+    def lines(self):
+        """the rendered table, one line at a time"""
+        for line in self.notice_lines():
+            yield line
+        for line in self.table_lines():
+            yield line
+
+    def notice_lines(self):
+        if self.skipped:
+            yield "Skipped sources (table is incomplete):"
+            for source, reason in self.skipped:
+                yield "  {} ({})".format(source, reason)
+            yield ''
 
-    def print_(self):
         if self.duplicates or self.unique:
             lwidth = max(itertools.chain(
                             (len(a) for a, b in self.duplicates),
                             (len(k) for k, v in self.unique),
             ))
-            print("Every device has these fields:")
+            yield "Every device has these fields:"
             for a, b in sorted(sorted(self.duplicates), key=lambda k: DISPLAY_ORDER.get(k, INF)):
-                print("  {0:{lwidth}} = <{1}>".format(a, b, lwidth=lwidth))
+                yield "  {0:{lwidth}} = <{1}>".format(a, b, lwidth=lwidth)
             for k, v in sorted(sorted(self.unique), key=lambda k: DISPLAY_ORDER.get(k, INF)):
-                print("  {0:{lwidth}} = {1}".format(k, v, lwidth=lwidth))
-            print()
+                yield "  {0:{lwidth}} = {1}".format(k, v, lwidth=lwidth)
+            yield ''
 
         if self.overflow:
-            print("Overflowing labels:\n  {}\n".format(', '.join(
-                sorted(self.overflow, key=lambda k: DISPLAY_ORDER.get(k, INF)))))
+            yield "Overflowing labels:"
+            yield "  {}".format(', '.join(sorted(self.overflow, key=lambda k: DISPLAY_ORDER.get(k, INF))))
+            yield ''
 
         if self.filter_log:
-            print("Showing only entries where:")
+            yield "Showing only entries where:"
             for f in self.filter_log:
-                print("  {}".format(f))
-            print()
+                yield "  {}".format(f)
+            yield ''
 
-        # header
-        line = ' '.join(col.formatted_cell_for(None, last=False) for col in self.columns)
-        print('\033[1m' + line + '\033[0m')
+    def header_line(self):
+        line = ' '.join(col.formatted_cell_for(None) for col in self.columns)
+        return '\033[1m' + line + '\033[0m' if self.color else line
 
-        # rows
+    def row_line(self, cells, row):
+        """the line for `row`, or None if it's filtered out and there's no color to dim it with"""
+        if not self.color:
+            return ' '.join(cells) if row.matching else None
+        return ('\033[0m' if row.matching else '\033[1;30m') + ' '.join(cells)
+
+    def table_lines(self):
+        yield self.header_line()
         for ii, row in enumerate(self.rows):
             last = ii+1 == len(self.rows) or self.rows[ii+1].indent == False
-            line = ' '.join(col.formatted_cell_for(row, last=last) for col in self.columns)
-            print('\033[0m' if row.matching else '\033[1;30m', end='')
-            print(line)
+            line = self.row_line((col.formatted_cell_for(ii, row, last=last) for col in self.columns), row)
+            if line is not None:
+                yield line
+
+class StreamingTable(Table):
+    """Renders rows as they're produced instead of laying out the whole table first. Column
+    widths come from the first SAMPLE_ROWS rows ('sample') or from SCHEMA_WIDTHS ('schema'), so
+    no more than that is ever held in memory; longer cells further down just push the rest of
+    their line to the right. Every column is shown, since whether one is the same in every
+    row isn't known until the end.
+    """
+    def __init__(self, host, args, widths='sample'):
+        self.skipped = host.skipped
+        self.color = args.color
+        self.duplicates, self.unique, self.overflow = set(), {}, []
+
+        self.filter_log = args.query.log if args.query is not None else []
+        self.matches = args.query.matches if args.query is not None else None
+
+        self.rows = (Row(ent) for ent in Table.entity_order_for(host, args))
+        self.sample = list(itertools.islice(self.rows, SAMPLE_ROWS if widths == 'sample' else 1))
+        cols = Table.build_columns(self.sample)
+        if widths == 'schema':
+            for key, col in cols.items():
+                col.resize(max(len(col.header_cell), SCHEMA_WIDTHS.get(key, EXPECTED_WIDTHS.get(key, 0))))
+
+        omit = set(Row.SYNTHESIZED) | set(args.exclude) - set(args.include)
+        keys = [key for key in cols if key not in omit]
+        self.columns = [cols[k] for k in sorted(keys, key=lambda k: (DISPLAY_ORDER.get(k, INF),
+                                                                     IMPORTANCE_ORDER.get(k, INF), k))]
+
+    def table_lines(self):
+        yield self.header_line()
+        previous = None
+        for row in itertools.chain(self.sample, self.rows):
+            row.matching = self.matches is None or self.matches(row)
+            if previous is not None:
+                line = self.streamed_line(previous, last=not row.indent)
+                if line is not None:
+                    yield line
+            previous = row
+        if previous is not None:
+            line = self.streamed_line(previous, last=True)
+            if line is not None:
+                yield line
+
+    def streamed_line(self, row, last):
+        return self.row_line((col.format_text(row.cell(col.key), row, last) for col in self.columns), row)
+
+def write_lines(lines, out=None):
+    """write `lines` through one buffered writer; a closed pipe (e.g. `| head`) just stops us.
+    Returns how many there were."""
+    out = out or sys.stdout
+    write = out.write
+    count = 0
+    for line in lines:
+        write(line)
+        write('\n')
+        count += 1
+    out.flush()
+    return count
 
 class Column(object):
-    def __init__(self, key):
+    def __init__(self, key, cells, rows, present=None):
+        """`cells` has one entry per row in `rows`; `present` says which rows actually have the
+        key (default all), for deciding whether the column is the same everywhere"""
         self.key = key
-        self.width = len(self.header_cell)
-        self.unique = None
-        self.unique_value = None
-
-    def update(self, row):
-        cell = self.cell_for(row)
-        if self.unique is not False:
-            if self.unique_value is None:
-                self.unique_value = cell
-            else:
-                self.unique = (self.unique_value == cell)
-        cell_len = len(cell) + (len(BOX_END) if row.indent and self.key == 'display_name' else 0)
-        self.width = max(self.width, cell_len)
+        self.cells = cells
+
+        width = max(map(len, cells)) if cells else 0
+        if key == 'display_name':
+            width = max(itertools.chain((width,), (len(cell) + len(BOX_END) * (row.level + row.indent)
+                                                   for cell, row in zip(cells, rows) if row.indent or row.level)))
+        self.width = max(len(self.header_cell), width)
+
+        values = set(cells if present is None else itertools.compress(cells, present))
+        count = len(cells) if present is None else sum(present)
+        self.unique = count > 1 and len(values) == 1
+        self.unique_value = next(iter(values)) if self.unique else None
+
+        self.resize(self.width)
+
+    def resize(self, width):
+        self.width = width
+        fmt = FORMAT_OPTIONS.get(self.key)
+        if fmt in ('>', '<'):
+            fmt += str(self.width)
+        elif fmt is None:
+            fmt = '>' + str(self.width)
+        self.fmt = '{0:' + fmt + '}'
 
     @property
     def header_cell(self):
@@ -346,32 +589,17 @@ class Column(object):
         else:
             return self.key
 
-    def cell_for(self, row): # xxx None |-> ''
-        if self.key == 'FSTYPE' and not row.show_fstype:
-            return ''
-
-        lookups = (
-            getattr(row, self.key, None),
-            getattr(row.ent, self.key, None),
-            row.ent.lsblk.get(self.key, None),
-            row.ent.by.get(self.key, None),
-        )
-        matches = tuple(filter(None, lookups))
-        assert len(matches) <= 1, "table key '{}' not unique for {}".format(self.key, row)
-        if matches:
-            return str(matches[0])
-        else:
-            return ''
-
-    def formatted_cell_for(self, row, **_3to2kwargs): # row=None means header
-        last = _3to2kwargs['last']; del _3to2kwargs['last']
-        if row is None:
-            text = self.header_cell
-        else:
-            text = self.cell_for(row)
+    def formatted_cell_for(self, ii, row=None, last=False): # ii=None means header
+        if ii is None:
+            return self.format_text(self.header_cell, None, last)
+        return self.format_text(self.cells[ii], row, last)
 
-        if self.key == 'display_name' and row and row.indent:
-            text = (BOX_END if last else BOX_MID) + text
+    def format_text(self, text, row, last):
+        if self.key == 'display_name' and row:
+            if row.indent:
+                text = (BOX_END if last else BOX_MID) + text
+            if row.level:
+                text = ' ' * (len(BOX_END) * row.level) + text
 
         if self.key == 'MAJ:MIN':
             text = pad_maj_min(text)
@@ -381,43 +609,86 @@ class Column(object):
             sep = ' ' * (self.width - len(a) - len(b))
             text = a + sep + b
 
-        fmt = FORMAT_OPTIONS.get(self.key)
-        if fmt in ('>', '<'):
-            fmt += str(self.width)
-        elif fmt is None:
-            fmt = '>' + str(self.width)
-
-        return "{0:{fmt}}".format(text, fmt=fmt)
+        return self.fmt.format(text)
 
 class Row(object):
+    __slots__ = ('ent', 'cells', 'matching', 'indent', 'level', 'size_formatter')
+
     SYNTHESIZED = ('NAME', 'PKNAME', 'zpath', 'MOUNTPOINT', 'TYPE', 'vdev', 'SIZE')
 
+    # columns computed by the row (or its entity) rather than looked up in lsblk or by-* links
+    ATTRIBUTES = ('display_name', 'location', 'zpath', 'size')
+
+    # columns only a fleet's rows have (see fleet.py)
+    FLEET_ATTRIBUTES = ('host',)
+
     def __init__(self, ent):
         self.ent = ent
+        self.cells = {}  # column key -> cell text, filled in by Row.cell
         self.matching = True
         self.indent = isinstance(self.ent, data.Partition)
+        self.level = Row.level_for(self.ent)
+        self.size_formatter = size_formatter_for(self.ent)
+
+    @staticmethod
+    def reused(row):
+        """`row` (from a previous table) with its per-table state reset but its cells kept"""
+        row.matching = True
+        row.indent = isinstance(row.ent, data.Partition)
+        row.level = Row.level_for(row.ent)
+        return row
+
+    @staticmethod
+    def level_for(ent):
+        """how far in the row's name goes: the depth of the device's stack of holders"""
+        return (ent.device if isinstance(ent, data.Partition) else ent).depth
 
-        # always use binary for partitions, but guess base for devices
-        if BYTES_FORMATTER:
-            self.size_formatter = BYTES_FORMATTER
-        elif isinstance(self.ent, data.Partition):
-            self.size_formatter = bytesize.short_formatter(base=1024)
+    def cell(self, key):
+        """text of the `key` column for this row, cached"""
+        try:
+            return self.cells[key]
+        except KeyError:
+            pass
+
+        if key == 'FSTYPE' and not self.show_fstype:
+            value = None
+        elif key in Row.ATTRIBUTES or key in Row.FLEET_ATTRIBUTES:
+            value = getattr(self, key)
         else:
-            self.size_formatter = bytesize.short_formatter(tolerance=0.025)
+            value = (self.ent.lsblk.get(key) or self.ent.by.get(key) or self.ent.iostat.get(key)
+                     or self.ent.smart.get(key) or self.ent.zfs.get(key))
+        cell = self.cells[key] = str(value) if value else ''
+        return cell
+
+    @property
+    def zpath(self):
+        return self.ent.zpath
+
+    @property
+    def host(self):
+        return self.ent.host
 
     def __iter__(self):
-        yield 'display_name'
-        yield 'location'
-        yield 'zpath'
-        yield 'size'
+        for yy in Row.ATTRIBUTES:
+            yield yy
+        if self.ent.host:
+            yield 'host'
         for yy in self.ent.lsblk.keys():
             yield yy
         for yy in self.ent.by.keys():
             yield yy
+        for yy in self.ent.iostat.keys():
+            yield yy
+        for yy in self.ent.smart.keys():
+            yield yy
+        for yy in self.ent.zfs.keys():
+            yield yy
 
     def __getitem__(self, key):
         if key.lower() == 'zpath':
             return self.zpath
+        if key == 'host' and self.ent.host:
+            return self.ent.host
 
         value = self.ent.lsblk.get(key.upper())
         if value:
@@ -427,6 +698,10 @@ class Row(object):
         if value:
             return value
 
+        value = self.ent.iostat.get(key) or self.ent.smart.get(key) or self.ent.zfs.get(key)
+        if value:
+            return value
+
         if key.startswith('by-'):
             value = self.by.get(key[3:])
             return value
@@ -447,79 +722,12 @@ class Row(object):
             return default
 
     def sort_value(self, key):
+        """the raw value of any field, for sorting.py"""
         if key.lower() == 'size':
-            return int(self.ent.lsblk['SIZE'])
-        return self.get(key, '')
-
-    @staticmethod
-    def comparator_regexp(key, rhs):
-        if key.lower() == 'size':
-            raise ValueError("can't compare size by regexp")
-        def compare(row):
-            value = row.get(key, '')
-            return re.match(rhs, value)
-        return compare, "{} matches regexp /{}/".format(key, rhs)
-
-    @staticmethod
-    def comparator_direct(key, op, op_str, rhs):
-        if key.lower() == 'size':
-            def compare(row):
-                return op(row.size, rhs)  # compare to string value as it appears in table
-        else:
-            def compare(row):
-                return op(row.get(key, ''), rhs)
-
-        text = "{} {}".format(key, op_str) + (' {}'.format(rhs) if rhs is not None else '')
-        return compare, text
-
-    @staticmethod
-    def comparator_relative(key, op, op_str, rhs):
-        if key.lower() == 'size':
-            return Row.comparator_relative_size(op, op_str, rhs)
-        else:
-            raise ValueError("can't compare by key '{}'".format(key))
-
-    @staticmethod
-    def comparator_relative_size(op, op_str, rhs):
-        # parse given size as integer
-        try:
-            rhs_int = int(rhs)
-            def compare(row):
-                return op(int(row.ent.lsblk['SIZE']), rhs_int)
-            return compare, "SIZE {} {} bytes".format(op_str, rhs_int)
-        except ValueError:
-            pass
-
-        # parse given size as string with pint/bytesize
-        if bytesize.ureg is None:
-            raise ValueError("can't parse size '{}' without module 'pint'".format(rhs))
-
-        try:
-            rhs_q = bytesize.ureg(rhs)
-        except bytesize.pint.unit.UndefinedUnitError as exn1:
-            rhs_q = None
-            try:
-                rhs_q = bytesize.ureg(rhs + 'B')
-            except bytesize.pint.unit.UndefinedUnitError:
-                pass
-            if rhs_q is None:
-                raise exn1
-
-        def compare(row):
-            row_size_q = int(row.ent.lsblk['SIZE']) * bytesize.ureg.bytes
-            return op(row_size_q, rhs_q)
-
-        text = "SIZE {} {}".format(op_str, rhs_q)
-        if rhs_q.magnitude > 1:
-            text += 's'
-
-        byte_mag = rhs_q.to('bytes').magnitude
-        if not isinstance(byte_mag, int):
-            if byte_mag.is_integer():
-                byte_mag = int(byte_mag)
-            text += " ({} bytes)".format(byte_mag)
-
-        return compare, text
+            return self.ent.lsblk.get('SIZE')
+        if key in Row.ATTRIBUTES or key in Row.FLEET_ATTRIBUTES:
+            return getattr(self, key)
+        return self.get(key)
 
     @property
     def size(self):
@@ -562,8 +770,79 @@ class Row(object):
         assert len(list(filter(None, (self.ent.zpath, mnt)))) <= 1
         return ' '.join(filter(None, (self.ent.zpath, mnt, holders)))
 
-def main():
-    # argparse
+def projection_for(args):
+    """the fields this invocation could show, or None for all of them"""
+    if args.export:
+        from . import export
+        fields = set(export.FIELDS)
+        if args.smart is not None:
+            fields.update(('WWN', 'SERIAL', 'MODEL'))
+        return data.Projection(fields)
+    if args.width_limit == INF:
+        return None
+
+    fields = set(Row.SYNTHESIZED)
+    for key in itertools.chain(args.include, args.sorts, args.query.fields if args.query is not None else ()):
+        fields.update((key, key.upper(), key.lower()))
+    if args.smart is not None:
+        fields.update(('WWN', 'SERIAL', 'MODEL'))  # what drives are known by, see smart.drive_key
+
+    # columns that no collector of this run will fill in take no room (snapshots have
+    # whatever their hosts collected)
+    off = set(args.exclude)
+    if not (args.fleet or args.load_data):
+        from . import iostat
+        from . import zpool
+        if args.iostat is None:
+            off.update(iostat.COLUMNS)
+        if args.smart is None:
+            off.update(smart.COLUMNS)
+        if not zpool.runs_status(args.zpool_status):
+            off.update(zpool.COLUMNS)
+
+    budget = args.width_limit * PROJECTION_SLACK
+    for key in sorted(IMPORTANCE_ORDER, key=IMPORTANCE_ORDER.get):
+        if key in off:
+            continue
+        width = max(len(key), EXPECTED_WIDTHS.get(key, 0))
+        if width > budget:
+            break
+        fields.add(key)
+        budget -= width + 1
+
+    for a, b in DUPLICATES:
+        if a in fields or b in fields:
+            fields.update((a, b))
+    return data.Projection(fields)
+
+def parse_timeout(text):
+    source, sep, seconds = text.partition('=')
+    if not sep or source not in data.COLLECTOR_TIMEOUTS:
+        raise argparse.ArgumentTypeError("expected SOURCE=SECONDS with SOURCE one of {}".format(
+            ', '.join(data.COLLECTOR_TIMEOUTS)))
+    try:
+        return source, (float(seconds) if seconds not in ('', 'none') else None)
+    except ValueError:
+        raise argparse.ArgumentTypeError("couldn't parse timeout '{}'".format(seconds))
+
+def use_box_characters(encoding, ascii=False):
+    """draw the tree with box-drawing characters for output in `encoding`, unless `ascii`"""
+    import codecs
+    global BOX_MID, BOX_END
+    try:
+        # python 3 says 'utf-8', python 2 'UTF-8'
+        utf8 = encoding is not None and codecs.lookup(encoding).name == 'utf-8'
+    except LookupError:
+        utf8 = False
+    if utf8 and not ascii:
+        BOX_MID, BOX_END = ' ├─ ', ' └─ '
+    else:
+        BOX_MID, BOX_END = ' |- ', ' `- '
+
+def parse_args(argv=None):
+    """command line options, with everything derived from them worked out"""
+    import shlex
+
     parser = argparse.ArgumentParser()
     parser.add_argument("-b", "--bytes", default=None, nargs='?', type=str, metavar='CHAR', const='',
                         help="show device capacities in bytes, optionally separated by CHAR")
@@ -575,71 +854,279 @@ def main():
                         help="exclude these fields from the output")
     # xxx expose field names that aren't labels
     parser.add_argument("-x", "--sort", action='append', dest='sorts', default=[],
-                        help="sort entities by field(s); implies --include")
+                        help="sort entities by any field(s), numbers numerically and names "
+                             "naturally (a2 before a10), missing values last; implies --include")
     parser.add_argument("-z", "--zfs", action='append_const', dest='sorts', const='vdev',
                         help="short for '--sort vdev'")
     parser.add_argument("-r", "--reverse", action='store_true', dest='reverse', default=False,
                         help="sort in reverse order")
+    parser.add_argument("--top", default=None, type=int, metavar='N',
+                        help="show only the first N entries in sort order (by default, the N largest)")
     parser.add_argument("-w", "--where", action='append', dest='filters', default=[],
-                        help="filters e.g. NAME=sdc, vdev=a4")
+                        help="filters e.g. NAME=sdc, vdev=a4, 'size>=4TiB and not TRAN in (usb, sata)', "
+                             "'MODEL=~^ST or NAME glob nvme*'; several are and'ed together")
     parser.add_argument("-a", "--all-devices", action='store_true',
                         help="include ram* and loop* devices, and include partitions of zpool drives")
     parser.add_argument("-A", "--all-columns", action='store_true',
-                        help="include all columns, appropriate to pipe to `less -S`")
+                        help="include all columns, appropriate to pipe to `less -S`; on a terminal, "
+                             "browse them with --pager")
+    parser.add_argument("--pager", choices=('auto', 'always', 'never'), default='auto',
+                        help="browse every column in a built-in pager that scrolls sideways and re-sorts "
+                             "and filters from the keyboard without collecting again; 'auto' uses it "
+                             "for -A on a terminal")
+    parser.add_argument("--collector", choices=('auto', 'native', 'lsblk', 'check'), default='auto',
+                        help="read device attributes from sysfs and the udev database ('native'), "
+                             "from `lsblk -O` ('lsblk'), or both and report differences ('check'); "
+                             "'auto' uses native when the udev database is available")
+    parser.add_argument("--timeout", action='append', dest='timeouts', default=[], type=parse_timeout,
+                        metavar='SOURCE=SECONDS',
+                        help="give up on a collector after SECONDS and show the table without it "
+                             "(sources: {})".format(', '.join(
+                                 '{}={}'.format(k, v) for k, v in data.COLLECTOR_TIMEOUTS.items())))
+    parser.add_argument("--watch", default=None, nargs='?', type=float, metavar='SECONDS', const=1.0,
+                        help="keep running, re-collecting devices as udev reports changes and "
+                             "redrawing what changed at most every SECONDS")
+    parser.add_argument("--widths", choices=('full', 'sample', 'schema'), default='full',
+                        help="size columns from every row ('full', the default), from the first {} rows "
+                             "('sample') or from fixed per-field widths ('schema'); the latter two stream "
+                             "rows out as they're made, for huge hosts, but show every column; --sort and "
+                             "--top always lay out in full".format(SAMPLE_ROWS))
+    parser.add_argument("--iostat", default=None, nargs='?', type=float, metavar='SECONDS', const=1.0,
+                        help="add r/s, w/s, rMB/s, wMB/s, await and util (%%util) columns, from "
+                             "/proc/diskstats read SECONDS apart (default: 1); sort and filter on them "
+                             "like any other field, e.g. -x util -r -w 'util>80'")
+    parser.add_argument("--smart", default=None, nargs='?', type=float, metavar='TTL', const=smart.DEFAULT_TTL,
+                        help="add temp, realloc (reallocated sectors), hours (power-on) and smart (health) "
+                             "columns from `smartctl --json`, run on up to {} drives at once without waking "
+                             "sleeping ones; readings are cached per drive and reused for TTL seconds "
+                             "(default: {:g})".format(smart.WORKERS, smart.DEFAULT_TTL))
+    parser.add_argument("--smart-cache", default=None, metavar='PATH',
+                        help="where to keep --smart readings between runs (default: in $XDG_RUNTIME_DIR)")
+    parser.add_argument("--smartctl", default=smart.SMARTCTL, type=shlex.split, metavar='COMMAND',
+                        help="how --smart runs smartctl, e.g. 'smartctl' as root or 'doas smartctl' "
+                             "(default: {})".format(' '.join(smart.SMARTCTL)))
+    parser.add_argument("--zpool-status", choices=('auto', 'always', 'never'), default='auto',
+                        help="when to run `sudo zpool status` for vdevs, member states and error counts; "
+                             "without it, pool names and states come from /proc/spl/kstat/zfs and the "
+                             "devices' ZFS labels (default: auto, when a pool is imported)")
+    parser.add_argument("--color", choices=('auto', 'always', 'never'), default='auto',
+                        help="highlight the header and dim filtered-out rows (default: when output is a terminal)")
     parser.add_argument("--ascii", action='store_true',
                         help="use ASCII characters for tree formatting")
-    parser.add_argument("--store-data", action='store_true',
-                        help="")
-    parser.add_argument("--load-data", action='store_true',
-                        help="")
-
-    args = parser.parse_args()
-
+    parser.add_argument("--cache", default=None, nargs='?', metavar='PATH', const='',
+                        help="reuse a snapshot of the devices from a recent run if nothing has changed "
+                             "since, or collect and store one at PATH (default: in $XDG_RUNTIME_DIR)")
+    parser.add_argument("--cache-ttl", default=None, type=float, metavar='SECONDS',
+                        help="consider --cache snapshots stale after SECONDS (default: {:g})".format(
+                            snapshot.DEFAULT_TTL))
+    parser.add_argument("--store-data", default=None, nargs='?', metavar='PATH', const='data',
+                        help="collect, write a snapshot to PATH (default: ./data), and exit")
+    parser.add_argument("--load-data", default=None, nargs='?', metavar='PATH', const='data',
+                        help="show the snapshot at PATH (default: ./data) instead of this machine's devices")
+    parser.add_argument("--fleet", default=None, metavar='DIR',
+                        help="show the snapshots in DIR (from --store-data on each host) as one table "
+                             "with a 'host' column; --where and --sort apply across all of them")
+    parser.add_argument("--export", default=None, choices=('prometheus',),
+                        help="write devices, sizes, zpool membership and state, holders and any --iostat "
+                             "or --smart readings as metrics instead of a table")
+    parser.add_argument("--output", default='-', metavar='PATH',
+                        help="where --export writes to, replacing PATH atomically (e.g. in node_exporter's "
+                             "textfile collector directory); default: stdout")
+    parser.add_argument("--daemon", action='store_true',
+                        help="keep the devices in memory, refreshed on udev events, and answer other "
+                             "lsblkpro --socket invocations from them; run it where `zpool status` works "
+                             "so clients don't need sudo")
+    parser.add_argument("--socket", default=None, nargs='?', metavar='PATH', const='',
+                        help="ask the --daemon listening at PATH (default: /run/lsblkpro.sock) instead of "
+                             "collecting; with --daemon, where to listen")
+    parser.add_argument("--socket-mode", default=0o660, type=lambda text: int(text, 8), metavar='MODE',
+                        help="with --daemon, the socket's permissions, in octal (default: 660)")
+    parser.add_argument("--socket-group", default=None, metavar='GROUP',
+                        help="with --daemon, the group that may connect (default: disk, if there is one)")
+    parser.add_argument("--timings", action='store_true',
+                        help="print wall and CPU time per phase, commands run and files read to stderr")
+    parser.add_argument("--trace", default=None, metavar='FILE',
+                        help="write the same as JSON lines to FILE")
+    parser.add_argument("--profile", default=None, metavar='PHASE',
+                        help="run PHASE (e.g. sysfs, lsblk, assemble, layout, print) under cProfile "
+                             "and print the hottest functions to stderr")
+
+    args = parser.parse_args(argv)
+
+    if args.top is not None and not args.sorts:
+        args.sorts, args.reverse = ['size'], not args.reverse
     args.include.extend(args.sorts)
 
-    if not (sys.platform.startswith('linux') or args.load_data):
+    if args.fleet and (args.load_data or args.store_data or args.cache is not None or args.watch is not None):
+        parser.error("--fleet can't be combined with --load-data, --store-data, --cache or --watch")
+
+    if args.export and (args.store_data or args.watch is not None):
+        parser.error("--export can't be combined with --store-data or --watch")
+    if args.daemon and (args.fleet or args.load_data or args.store_data or args.watch is not None or args.export):
+        parser.error("--daemon can't be combined with --fleet, --load-data, --store-data, --watch or --export")
+    if args.socket is not None and not args.daemon and (args.fleet or args.load_data or args.store_data
+                                                        or args.cache is not None or args.watch is not None
+                                                        or args.export):
+        parser.error("--socket can't be combined with --fleet, --load-data, --store-data, --cache, --watch "
+                     "or --export")
+
+    other_outputs = (args.store_data or args.watch is not None or args.export or args.daemon
+                     or args.socket is not None)
+    if args.pager == 'always' and other_outputs:
+        parser.error("--pager can't be combined with --store-data, --watch, --export, --daemon or --socket")
+    if args.pager == 'auto':
+        args.pager = bool(args.all_columns and sys.stdin.isatty() and sys.stdout.isatty() and not other_outputs)
+    else:
+        args.pager = args.pager == 'always'
+
+    if not (sys.platform.startswith('linux') or args.load_data or args.fleet):
         print("{}: fatal error: Linux is required".format(os.path.basename(sys.argv[0])))
         sys.exit(1)
 
-    global BOX_MID, BOX_END
-    if sys.stdout.encoding == 'UTF-8' and not args.ascii:
-        BOX_MID, BOX_END = ' ├─ ', ' └─ '
+    use_box_characters(sys.stdout.encoding, args.ascii)
+
+    if args.color == 'auto':
+        args.color = sys.stdout.isatty()
     else:
-        BOX_MID, BOX_END = ' |- ', ' `- '
+        args.color = args.color == 'always'
 
-    if args.all_columns:
+    if args.all_columns or args.pager or not sys.stdout.isatty():
         args.width_limit = INF
     else:
         try:
             _, width = terminal_size()
             args.width_limit = width - 1
-        # xxx if output is not a tty then be sure not to limit width
         except Exception:
             args.width_limit = INF
 
 
-    if args.bytes is not None:
-        global BYTES_FORMATTER
-        BYTES_FORMATTER = bytes_formatter_for(separator=args.bytes)
+    try:
+        args.query = query.Query(args.filters) if args.filters else None
+    except query.QueryError as ex:
+        parser.error(str(ex))
+
+    # the daemon collects everything, since it doesn't know what its clients will ask for, and
+    # so does --store-data, for whatever --load-data or --fleet will ask of the snapshot
+    args.projection = projection_for(args) if not (args.daemon or args.store_data) else None
+    # ...and every device: a host that's kept (or serves clients) can't have --where rule any
+    # out while it's collected, only when it's shown
+    args.pushdown = not (args.daemon or args.store_data or args.cache is not None)
+
+    # (reset every time: the daemon parses each client's options in turn)
+    global BYTES_FORMATTER
+    BYTES_FORMATTER = bytes_formatter_for(separator=args.bytes) if args.bytes is not None else None
+
+    return args
+
+def show(host, args, out=None, reuse=None):
+    """lay out and print the table for `host`; returns the table. `reuse` is as for Table."""
+    out = out or sys.stdout
+    if host.missing_from_lsblk:
+        # xxx more prominent warning (color?)
+        print("Present in sysfs but not in `lsblk`:\n  {}\n".format(', '.join(host.missing_from_lsblk)), file=out)
+
+    # (streaming can't sort)
+    widths = args.widths if not args.sorts and args.top is None else 'full'
+    with timing.phase('layout') as info:
+        if widths == 'full':
+            table = Table(host, args, reuse=reuse)
+            info['rows'] = len(table.rows)
+        else:
+            table = StreamingTable(host, args, widths=widths)
+            info['sampled_rows'] = len(table.sample)
+        info['columns'] = len(table.columns)
+
+    with timing.phase('print') as info:
+        info['lines'] = table.print_(out=out)
+    return table
+
+def main():
+    args = parse_args()
+    if args.timings or args.trace or args.profile:
+        timing.enable(report=args.timings, trace=args.trace, profile=args.profile)
+
+    text = None
+    if args.socket is not None and not args.daemon:
+        from . import daemon
+        try:
+            with timing.phase('daemon'):
+                text = daemon.ask(args.socket or daemon.DEFAULT_SOCKET, sys.argv[1:],
+                                  width=args.width_limit if args.width_limit != INF else None,
+                                  color=args.color, ascii=args.ascii, encoding=sys.stdout.encoding)
+        except daemon.DaemonError as ex:
+            print("warning: {}; collecting devices here instead".format(ex))
 
     # data
-    if args.load_data:
-        import pickle
-        with open('data', 'rb') as f:
-            host = pickle.load(f)
+    if text is not None:
+        host = None
+    elif args.fleet:
+        from . import fleet
+        try:
+            host = fleet.load(args.fleet)
+        except snapshot.SnapshotError as ex:
+            print("{}: {}".format(os.path.basename(sys.argv[0]), ex))
+            sys.exit(1)
+    elif args.load_data:
+        try:
+            with timing.phase('snapshot'):
+                host = snapshot.load(args.load_data)
+        except snapshot.SnapshotError as ex:
+            print("{}: {}".format(os.path.basename(sys.argv[0]), ex))
+            sys.exit(1)
+    elif args.cache is not None:
+        cache_path = args.cache or snapshot.default_path()
+        ttl = args.cache_ttl if args.cache_ttl is not None else snapshot.DEFAULT_TTL
+        with timing.phase('snapshot') as info:
+            fingerprint = snapshot.fingerprint(args)
+            host = snapshot.load_fresh(cache_path, fingerprint, ttl=ttl)
+            info['hit'] = host is not None
+        if host is None:
+            host = data.Host.go(args)
+            if not host.skipped:
+                snapshot.store(cache_path, host, fingerprint)
     else:
         host = data.Host.go(args)
 
     if args.store_data:
         assert not args.load_data
-        import pickle
-        with open('data', 'wb') as f:
-            pickle.dump(host, f)
+        with timing.phase('snapshot'):
+            snapshot.store(args.store_data, host, snapshot.fingerprint(args))
         sys.exit(0)
 
-    if host.missing_from_lsblk:
-        # xxx more prominent warning (color?)
-        print("Present in sysfs but not in `lsblk`:\n  {}\n".format(', '.join(host.missing_from_lsblk)))
+    if args.export:
+        from . import export
+        with timing.phase('export'):
+            export.write(host, args.export, args.output)
+        return
 
-    table = Table(host, args)
-    table.print_()
+    if args.watch is not None:
+        from . import watch
+        watch.run(host, args)
+        return
+
+    if args.daemon:
+        from . import daemon
+        try:
+            daemon.serve(host, args, args.socket or daemon.DEFAULT_SOCKET)
+        except daemon.DaemonError as ex:
+            print("{}: {}".format(os.path.basename(sys.argv[0]), ex))
+            sys.exit(1)
+        except KeyboardInterrupt:
+            pass
+        return
+
+    if args.pager:
+        from . import pager
+        pager.run(host, args)
+        return
+
+    try:
+        if text is not None:
+            sys.stdout.write(text)
+            sys.stdout.flush()
+        else:
+            show(host, args)
+    except BrokenPipeError:
+        # the reader went away; don't let the interpreter complain while flushing at exit
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(1)
@@ -0,0 +1,288 @@
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+from builtins import *
+
+import os
+import re
+import grp
+import pwd
+import stat
+
+from . import data
+from . import timing
+
+# lsblk columns this collector knows how to fill in, in `lsblk -O` order
+COLUMNS = (
+    'ALIGNMENT', 'DISC-ALN', 'DISC-GRAN', 'DISC-MAX', 'DISC-ZERO', 'FSTYPE', 'FSVER',
+    'GROUP', 'HCTL', 'KNAME', 'LABEL', 'LOG-SEC', 'MAJ:MIN', 'MIN-IO', 'MODE', 'MODEL',
+    'NAME', 'OPT-IO', 'OWNER', 'PARTFLAGS', 'PARTLABEL', 'PARTTYPE', 'PARTUUID', 'PATH',
+    'PHY-SEC', 'PKNAME', 'PTTYPE', 'PTUUID', 'RA', 'RAND', 'REV', 'RM', 'RO', 'ROTA',
+    'RQ-SIZE', 'SCHED', 'SERIAL', 'SIZE', 'STATE', 'MOUNTPOINT', 'TRAN', 'TYPE', 'UUID',
+    'VENDOR', 'WSAME', 'WWN',
+)
+
+# lsblk column -> file under the (parent) device's queue/ directory
+QUEUE_FILES = {
+    'RA': 'read_ahead_kb',
+    'RQ-SIZE': 'nr_requests',
+    'ROTA': 'rotational',
+    'RAND': 'add_random',
+    'PHY-SEC': 'physical_block_size',
+    'LOG-SEC': 'logical_block_size',
+    'MIN-IO': 'minimum_io_size',
+    'OPT-IO': 'optimal_io_size',
+    'DISC-GRAN': 'discard_granularity',
+    'DISC-MAX': 'discard_max_bytes',
+    'DISC-ZERO': 'discard_zeroes_data',
+    'WSAME': 'write_same_max_bytes',
+}
+
+# lsblk column -> udev property, first one present wins
+UDEV_PROPERTIES = {
+    'FSTYPE': ('ID_FS_TYPE',),
+    'FSVER': ('ID_FS_VERSION',),
+    'UUID': ('ID_FS_UUID',),
+    'LABEL': ('ID_FS_LABEL',),
+    'PTUUID': ('ID_PART_TABLE_UUID',),
+    'PTTYPE': ('ID_PART_TABLE_TYPE',),
+    'PARTUUID': ('ID_PART_ENTRY_UUID',),
+    'PARTTYPE': ('ID_PART_ENTRY_TYPE',),
+    'PARTLABEL': ('ID_PART_ENTRY_NAME',),
+    'PARTFLAGS': ('ID_PART_ENTRY_FLAGS',),
+    'SERIAL': ('ID_SCSI_SERIAL', 'ID_SERIAL_SHORT'),
+    'WWN': ('ID_WWN_WITH_EXTENSION', 'ID_WWN'),
+}
+
+# substrings of the resolved sysfs device path -> lsblk TRAN
+TRANSPORTS = (
+    ('/usb', 'usb'),
+    ('/nvme', 'nvme'),
+    ('/mmc_host', 'mmc'),
+    ('/rport-', 'fc'),
+    ('/session', 'iscsi'),
+    ('/end_device-', 'sas'),
+    ('/ata', 'sata'),
+)
+
+class Collector(object):
+    """Fill in lsblk-style records straight from sysfs, the udev database and mountinfo,
+    without forking `lsblk -O`.
+    """
+    def __init__(self, args, udev=None):
+        """`udev` is as for udev_entry, shared with whatever else reads the database"""
+        self.all_devices = args.all_devices
+        self.columns = set(COLUMNS)
+        if args.projection is not None:
+            self.columns &= set(args.projection.lsblk_columns())
+        self.mounts = read_mountpoints() if 'MOUNTPOINT' in self.columns else {}
+        self.udev = udev if udev is not None else {}
+
+    def records(self, host):
+        for dev in host.devices.values():
+            record = self.record_for(dev, None)
+            if record is not None:
+                yield record
+            for part in dev.partitions:
+                record = self.record_for(part, dev)
+                if record is not None:
+                    yield record
+
+    def udev_properties(self, entity):
+        return udev_entry(entity, self.udev)[0]
+
+    def wants(self, *keys):
+        return any(key in self.columns for key in keys)
+
+    def record_for(self, entity, parent):
+        """the record `lsblk -P -O -b` would print for `entity`, or None if lsblk would skip it"""
+        if parent is None:
+            path = os.path.join(data.SYSFS, 'block', entity.name)
+            device_path = path
+        else:
+            path = os.path.join(data.SYSFS, 'block', parent.name, entity.name)
+            device_path = os.path.join(data.SYSFS, 'block', parent.name)
+
+        size = read_attribute(path, 'size')
+        size = int(size) * 512 if size.isdigit() else 0
+        typ = entity_type(entity, path, parent)
+        if not self.all_devices and (size == 0 or typ == 'ram'):
+            # without --all lsblk skips empty devices (unattached loops, an sr0 with no disc...)
+            # and ramdisks
+            return None
+
+        rec = {}
+        rec['KNAME'] = entity.name
+        rec['NAME'] = read_attribute(path, os.path.join('dm', 'name')) or entity.name
+        rec['PATH'] = os.path.join(data.DEV, 'mapper' if rec['NAME'] != entity.name else '', rec['NAME'])
+        rec['MAJ:MIN'] = '{}:{}'.format(entity.major, entity.minor)
+        rec['SIZE'] = str(size)
+        rec['TYPE'] = typ
+        for key, filename in (('RO', 'ro'), ('ALIGNMENT', 'alignment_offset'),
+                              ('DISC-ALN', 'discard_alignment')):
+            if self.wants(key):
+                rec[key] = read_attribute(path, filename)
+        if self.wants('RM'):
+            rec['RM'] = read_attribute(device_path, 'removable')
+        for key, filename in QUEUE_FILES.items():
+            if self.wants(key):
+                rec[key] = read_attribute(device_path, os.path.join('queue', filename))
+        if self.wants('SCHED'):
+            rec['SCHED'] = parse_scheduler(read_attribute(device_path, os.path.join('queue', 'scheduler')))
+
+        if parent is None:
+            rec['PKNAME'] = ''
+            slaves = os.path.join(path, 'slaves')
+            if os.path.isdir(slaves):
+                rec['PKNAME'] = next(iter(sorted(os.listdir(slaves))), '')
+        else:
+            rec['PKNAME'] = parent.name
+
+        for key, filename in (('MODEL', 'model'), ('VENDOR', 'vendor'),
+                              ('REV', 'rev'), ('STATE', 'state')):
+            if self.wants(key):
+                rec[key] = read_attribute(device_path, os.path.join('device', filename)) if parent is None else ''
+        if self.wants('HCTL', 'TRAN'):
+            rec['HCTL'], rec['TRAN'] = hctl_and_transport(device_path) if parent is None else ('', '')
+
+        if self.wants(*UDEV_PROPERTIES):
+            props = self.udev_properties(entity)
+            for key, names in UDEV_PROPERTIES.items():
+                rec[key] = next((props[n] for n in names if props.get(n)), '')
+            if parent is None and not rec['SERIAL']:
+                rec['SERIAL'] = read_attribute(path, os.path.join('device', 'serial'))
+
+        if self.wants('MOUNTPOINT'):
+            rec['MOUNTPOINT'] = self.mounts.get((entity.major, entity.minor), '')
+        if self.wants('OWNER', 'GROUP', 'MODE'):
+            rec['OWNER'], rec['GROUP'], rec['MODE'] = device_node_owner(entity.name)
+        return data.Record((key, value) for key, value in rec.items() if key in self.columns)
+
+def entity_type(entity, path, parent):
+    if parent is not None:
+        return 'part'
+    if os.path.isdir(os.path.join(path, 'dm')):
+        uuid = read_attribute(path, os.path.join('dm', 'uuid'))
+        prefix = uuid.split('-', 1)[0].lower() if '-' in uuid else ''
+        if re.match(r'^part\d+$', prefix):
+            return 'part'
+        return prefix if prefix else 'dm'
+    if os.path.isdir(os.path.join(path, 'md')):
+        return read_attribute(path, os.path.join('md', 'level')) or 'md'
+    if entity.name.startswith('loop'):
+        return 'loop'
+    if entity.major == 1:
+        return 'ram'
+    if read_attribute(path, os.path.join('device', 'type')) == '5':
+        return 'rom'
+    return 'disk'
+
+def hctl_and_transport(device_path):
+    try:
+        resolved = os.path.realpath(os.path.join(device_path, 'device'))
+    except OSError:
+        return '', ''
+    hctl = os.path.basename(resolved)
+    if not re.match(r'^\d+:\d+:\d+:\d+$', hctl):
+        hctl = ''
+    for needle, tran in TRANSPORTS:
+        if needle in resolved:
+            return hctl, tran
+    return hctl, ''
+
+def parse_scheduler(text):
+    m = re.search(r'\[(.*?)\]', text)
+    return m.group(1) if m else text
+
+def device_node_owner(name):
+    try:
+        st = os.stat(os.path.join(data.DEV, name))
+    except OSError:
+        return '', '', ''
+    try:
+        owner = pwd.getpwuid(st.st_uid).pw_name
+    except KeyError:
+        owner = str(st.st_uid)
+    try:
+        group = grp.getgrgid(st.st_gid).gr_name
+    except KeyError:
+        group = str(st.st_gid)
+    return owner, group, stat.filemode(st.st_mode)
+
+def read_attribute(path, filename):
+    """contents of a sysfs attribute as a stripped string, or '' if it's absent"""
+    timing.count('sysfs_files_read')
+    try:
+        with open(os.path.join(path, filename), 'r') as f:
+            return f.read().strip()
+    except (IOError, OSError):
+        return ''
+
+def udev_entry(entity, cache=None):
+    """read_udev_entry for `entity`, remembered in `cache` ((major, minor) -> entry) if given"""
+    key = (entity.major, entity.minor)
+    if cache is None:
+        return read_udev_entry(*key)
+    try:
+        return cache[key]
+    except KeyError:
+        entry = cache[key] = read_udev_entry(*key)
+        return entry
+
+def read_udev_entry(major, minor):
+    """({property: value} from the E: records, [link] from the S: records) of the udev database
+    entry for block device `major`:`minor`; links are relative to /dev, e.g. 'disk/by-id/...'"""
+    props, links = {}, []
+    timing.count('udev_files_read')
+    try:
+        with open(os.path.join(data.UDEV_DATA, 'b{}:{}'.format(major, minor)), 'r') as f:
+            for l in f:
+                if l.startswith('E:'):
+                    k, _, v = l[2:].rstrip('\n').partition('=')
+                    props[k] = v
+                elif l.startswith('S:'):
+                    links.append(l[2:].rstrip('\n'))
+    except (IOError, OSError):
+        pass
+    return props, links
+
+def unescape_mountinfo(text):
+    return re.sub(r'\\([0-7]{3})', lambda m: chr(int(m.group(1), 8)), text)
+
+def read_mountpoints():
+    """(major, minor) -> mount point, first mount wins like lsblk; swap shows as [SWAP]"""
+    mounts = {}
+    with open(os.path.join(data.PROC, 'self', 'mountinfo'), 'r') as f:
+        for l in f:
+            fields = l.split(' ')
+            major, minor = data.parse_maj_min(fields[2])
+            mounts.setdefault((major, minor), unescape_mountinfo(fields[4]))
+
+    try:
+        with open(os.path.join(data.PROC, 'swaps'), 'r') as f:
+            swaps = [l.split()[0] for l in f.readlines()[1:] if l.strip()]
+    except (IOError, OSError):
+        swaps = []
+    for swap in swaps:
+        try:
+            rdev = os.stat(swap).st_rdev
+        except OSError:
+            continue
+        mounts[(os.major(rdev), os.minor(rdev))] = '[SWAP]'
+
+    return mounts
+
+def cross_check(native_records, lsblk_records):
+    """compare native records against lsblk's; yields (name, key, native, lsblk) disagreements,
+    with key None for a device only one side has (and the record it has, the other None)
+    """
+    by_name = {rec[data.PRIMARY_KEY]: rec for rec in native_records}
+    for rec in lsblk_records:
+        name = rec[data.PRIMARY_KEY]
+        mine = by_name.pop(name, None)
+        if mine is None:
+            yield name, None, None, rec
+            continue
+        for key in sorted(set(mine) & set(rec)):
+            if mine[key] != rec[key]:
+                yield name, key, mine[key], rec[key]
+    for name, mine in sorted(by_name.items()):
+        yield name, None, mine, None
@@ -0,0 +1,281 @@
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+from builtins import *
+
+import os
+
+from . import data
+from . import query
+from . import sorting
+from . import timing
+from . import lsblkpro
+
+# columns that stay at the left while the rest scroll past
+PINNED = ('host', 'display_name')
+
+KEYS = (
+    ('j k, up down', "scroll a row"),
+    ('space b, PgDn PgUp', "scroll a screen"),
+    ('g G, Home End', "first or last row"),
+    ('h l, left right', "select a column, scrolling sideways to it"),
+    ('^ $', "first or last column"),
+    ('s', "sort by the selected column; again to reverse"),
+    ('o', "back to the original order"),
+    ('/', "show only rows matching a --where expression, and'ed with the others; empty to show all"),
+    ('?', "this help, and the notes above the table"),
+    ('q', "quit"),
+)
+
+class Pager(object):
+    """Every column of a table, a screenful at a time. Cells and column widths are worked out
+    once, when the Table is laid out; after that a frame formats only the rows and columns on
+    screen, so scrolling costs the same however big the table is. Re-sorting and filtering
+    reorder row indices into the table, without collecting anything again.
+    """
+    def __init__(self, host, args):
+        self.host = host
+        self.table = lsblkpro.Table(host, args)
+        self.rows = self.table.rows
+        self.columns = self.table.columns
+        self.pinned = 0
+        while self.pinned < len(self.columns) and self.columns[self.pinned].key in PINNED:
+            self.pinned += 1
+
+        # room for the tree in front of partitions and holders, which going back to the original
+        # order can bring back
+        for col in self.columns:
+            if col.key == 'display_name' and self.rows:
+                steps = (lsblkpro.Row.level_for(row.ent) + isinstance(row.ent, data.Partition) for row in self.rows)
+                col.resize(max(col.width, max(len(cell) + len(lsblkpro.BOX_END) * step
+                                              for cell, step in zip(col.cells, steps))))
+
+        self.filters = list(args.filters)
+        self.sorts, self.reverse = list(args.sorts), args.reverse
+        self.order = list(range(len(self.rows)))  # indices into self.rows, in display order
+        self.resorted = bool(args.sorts) or args.top is not None  # self.rows aren't in host order
+        self.visible = self.order                 # the ones that match the filters
+        self.refilter()
+
+        self.top = 0      # first visible row on screen
+        self.cursor = 0   # selected column
+        self.left = self.pinned  # first scrolled column on screen
+        self.message = None
+
+    def refilter(self):
+        self.visible = [ii for ii in self.order if self.rows[ii].matching]
+
+    def where(self, expr):
+        if not expr:
+            self.filters = []
+            for row in self.rows:
+                row.matching = True
+        else:
+            try:
+                q = query.Query(self.filters + [expr])
+            except query.QueryError as ex:
+                self.message = str(ex)
+                return
+            self.filters.append(expr)
+            matches = q.matches
+            for row in self.rows:
+                row.matching = matches(row)
+        self.table.filter_log = query.Query(self.filters).log if self.filters else []
+        self.refilter()
+        self.top = 0
+
+    def sort(self, keys, reverse=False):
+        self.sorts, self.reverse = keys, reverse
+        if keys:
+            key = sorting.row_key(keys, reverse)
+            self.order = sorted(range(len(self.rows)), key=lambda ii: key(self.rows[ii]), reverse=reverse)
+        else:
+            self.order = list(range(len(self.rows)))
+        for row in self.rows:
+            row.indent = isinstance(row.ent, data.Partition)
+            row.level = lsblkpro.Row.level_for(row.ent)
+        if keys or self.resorted:
+            lsblkpro.Table.recalculate_indentation([self.rows[ii] for ii in self.order])
+        self.refilter()
+        self.top = 0
+
+    def shown_columns(self, width):
+        """the columns that fit in `width`: the pinned ones, then as many as fit from self.left"""
+        shown = self.columns[:self.pinned]
+        x = sum(col.width + 1 for col in shown)
+        for col in self.columns[self.left:]:
+            if x + col.width > width and len(shown) > self.pinned:
+                break
+            shown.append(col)
+            x += col.width + 1
+        return shown
+
+    def scroll_to_cursor(self, width):
+        if self.cursor < self.pinned:
+            return
+        if self.cursor < self.left:
+            self.left = self.cursor
+        while self.columns[self.cursor] not in self.shown_columns(width):
+            self.left += 1
+
+    def frame(self, height, width):
+        """(header, [line], status) for a screen of `height` lines"""
+        body = max(0, height - 2)
+        self.top = max(0, min(self.top, len(self.visible) - body))
+        self.scroll_to_cursor(width)
+        columns = self.shown_columns(width)
+
+        header = ' '.join(col.formatted_cell_for(None) for col in columns)
+        lines = []
+        end = min(self.top + body, len(self.visible))
+        for kk in range(self.top, end):
+            ii = self.visible[kk]
+            row = self.rows[ii]
+            last = kk + 1 == len(self.visible) or not self.rows[self.visible[kk + 1]].indent
+            lines.append(' '.join(col.formatted_cell_for(ii, row, last=last) for col in columns))
+        return header, lines, self.status(end)
+
+    def status(self, end):
+        if self.message:
+            return self.message
+        parts = ["{}-{} of {}".format(self.top + 1 if end else 0, end, len(self.visible))]
+        if len(self.visible) != len(self.rows):
+            parts[0] += " ({} hidden)".format(len(self.rows) - len(self.visible))
+        if self.columns:
+            parts.append("column {} ({}/{})".format(self.columns[self.cursor].header_cell,
+                                                    self.cursor + 1, len(self.columns)))
+        if self.sorts:
+            parts.append("sorted by {}{}".format(', '.join(self.sorts), ' reversed' if self.reverse else ''))
+        if self.filters:
+            parts.append("where {}".format(' and '.join(self.filters)))
+        if self.table.skipped:
+            parts.append("INCOMPLETE")
+        parts.append("? for keys")
+        return '  '.join(parts)
+
+    def help_lines(self):
+        lines = ["Keys:"]
+        lines.extend("  {:<20} {}".format(keys, what) for keys, what in KEYS)
+        lines.append('')
+        if self.host.missing_from_lsblk:
+            lines.append("Present in sysfs but not in `lsblk`:")
+            lines.append("  {}".format(', '.join(self.host.missing_from_lsblk)))
+            lines.append('')
+        lines.extend(self.table.notice_lines())
+        return lines
+
+    def key(self, ch, height, width):
+        """act on key `ch`; False to quit"""
+        body = max(1, height - 2)
+        self.message = None
+        if ch in ('q', 'Q'):
+            return False
+        elif ch in ('j', 'KEY_DOWN'):
+            self.top += 1
+        elif ch in ('k', 'KEY_UP'):
+            self.top = max(0, self.top - 1)
+        elif ch in (' ', 'f', 'KEY_NPAGE'):
+            self.top += body
+        elif ch in ('b', 'KEY_PPAGE'):
+            self.top = max(0, self.top - body)
+        elif ch in ('g', 'KEY_HOME'):
+            self.top = 0
+        elif ch in ('G', 'KEY_END'):
+            self.top = len(self.visible)
+        elif ch in ('h', 'KEY_LEFT'):
+            self.cursor = max(0, self.cursor - 1)
+        elif ch in ('l', 'KEY_RIGHT'):
+            self.cursor = min(len(self.columns) - 1, self.cursor + 1)
+        elif ch == '^':
+            self.cursor = 0
+        elif ch == '$':
+            self.cursor = len(self.columns) - 1
+        elif ch == 's' and self.columns:
+            key = self.columns[self.cursor].key
+            self.sort([key], reverse=self.sorts == [key] and not self.reverse)
+        elif ch == 'o':
+            self.sort([])
+        return True
+
+    def draw(self, screen):
+        import curses
+        height, width = screen.getmaxyx()
+        header, lines, status = self.frame(height, width - 1)
+        screen.erase()
+        screen.addnstr(0, 0, header, width - 1, curses.A_BOLD)
+        if self.columns:
+            # underline the selected column's header
+            x = 0
+            for col in self.shown_columns(width - 1):
+                if col is self.columns[self.cursor]:
+                    screen.addnstr(0, x, col.formatted_cell_for(None), max(0, width - 1 - x),
+                                   curses.A_BOLD | curses.A_REVERSE)
+                x += col.width + 1
+        for y, line in enumerate(lines):
+            screen.addnstr(y + 1, 0, line, width - 1)
+        screen.addnstr(height - 1, 0, status, width - 1, curses.A_REVERSE)
+        screen.refresh()
+
+    def show_help(self, screen):
+        import curses
+        height, width = screen.getmaxyx()
+        screen.erase()
+        for y, line in enumerate(self.help_lines()[:height - 1]):
+            screen.addnstr(y, 0, line, width - 1)
+        screen.addnstr(height - 1, 0, "any key to go back", width - 1, curses.A_REVERSE)
+        screen.refresh()
+        screen.getkey()
+
+    def prompt(self, screen, text):
+        import curses
+        height, width = screen.getmaxyx()
+        screen.move(height - 1, 0)
+        screen.clrtoeol()
+        screen.addnstr(height - 1, 0, text, width - 1)
+        curses.echo()
+        visibility(1)
+        try:
+            answer = screen.getstr(height - 1, len(text), max(1, width - 1 - len(text)))
+        finally:
+            curses.noecho()
+            visibility(0)
+        return answer.decode('utf-8', 'replace').strip()
+
+    def run(self, screen):
+        visibility(0)
+        while True:
+            self.draw(screen)
+            try:
+                ch = screen.getkey()
+            except KeyboardInterrupt:
+                return
+            except Exception:
+                continue  # e.g. no input during a resize
+            height, width = screen.getmaxyx()
+            if ch == '/':
+                self.where(self.prompt(screen, "where: "))
+            elif ch == '?':
+                self.show_help(screen)
+            elif not self.key(ch, height, width - 1):
+                return
+
+def visibility(cursor):
+    import curses
+    try:
+        curses.curs_set(cursor)
+    except curses.error:
+        pass  # the terminal can't hide it
+
+def run(host, args):
+    """`--pager`: browse every column of `host`'s table until 'q'"""
+    import curses
+    import locale
+    locale.setlocale(locale.LC_ALL, '')  # so curses writes the tree characters as UTF-8
+    os.environ.setdefault('ESCDELAY', '25')
+
+    with timing.phase('layout') as info:
+        pager = Pager(host, args)
+        info['rows'] = len(pager.rows)
+        info['columns'] = len(pager.columns)
+    try:
+        curses.wrapper(pager.run)
+    except KeyboardInterrupt:
+        pass
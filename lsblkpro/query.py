@@ -0,0 +1,323 @@
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+from builtins import *
+
+import re
+import fnmatch
+import operator
+
+# fields that can be decided while walking /sys/block, before lsblk or anything else runs
+# (see data.Probe)
+PUSHDOWN_FIELDS = ('NAME', 'KNAME', 'TYPE', 'TRAN')
+
+RELATIONAL = {
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+
+# size suffixes: k, M, G, ... are decimal like pint's 'kB', 'MB', ...; Ki, Mi, Gi, ... are binary
+SIZE_PREFIXES = 'kmgtpe'
+SIZE_RE = re.compile(r'^\s*(\d+(?:\.\d*)?|\.\d+)\s*(?:([kmgtpe])(i)?)?b?\s*$', re.I)
+
+WHITESPACE = re.compile(r'\s*')
+OR = re.compile(r'(?:or\b|\|\|)', re.I)
+AND = re.compile(r'(?:and\b|&&)', re.I)
+NOT = re.compile(r'(?:not\b|!(?![=~]))', re.I)
+IN = re.compile(r'in\b', re.I)
+GLOB = re.compile(r'glob\b', re.I)
+LPAREN = re.compile(r'\(')
+RPAREN = re.compile(r'\)')
+COMMA = re.compile(r',')
+KEYWORD = re.compile(r'^(?:and|or|not|in|glob)$', re.I)
+FIELD = re.compile(r'[^\s()=~<>!,\'"&|]+')
+OPERATOR = re.compile(r'=~|!~|==|!=|>=|<=|=|>|<')
+QUOTED = re.compile(r'"((?:[^"\\]|\\.)*)"|\'((?:[^\'\\]|\\.)*)\'')
+
+# the old single-comparison syntax, where everything after the operator is the value, so
+# `MOUNTPOINT=/mnt/my disk` still works
+LEGACY = re.compile(r'^([^ =~><!]+)\s*(=~|!~|==|!=|>=|<=|=|>|<)\s?(.*)$')
+BOOLEAN = re.compile(r'[()]|\b(?:and|or|not|in|glob)\b|&&|\|\|', re.I)
+
+# pint's unit registry, set up the first time a size needs it (see unit_registry)
+UNITS = None
+
+class QueryError(ValueError):
+    pass
+
+class Query(object):
+    """Every --where, parsed and compiled once. `matches(row)` is true for rows all of them
+    accept; `decide(probe)` says whether an entity could match from what's known about it
+    while walking sysfs: True, False, or None if it depends on something not known yet.
+    """
+    def __init__(self, exprs):
+        self.nodes = [parse(expr) for expr in exprs]
+        self.log = [str(node) for node in self.nodes]
+        node = self.nodes[0] if len(self.nodes) == 1 else And(self.nodes)
+        self.matches = node.compile()
+        self.decide = node.decide
+        self.fields = set(node.fields())
+        self.pushable = any(key.upper() in PUSHDOWN_FIELDS for key in self.fields)
+
+def parse(text):
+    try:
+        return Parser(text).parse()
+    except QueryError:
+        m = LEGACY.match(text)
+        if m is None or BOOLEAN.search(text):
+            raise
+        return Compare(*m.groups())
+
+class Parser(object):
+    """
+    expr   := term (('or' | '||') term)*
+    term   := factor (('and' | '&&') factor)*
+    factor := ('not' | '!') factor | '(' expr ')' | FIELD [OP value | 'in' '(' value (',' value)* ')' | 'glob' value]
+    """
+    def __init__(self, text):
+        self.text = text
+        self.pos = 0
+
+    def error(self, message):
+        raise QueryError("{} at column {} of filter expression '{}'".format(message, self.pos + 1, self.text))
+
+    def take(self, regex):
+        start = WHITESPACE.match(self.text, self.pos).end()
+        m = regex.match(self.text, start)
+        if m is not None:
+            self.pos = m.end()
+        return m
+
+    def parse(self):
+        node = self.expr()
+        self.pos = WHITESPACE.match(self.text, self.pos).end()
+        if self.pos < len(self.text):
+            self.error("unexpected '{}'".format(self.text[self.pos:]))
+        return node
+
+    def expr(self):
+        nodes = [self.term()]
+        while self.take(OR):
+            nodes.append(self.term())
+        return nodes[0] if len(nodes) == 1 else Or(nodes)
+
+    def term(self):
+        nodes = [self.factor()]
+        while self.take(AND):
+            nodes.append(self.factor())
+        return nodes[0] if len(nodes) == 1 else And(nodes)
+
+    def factor(self):
+        if self.take(NOT):
+            return Not(self.factor())
+        if self.take(LPAREN):
+            node = self.expr()
+            if not self.take(RPAREN):
+                self.error("expected ')'")
+            return node
+
+        m = self.take(FIELD)
+        if m is None or KEYWORD.match(m.group(0)):
+            self.error("expected a field name")
+        key = m.group(0)
+
+        m = self.take(OPERATOR)
+        if m is not None:
+            return Compare(key, m.group(0), self.value())
+        if self.take(IN):
+            if not self.take(LPAREN):
+                self.error("expected '(' after 'in'")
+            values = [self.value(in_list=True)]
+            while self.take(COMMA):
+                values.append(self.value(in_list=True))
+            if not self.take(RPAREN):
+                self.error("expected ')'")
+            return Compare(key, 'in', values)
+        if self.take(GLOB):
+            return Compare(key, 'glob', self.value())
+        return Compare(key)
+
+    def value(self, in_list=False):
+        """a quoted string, or everything up to whitespace or an unbalanced ')' (so regexps can
+        have groups in them)"""
+        m = self.take(QUOTED)
+        if m is not None:
+            quoted = m.group(1) if m.group(1) is not None else m.group(2)
+            return re.sub(r'\\(.)', r'\1', quoted)
+
+        self.pos = start = WHITESPACE.match(self.text, self.pos).end()
+        depth = 0
+        while self.pos < len(self.text):
+            c = self.text[self.pos]
+            if c.isspace() or (in_list and c == ',' and depth == 0):
+                break
+            if c == '(':
+                depth += 1
+            elif c == ')':
+                if depth == 0:
+                    break
+                depth -= 1
+            self.pos += 1
+        return self.text[start:self.pos]
+
+class Compare(object):
+    def __init__(self, key, op=None, value=None):
+        self.key = key
+        self.op = '==' if op == '=' else op
+        self.value = value
+        self.test = self.compile_test()
+
+    def compile_test(self):
+        """the test for one field value, with the right-hand side worked out up front"""
+        op, rhs = self.op, self.value
+        if op is None:
+            return bool
+        if op in RELATIONAL:
+            compare, rhs = RELATIONAL[op], parse_size(rhs)
+            def test(value):
+                try:
+                    return compare(int(value), rhs)
+                except ValueError:
+                    pass
+                try:
+                    return compare(float(value), rhs)
+                except ValueError:
+                    return False
+            return test
+        if op in ('=~', '!~'):
+            if self.key.lower() == 'size':
+                raise QueryError("can't compare size by regexp")
+            try:
+                regexp = re.compile(rhs)
+            except re.error as ex:
+                raise QueryError("bad regexp /{}/: {}".format(rhs, ex))
+            if op == '=~':
+                return lambda value: regexp.match(value) is not None
+            return lambda value: regexp.match(value) is None
+        if op == '==':
+            return lambda value: value == rhs
+        if op == '!=':
+            return lambda value: value != rhs
+        if op == 'in':
+            values = frozenset(rhs)
+            return lambda value: value in values
+        if op == 'glob':
+            regexp = re.compile(fnmatch.translate(rhs))
+            return lambda value: regexp.match(value) is not None
+        raise QueryError("unknown operator '{}'".format(op))
+
+    def compile(self):
+        key, test = self.key, self.test
+        if key.lower() == 'size' and self.op not in RELATIONAL:
+            # compare to the size as it appears in the table
+            return lambda row: test(row.size or '')
+        return lambda row: test(row.get(key, '') or '')
+
+    def decide(self, probe):
+        key = self.key.upper()
+        if key not in PUSHDOWN_FIELDS:
+            return None
+        return self.test(probe[key] or '')
+
+    def fields(self):
+        yield self.key
+
+    def __str__(self):
+        op, rhs = self.op, self.value
+        if op is None:
+            return "{} is set".format(self.key)
+        if op == '=~':
+            return "{} matches regexp /{}/".format(self.key, rhs)
+        if op == '!~':
+            return "{} doesn't match regexp /{}/".format(self.key, rhs)
+        if op == 'in':
+            return "{} in ({})".format(self.key, ', '.join(rhs))
+        if op == 'glob':
+            return "{} matches glob {}".format(self.key, rhs)
+        text = "{} {} {}".format(self.key, op, rhs)
+        if op in RELATIONAL and rhs.strip() != str(parse_size(rhs)):
+            text += " ({} bytes)".format(parse_size(rhs))
+        return text
+
+class Not(object):
+    def __init__(self, node):
+        self.node = node
+
+    def compile(self):
+        predicate = self.node.compile()
+        return lambda row: not predicate(row)
+
+    def decide(self, probe):
+        result = self.node.decide(probe)
+        return None if result is None else not result
+
+    def fields(self):
+        return self.node.fields()
+
+    def __str__(self):
+        return "not ({})".format(self.node)
+
+class And(object):
+    def __init__(self, nodes):
+        self.nodes = nodes
+
+    def compile(self):
+        predicates = [node.compile() for node in self.nodes]
+        return lambda row: all(predicate(row) for predicate in predicates)
+
+    def decide(self, probe):
+        results = [node.decide(probe) for node in self.nodes]
+        if False in results:
+            return False
+        return None if None in results else True
+
+    def fields(self):
+        for node in self.nodes:
+            for key in node.fields():
+                yield key
+
+    def __str__(self):
+        return ' and '.join('({})'.format(node) if isinstance(node, Or) else str(node)
+                            for node in self.nodes)
+
+class Or(And):
+    def compile(self):
+        predicates = [node.compile() for node in self.nodes]
+        return lambda row: any(predicate(row) for predicate in predicates)
+
+    def decide(self, probe):
+        results = [node.decide(probe) for node in self.nodes]
+        if True in results:
+            return True
+        return None if None in results else False
+
+    def __str__(self):
+        return ' or '.join(str(node) for node in self.nodes)
+
+def parse_size(text):
+    """`text` as a number of bytes: plain numbers, k/M/G/T/P/E (powers of 1000) or
+    Ki/Mi/Gi/Ti/Pi/Ei (powers of 1024), with or without a trailing 'B'. Anything else is
+    handed to pint."""
+    m = SIZE_RE.match(text)
+    if m is not None:
+        number, prefix, binary = m.groups()
+        magnitude = float(number) if '.' in number else int(number)
+        if prefix:
+            magnitude *= (1024 if binary else 1000) ** (SIZE_PREFIXES.index(prefix.lower()) + 1)
+        return int(magnitude) if magnitude == int(magnitude) else magnitude
+
+    try:
+        quantity = unit_registry()(text).to('bytes')
+    except ImportError:
+        raise QueryError("can't parse size '{}' without module 'pint'".format(text))
+    except Exception as ex:
+        raise QueryError("can't parse size '{}': {}".format(text, ex))
+    magnitude = quantity.magnitude
+    return int(magnitude) if magnitude == int(magnitude) else magnitude
+
+def unit_registry():
+    global UNITS
+    if UNITS is None:
+        import pint
+        UNITS = pint.UnitRegistry()
+    return UNITS
@@ -0,0 +1,206 @@
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+from builtins import *
+
+import os
+import time
+import subprocess
+
+from . import data
+from . import timing
+
+# how to run smartctl (see --smartctl); `-n standby` leaves sleeping drives alone and makes
+# it exit with STANDBY_STATUS instead
+SMARTCTL = ['sudo', '-n', 'smartctl']
+STANDBY_STATUS = 254
+
+# the columns --smart adds; 'smart' is the overall health (PASSED, FAILED) or 'standby'
+COLUMNS = ('temp', 'realloc', 'hours', 'smart')
+
+# smartctl processes at once
+WORKERS = 8
+
+# seconds a drive's readings are reused before it's asked again
+DEFAULT_TTL = 600.0
+
+# seconds one smartctl may take
+COMMAND_TIMEOUT = 20.0
+
+REALLOCATED_SECTOR_COUNT = 5  # ATA attribute id
+
+class SmartError(Exception):
+    pass
+
+def default_cache_path():
+    import tempfile
+    runtime = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime and os.path.isdir(runtime):
+        return os.path.join(runtime, 'lsblkpro.smart')
+    return os.path.join(tempfile.gettempdir(), 'lsblkpro-{}.smart'.format(os.getuid()))
+
+def drive_key(ent):
+    """what a drive's readings are cached under: its WWN or serial number, which stay put when
+    the kernel name doesn't; None for things that aren't drives"""
+    lsblk = ent.lsblk
+    if lsblk.get('TYPE') != 'disk':
+        return None
+    if lsblk.get('WWN'):
+        return 'wwn:' + lsblk['WWN']
+    if lsblk.get('SERIAL'):
+        return 'serial:{}:{}'.format(lsblk.get('MODEL', ''), lsblk['SERIAL'])
+    return None
+
+def query(name, smartctl=SMARTCTL):
+    """{column: value} for the drive /dev/`name`, or None if it was asleep, from the command
+    `smartctl`. Raises SmartError if there's no report, e.g. when sudo won't run smartctl or
+    it isn't installed."""
+    import json
+
+    cmd = list(smartctl) + ['--json', '--info', '--health', '--attributes',
+                      '-n', 'standby,{}'.format(STANDBY_STATUS), os.path.join(data.DEV, name)]
+    errors = b''
+    try:
+        out = data.run_command(cmd, timeout=COMMAND_TIMEOUT, stderr=subprocess.PIPE)
+    except subprocess.CalledProcessError as ex:
+        # the other bits of smartctl's exit status are warnings about the drive, and still
+        # come with a report
+        if ex.returncode == STANDBY_STATUS:
+            return None
+        out, errors = ex.output, ex.stderr or b''
+    try:
+        report = json.loads(out.decode('utf-8'))
+    except ValueError:
+        report = None
+    if not isinstance(report, dict):
+        why = errors.decode('utf-8', 'replace').strip().splitlines()
+        raise SmartError(why[0] if why else "no report from `{}`".format(' '.join(cmd)))
+    return parse_report(report)
+
+def parse_report(report):
+    """the COLUMNS from a `smartctl --json` report, for ATA, SCSI and NVMe drives"""
+    values = {}
+    nvme = report.get('nvme_smart_health_information_log', {})
+
+    temperature = report.get('temperature', {}).get('current', nvme.get('temperature'))
+    if temperature is not None:
+        values['temp'] = str(temperature)
+
+    hours = report.get('power_on_time', {}).get('hours', nvme.get('power_on_hours'))
+    if hours is not None:
+        values['hours'] = str(hours)
+
+    for attribute in report.get('ata_smart_attributes', {}).get('table', []):
+        if attribute.get('id') == REALLOCATED_SECTOR_COUNT:
+            values['realloc'] = str(attribute.get('raw', {}).get('value', ''))
+    if 'realloc' not in values and 'scsi_grown_defect_list' in report:
+        values['realloc'] = str(report['scsi_grown_defect_list'])
+
+    status = report.get('smart_status', {})
+    if 'passed' in status:
+        values['smart'] = 'PASSED' if status['passed'] else 'FAILED'
+    return values
+
+class Cache(object):
+    """Readings per drive (see drive_key), with when they were taken, kept in a file between
+    runs so that each run only asks the drives whose readings are older than `ttl`.
+    """
+    def __init__(self, path, ttl=DEFAULT_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.entries = self.read()  # key -> {'time': ..., 'values': {...}}
+        self.dirty = False
+
+    def read(self):
+        import json
+        try:
+            fd = os.open(self.path, os.O_RDONLY | getattr(os, 'O_NOFOLLOW', 0))
+        except OSError:
+            return {}
+        with os.fdopen(fd, 'r') as f:
+            if os.fstat(f.fileno()).st_uid not in (0, os.getuid()):
+                return {}
+            try:
+                entries = json.load(f)
+            except ValueError:
+                return {}
+        return entries if isinstance(entries, dict) else {}
+
+    def fresh(self, key, now):
+        entry = self.entries.get(key)
+        return entry is not None and now - entry['time'] <= self.ttl
+
+    def values(self, key):
+        entry = self.entries.get(key)
+        return dict(entry['values']) if entry is not None else {}
+
+    def update(self, key, values, now):
+        if values is None:
+            # asleep: keep what we knew, and don't wake it up to ask again until the ttl is up
+            values = dict(self.values(key), smart='standby')
+        self.entries[key] = {'time': now, 'values': values}
+        self.dirty = True
+
+    def store(self):
+        import json, tempfile
+        if not self.dirty:
+            return
+        directory = os.path.dirname(os.path.abspath(self.path))
+        try:
+            fd, tmp = tempfile.mkstemp(dir=directory, prefix='.lsblkpro-smart-')
+        except OSError as ex:
+            print("warning: couldn't write SMART cache '{}': {}".format(self.path, ex.strerror))
+            return
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self.entries, f, separators=(',', ':'))
+            os.rename(tmp, self.path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        self.dirty = False
+
+@timing.timed('smart')
+def punch_up(host, args, timeout=None):
+    """fill in Entity.smart for every drive in `host`, asking the ones whose cached readings
+    are stale, WORKERS at a time; gives up on the rest after `timeout` seconds"""
+    import concurrent.futures
+
+    cache = Cache(args.smart_cache or default_cache_path(), ttl=args.smart)
+    now = time.time()
+    drives = {}
+    for dev in host.devices.values():
+        key = drive_key(dev)
+        if key is not None:
+            drives[key] = dev
+
+    stale = sorted(key for key in drives if not cache.fresh(key, now))
+    if stale:
+        executor = data.DaemonExecutor(max_workers=min(WORKERS, len(stale)))
+        try:
+            futures = {executor.submit(query, drives[key].name, args.smartctl): key for key in stale}
+            answered = 0
+            failed = []  # SmartErrors, which aren't cached: the next run asks again
+            try:
+                for future in concurrent.futures.as_completed(futures, timeout=timeout):
+                    answered += 1
+                    try:
+                        values = future.result()
+                    except subprocess.TimeoutExpired:
+                        continue
+                    except (SmartError, OSError) as ex:
+                        failed.append(ex)
+                        continue
+                    cache.update(futures[future], values, now)
+            except concurrent.futures.TimeoutError:
+                for future in futures:
+                    future.cancel()
+                host.skipped.append(('smart', 'timed out with {} of {} drives unanswered'.format(
+                    len(stale) - answered, len(stale))))
+        finally:
+            executor.shutdown(wait=False)
+        if failed:
+            print("warning: no SMART data for {} of {} drives ({})".format(len(failed), len(stale), failed[0]))
+        timing.count('smart_drives_queried', len(stale))
+        cache.store()
+
+    for key, dev in drives.items():
+        dev.smart = cache.values(key)
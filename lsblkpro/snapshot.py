@@ -0,0 +1,216 @@
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+from builtins import *
+
+import os
+import time
+
+from . import data
+
+# json, gzip, socket and tempfile are imported where they're used, so that runs without
+# --cache, --store-data or --load-data don't pay for them at startup
+
+FORMAT = 'lsblkpro-snapshot'
+VERSION = 1
+
+DEFAULT_TTL = 60.0
+
+class SnapshotError(Exception):
+    pass
+
+def default_path():
+    import tempfile
+    runtime = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime and os.path.isdir(runtime):
+        return os.path.join(runtime, 'lsblkpro.snapshot')
+    return os.path.join(tempfile.gettempdir(), 'lsblkpro-{}.snapshot'.format(os.getuid()))
+
+def fingerprint(args):
+    """Cheap summary of the state a snapshot was collected from: if any of it moves, the
+    snapshot is stale. The uevent sequence number counts every uevent the kernel has sent,
+    so it catches anything udev could have acted on. Mounting and importing or exporting a
+    pool send no block uevent, so the mount table and the pools ZFS has imported count too.
+    """
+    import zlib
+    from . import zpool
+
+    def mtime(path):
+        try:
+            return os.stat(path).st_mtime
+        except OSError:
+            return None
+
+    try:
+        with open(os.path.join(data.SYSFS, 'kernel', 'uevent_seqnum'), 'r') as f:
+            seqnum = f.read().strip()
+    except (IOError, OSError):
+        seqnum = None
+
+    try:
+        # (procfs doesn't keep mtimes for it)
+        with open(os.path.join(data.PROC, 'self', 'mountinfo'), 'rb') as f:
+            mounts = zlib.crc32(f.read())
+    except (IOError, OSError):
+        mounts = None
+
+    pools = zpool.imported()
+    return {
+        'uevent_seqnum': seqnum,
+        'block': sorted(os.listdir(os.path.join(data.SYSFS, 'block'))),
+        'udev_data_mtime': mtime(data.UDEV_DATA),
+        'dev_disk_mtime': mtime(os.path.join(data.DEV, 'disk')),
+        'mountinfo_crc32': mounts,
+        'zpools': sorted(pools) if pools is not None else None,
+        'all_devices': bool(args.all_devices),
+        'collector': args.collector,
+        'projection': sorted(args.projection.fields) if args.projection is not None else None,
+        'iostat': args.iostat,  # rates are only worth reusing as long as the cache lives
+        'smart': args.smart is not None,
+    }
+
+def udev_busy():
+    """udev keeps /run/udev/queue around while it still has events to process"""
+    return os.path.exists(os.path.join(os.path.dirname(data.UDEV_DATA), 'queue'))
+
+def encode_host(host):
+    columns = sorted(set(key for ent in entities_of(host) for key in ent.lsblk))
+    index = {key: ii for ii, key in enumerate(columns)}
+
+    def encode_entity(ent):
+        values = [None] * len(columns)
+        for key, value in ent.lsblk.items():
+            values[index[key]] = value
+        return {
+            'name': ent.name,
+            'dev': [ent.major, ent.minor],
+            'holders': ent.holder_names,
+            'zpath': ent.zpath,
+            'zfs': ent.zfs or None,
+            'by': ent.by,
+            'iostat': ent.iostat or None,
+            'smart': ent.smart or None,
+            'lsblk': values if ent.lsblk else None,
+        }
+
+    devices = []
+    for dev in host.devices.values():
+        obj = encode_entity(dev)
+        obj['partitions'] = [encode_entity(part) for part in dev.partitions]
+        devices.append(obj)
+
+    result = getattr(host, 'zpool_status_result', None)
+    return {
+        'columns': columns,
+        'devices': devices,
+        'missing_from_lsblk': host.missing_from_lsblk,
+        'skipped': host.skipped,
+        'zpool_status_result': result if result in (True, False) else None,
+        'zpool_states': host.zpool_states,
+        'zpool_io': host.zpool_io,
+    }
+
+def decode_host(obj):
+    record = data.Record.maker(obj['columns'])
+
+    def decode_entity(ent, values):
+        ent.major, ent.minor = values['dev']
+        ent.holder_names = values['holders']
+        ent.zpath = values['zpath']
+        ent.zfs = values.get('zfs') or {}
+        ent.by = values['by']
+        ent.iostat = values.get('iostat') or {}
+        ent.smart = values.get('smart') or {}
+        if values['lsblk'] is not None:
+            ent.lsblk = record(values['lsblk'])
+        return ent
+
+    host = data.Host()
+    host.devices = {}
+    host.partitions = {}
+    for values in obj['devices']:
+        dev = decode_entity(data.Device(values['name']), values)
+        dev.partitions = [decode_entity(data.Partition(part['name'], dev), part)
+                          for part in values['partitions']]
+        host.devices[dev.name] = dev
+        for part in dev.partitions:
+            host.partitions[part.name] = part
+
+    host.reindex()
+    host.missing_from_lsblk = obj['missing_from_lsblk']
+    host.skipped = [tuple(pair) for pair in obj['skipped']]
+    host.zpool_status_result = obj['zpool_status_result']
+    host.zpool_states = obj.get('zpool_states', {})
+    host.zpool_io = obj.get('zpool_io', {})
+    return host
+
+def entities_of(host):
+    for dev in host.devices.values():
+        yield dev
+        for part in dev.partitions:
+            yield part
+
+def store(path, host, fingerprint=None, hostname=None):
+    """write `host` to `path` atomically; readers never see a half-written snapshot"""
+    import json, gzip, socket, tempfile
+    obj = {
+        'format': FORMAT,
+        'version': VERSION,
+        'created': time.time(),
+        'hostname': hostname or socket.gethostname(),
+        'fingerprint': fingerprint,
+        'host': encode_host(host),
+    }
+    payload = gzip.compress(json.dumps(obj, separators=(',', ':')).encode('utf-8'), compresslevel=1)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.lsblkpro-snapshot-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(payload)
+        os.rename(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+def read(path):
+    """the raw snapshot object at `path`; raises SnapshotError if it isn't one we can read"""
+    import json, gzip
+    try:
+        fd = os.open(path, os.O_RDONLY | getattr(os, 'O_NOFOLLOW', 0))
+    except OSError as ex:
+        raise SnapshotError("can't open snapshot '{}': {}".format(path, ex.strerror))
+    with os.fdopen(fd, 'rb') as f:
+        owner = os.fstat(f.fileno()).st_uid
+        if owner not in (0, os.getuid()):
+            raise SnapshotError("snapshot '{}' belongs to uid {}, refusing to read it".format(path, owner))
+        try:
+            obj = json.loads(gzip.decompress(f.read()).decode('utf-8'))
+        except (IOError, OSError, ValueError) as ex:
+            raise SnapshotError("'{}' is not a readable snapshot: {}".format(path, ex))
+
+    if not isinstance(obj, dict) or obj.get('format') != FORMAT:
+        raise SnapshotError("'{}' is not an lsblkpro snapshot".format(path))
+    if obj.get('version') != VERSION:
+        raise SnapshotError("snapshot '{}' is version {}, expected {}".format(path, obj.get('version'), VERSION))
+    return obj
+
+def load(path):
+    """the Host in the snapshot at `path`, however old it is"""
+    return decode_host(read(path)['host'])
+
+def load_fresh(path, fingerprint, ttl=DEFAULT_TTL):
+    """the Host in the snapshot at `path` if it's younger than `ttl` seconds and nothing has
+    changed since it was collected, otherwise None"""
+    try:
+        age = time.time() - os.stat(path).st_mtime
+    except OSError:
+        return None
+    if age > ttl or udev_busy():
+        return None
+
+    try:
+        obj = read(path)
+    except SnapshotError:
+        return None
+    if obj['fingerprint'] != fingerprint:
+        return None
+    return decode_host(obj['host'])
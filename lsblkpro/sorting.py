@@ -0,0 +1,127 @@
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+from builtins import *
+
+import re
+import heapq
+
+# how each field sorts; anything not listed sorts naturally ('a2' < 'a10')
+NUMERIC = 'numeric'
+NATURAL = 'natural'
+DEVICE = 'device'  # natural, but shorter runs of letters first, like the kernel names them
+STRING = 'string'
+
+FIELD_TYPES = {
+    'NAME': DEVICE,
+    'KNAME': DEVICE,
+    'PKNAME': DEVICE,
+    'display_name': DEVICE,
+    'size': NUMERIC,
+    'SIZE': NUMERIC,
+    'ALIGNMENT': NUMERIC,
+    'DISC-ALN': NUMERIC,
+    'DISC-GRAN': NUMERIC,
+    'DISC-MAX': NUMERIC,
+    'DISC-ZERO': NUMERIC,
+    'FSAVAIL': NUMERIC,
+    'FSSIZE': NUMERIC,
+    'FSUSED': NUMERIC,
+    'LOG-SEC': NUMERIC,
+    'MIN-IO': NUMERIC,
+    'OPT-IO': NUMERIC,
+    'PHY-SEC': NUMERIC,
+    'RA': NUMERIC,
+    'RAND': NUMERIC,
+    'RM': NUMERIC,
+    'RO': NUMERIC,
+    'ROTA': NUMERIC,
+    'RQ-SIZE': NUMERIC,
+    'START': NUMERIC,
+    'WSAME': NUMERIC,
+    'r/s': NUMERIC,  # iostat.COLUMNS
+    'w/s': NUMERIC,
+    'rMB/s': NUMERIC,
+    'wMB/s': NUMERIC,
+    'await': NUMERIC,
+    'util': NUMERIC,
+    'temp': NUMERIC,  # smart.COLUMNS
+    'realloc': NUMERIC,
+    'hours': NUMERIC,
+    'zread': NUMERIC,  # zpool.COLUMNS
+    'zwrite': NUMERIC,
+    'zcksum': NUMERIC,
+    'UUID': STRING,
+    'PARTUUID': STRING,
+    'PTUUID': STRING,
+    'WWN': STRING,
+    'MODE': STRING,
+}
+
+NATURAL_PARTS = re.compile(r'(\d+)')
+
+_natural_keys = {}  # text -> natural_key(text)
+_device_keys = {}  # text -> device_key(text)
+
+def field_type(key):
+    return FIELD_TYPES.get(key, FIELD_TYPES.get(key.upper(), NATURAL))
+
+def natural_key(text):
+    """`text` split into runs of digits, compared as numbers, and everything else, compared as
+    strings, e.g. 'a10' -> ('a', 10, '') > ('a', 2, ''); memoized"""
+    try:
+        return _natural_keys[text]
+    except KeyError:
+        pass
+    parts = NATURAL_PARTS.split(text)
+    # every other part is digits, so ints and strs are never compared with each other
+    key = _natural_keys[text] = tuple(int(part) if ii % 2 else part for ii, part in enumerate(parts))
+    return key
+
+def device_key(text):
+    """natural_key, but with each run of letters ahead of the longer ones, so that 'sdz' <
+    'sdaa' as the kernel hands them out; memoized"""
+    try:
+        return _device_keys[text]
+    except KeyError:
+        pass
+    key = _device_keys[text] = tuple((len(part), part) if isinstance(part, str) else part
+                                     for part in natural_key(text))
+    return key
+
+def numeric_key(text):
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+def key_for(key, reverse=False):
+    """function from a row to something that sorts it by field `key`. Rows without the field,
+    or with a value that doesn't fit its type, go last either way."""
+    typ = field_type(key)
+    convert = {NUMERIC: numeric_key, NATURAL: natural_key, DEVICE: device_key, STRING: str}[typ]
+    present, missing = (1, (0,)) if reverse else (0, (1,))
+
+    def sort_key(row):
+        value = row.sort_value(key)
+        if value is None or value == '':
+            return missing
+        try:
+            return present, convert(value)
+        except ValueError:
+            return missing
+    return sort_key
+
+def row_key(keys, reverse=False):
+    keys = [key_for(key, reverse) for key in keys]
+    if len(keys) == 1:
+        return keys[0]
+    return lambda row: tuple(key(row) for key in keys)
+
+def sort_rows(rows, keys, reverse=False, top=None):
+    """`rows` sorted by `keys` in turn; with `top`, just the first `top` of them, without
+    sorting the rest"""
+    key = row_key(keys, reverse)
+    if top is None:
+        return sorted(rows, key=key, reverse=reverse)
+    if reverse:
+        return heapq.nlargest(top, rows, key=key)
+    return heapq.nsmallest(top, rows, key=key)
@@ -0,0 +1,138 @@
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+from builtins import *
+
+import sys
+import time
+import atexit
+import threading
+import functools
+import contextlib
+import collections
+
+# the Recorder for this run, or None when nobody asked (--timings, --trace, --profile)
+TIMINGS = None
+
+class Recorder(object):
+    """Wall and CPU time per phase, external commands run, and counters, for --timings.
+    Phases may run in the collector threads, so CPU time is per thread.
+    """
+    def __init__(self, trace=None, profile=None):
+        self.started = time.time()
+        self.phases = []  # (start, depth, name, wall, cpu, info) in the order they finished
+        self.main_depth = 0
+        self.commands = []  # (argv[0], wall, returncode)
+        self.counters = collections.Counter()
+        self.trace = trace
+        self.profile = profile
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def emit(self, obj):
+        if self.trace is not None:
+            import json
+            line = json.dumps(obj, sort_keys=True)
+            with self.lock:
+                self.trace.write(line + '\n')
+
+    @contextlib.contextmanager
+    def phase(self, name, **info):
+        # phases in a collector thread nest under whatever the main thread is doing
+        depth = getattr(self.local, 'depth', None)
+        if depth is None:
+            depth = self.main_depth
+        main = threading.current_thread() is threading.main_thread()
+        self.local.depth = depth + 1
+        if main:
+            self.main_depth = depth + 1
+        profiler = None
+        if self.profile == name:
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
+        start, wall, cpu = time.time(), time.perf_counter(), time.thread_time()
+        try:
+            yield info
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.thread_time() - cpu
+            self.local.depth = depth
+            if main:
+                self.main_depth = depth
+            if profiler is not None:
+                profiler.disable()
+                self.print_profile(profiler, name)
+            with self.lock:
+                self.phases.append((start, depth, name, wall, cpu, info))
+            self.emit(dict(info, type='phase', name=name, start=start, wall=wall, cpu=cpu,
+                           thread=threading.current_thread().name))
+
+    def command(self, cmd, wall, returncode):
+        with self.lock:
+            self.commands.append((cmd[0], wall, returncode))
+        self.emit({'type': 'command', 'argv': list(cmd), 'wall': wall, 'returncode': returncode})
+
+    def print_profile(self, profiler, name):
+        import pstats
+        print("profile of phase '{}':".format(name), file=sys.stderr)
+        pstats.Stats(profiler, stream=sys.stderr).sort_stats('cumulative').print_stats(30)
+
+    def report(self, out=None):
+        out = out or sys.stderr
+        phases = sorted(self.phases, key=lambda p: p[0])
+        width = max([len(name) + 2 * depth for _, depth, name, _, _, _ in phases] + [5])
+        print("timings:", file=out)
+        print("  {:{width}} {:>9} {:>9}".format('phase', 'wall', 'cpu', width=width), file=out)
+        for _, depth, name, wall, cpu, info in phases:
+            extra = ', '.join('{} {}'.format(k, v) for k, v in sorted(info.items()))
+            print("  {:{width}} {:8.3f}s {:8.3f}s{}".format(
+                '  ' * depth + name, wall, cpu, '  ' + extra if extra else '', width=width), file=out)
+        total = sum(wall for _, wall, _ in self.commands)
+        print("  commands run: {} ({:.3f}s)".format(len(self.commands), total), file=out)
+        for cmd, wall, returncode in self.commands:
+            print("    {:20} {:8.3f}s  {}".format(cmd, wall, 'exit {}'.format(returncode)
+                                               if returncode is not None else "didn't run"), file=out)
+        for counter, value in sorted(self.counters.items()):
+            print("  {}: {}".format(counter.replace('_', ' '), value), file=out)
+
+def enable(report=True, trace=None, profile=None):
+    """start recording; prints the report (if `report`) and closes `trace` at exit"""
+    global TIMINGS
+    TIMINGS = Recorder(trace=open(trace, 'w') if trace else None, profile=profile)
+
+    def finish():
+        TIMINGS.emit({'type': 'counters', 'wall': time.time() - TIMINGS.started,
+                      'commands': len(TIMINGS.commands), 'counters': dict(TIMINGS.counters)})
+        if TIMINGS.trace is not None:
+            TIMINGS.trace.close()
+        if report:
+            TIMINGS.report()
+    atexit.register(finish)
+
+@contextlib.contextmanager
+def phase(name, **info):
+    """time the block as phase `name`; whatever it adds to the yielded dict is reported too"""
+    if TIMINGS is None:
+        yield info
+    else:
+        with TIMINGS.phase(name, **info) as info:
+            yield info
+
+def timed(name):
+    """decorator: time every call as phase `name`"""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if TIMINGS is None:
+                return fn(*args, **kwargs)
+            with TIMINGS.phase(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def count(counter, n=1):
+    if TIMINGS is not None:
+        with TIMINGS.lock:
+            TIMINGS.counters[counter] += n
+
+def command(cmd, wall, returncode):
+    if TIMINGS is not None:
+        TIMINGS.command(cmd, wall, returncode)
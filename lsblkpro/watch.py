@@ -0,0 +1,162 @@
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+from builtins import *
+
+import os
+import re
+import sys
+import time
+import select
+import socket
+
+from . import data
+from . import lsblkpro
+
+NETLINK_KOBJECT_UEVENT = 15
+UEVENT_KERNEL_GROUP = 1
+
+# after the first uevent of a burst, wait this long for the rest (and for udev's links)
+SETTLE = 0.5
+
+# a control sequence, e.g. the colours Table.lines() adds, which takes no room on screen
+ESCAPE = re.compile(r'\x1b\[[0-9;?]*[A-Za-z]')
+
+class UeventMonitor(object):
+    """Names of block devices that changed, from kernel uevents over netlink. Where netlink
+    isn't available, falls back to polling the uevent sequence number, which can only say that
+    *something* changed.
+    """
+    def __init__(self):
+        try:
+            self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT)
+            self.sock.bind((0, UEVENT_KERNEL_GROUP))
+        except (AttributeError, socket.error):
+            self.sock = None
+        self.seqnum = read_seqnum()
+
+    def wait(self, timeout):
+        """Block for up to `timeout` seconds. Returns the set of device names that changed,
+        or None if something changed but we can't tell what.
+        """
+        if self.sock is None:
+            time.sleep(timeout)
+            seqnum = read_seqnum()
+            changed, self.seqnum = seqnum != self.seqnum, seqnum
+            return None if changed else set()
+
+        names = set()
+        deadline = time.time() + timeout
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            readable, _, _ = select.select([self.sock], [], [], remaining)
+            if not readable:
+                break
+            name = parse_uevent(self.sock.recv(65536))
+            if name is not None:
+                names.add(name)
+                deadline = min(deadline, time.time() + SETTLE)
+        return names
+
+def terminal_size():
+    try:
+        return lsblkpro.terminal_size()
+    except (IOError, OSError):
+        return 0, 0
+
+def read_seqnum():
+    try:
+        with open(os.path.join(data.SYSFS, 'kernel', 'uevent_seqnum'), 'r') as f:
+            return f.read().strip()
+    except (IOError, OSError):
+        return None
+
+def parse_uevent(message):
+    """the (whole) device a kernel uevent is about, or None if it's not about a block device"""
+    fields = message.split(b'\0')
+    env = dict(field.split(b'=', 1) for field in fields[1:] if b'=' in field)
+    if env.get(b'SUBSYSTEM') != b'block' or b'DEVPATH' not in env:
+        return None
+    devpath = env[b'DEVPATH'].decode('ascii', 'replace')
+    if env.get(b'DEVTYPE') == b'partition':
+        # refresh the whole device so its partition list is right
+        devpath = os.path.dirname(devpath)
+    return os.path.basename(devpath)
+
+def clip(line, width):
+    """`line` cut to `width` columns, not counting (or cutting) its escape sequences"""
+    if len(line) <= width:
+        return line
+    out = []
+    pos = 0
+    for match in ESCAPE.finditer(line):
+        text = line[pos:match.start()][:width]
+        width -= len(text)
+        out.extend((text, match.group()))
+        pos = match.end()
+    out.append(line[pos:][:width])
+    return ''.join(out)
+
+class Screen(object):
+    """Repaints only the terminal lines that differ from the last frame."""
+    def __init__(self, out):
+        self.out = out
+        self.previous = None
+
+    def draw(self, lines):
+        height, width = terminal_size()
+        if height:
+            lines = lines[:height]
+        if width:
+            # (not the last column, which would wrap on some terminals)
+            lines = [clip(line, width - 1) for line in lines]
+        buf = []
+        if self.previous is None:
+            buf.append('\033[?25l\033[H\033[2J')
+            self.previous = []
+        for ii, line in enumerate(lines):
+            if ii >= len(self.previous) or self.previous[ii] != line:
+                buf.append('\033[{};1H{}\033[0m\033[K'.format(ii + 1, line))
+        if len(lines) < len(self.previous):
+            buf.append('\033[{};1H\033[J'.format(len(lines) + 1))
+        self.previous = lines
+        self.out.write(''.join(buf))
+        self.out.flush()
+
+    def close(self):
+        if self.previous is not None:
+            self.out.write('\033[0m\033[{};1H\033[?25h\n'.format(len(self.previous)))
+            self.out.flush()
+
+def run(host, args):
+    """`--watch`: keep `host` up to date from uevents and redraw what changed until ^C"""
+    monitor = UeventMonitor()
+    screen = Screen(sys.stdout)
+    table = None
+    changed = set()
+    try:
+        while True:
+            if table is None:
+                reuse = None
+            else:
+                reuse = {row.ent: row for row in table.rows if row.ent.name not in changed}
+            _, width = terminal_size()
+            args.width_limit = width - 1 if width else lsblkpro.INF
+            table = lsblkpro.Table(host, args, reuse=reuse)
+
+            status = "Every {}s: lsblkpro ({} devices){}".format(
+                args.watch, len(host.devices),
+                ', refreshed {}'.format(', '.join(sorted(changed))) if changed else '')
+            screen.draw([status, time.strftime('%c'), ''] + list(table.lines()))
+
+            names = monitor.wait(args.watch)
+            if names is None:
+                changed = host.refresh(args)
+            elif names:
+                changed = host.refresh(args, names)
+            else:
+                changed = set()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        screen.close()
@@ -0,0 +1,316 @@
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+from builtins import *
+
+import os
+import re
+import subprocess
+import time
+
+from . import data
+from . import timing
+
+# the columns zpool members get: state (ONLINE, DEGRADED, FAULTED, UNAVAIL, OFFLINE, AVAIL,
+# INUSE, ...), error counts, and what else `zpool status` says about them, e.g. 'replacing',
+# 'resilvering 1.70%', 'was /dev/sdq1'
+COLUMNS = ('zstate', 'zread', 'zwrite', 'zcksum', 'znote')
+
+# `zpool status` commands at once
+WORKERS = 8
+
+# the counters in /proc/spl/kstat/zfs/POOL/io that are kept (see kstat)
+KSTAT_IO = ('nread', 'nwritten', 'reads', 'writes')
+
+# top-level groups that aren't vdevs themselves, listed at the same depth as the pool
+SECTIONS = ('logs', 'cache', 'spares', 'special', 'dedup')
+
+# interior vdevs that stand in for one device while another takes its place
+STAND_INS = ('replacing', 'spare')
+
+FIELD = re.compile(r'^ *(pool|state|status|action|see|scan|remove|config|errors): ?(.*)$')
+HEADER = re.compile(r'^\s*NAME\s+STATE\s+READ\s+WRITE\s+CKSUM')
+PROGRESS = re.compile(r'([\d.]+)% done')
+
+class Vdev(object):
+    def __init__(self, name, state='', counts=('', '', ''), note=''):
+        self.name = name
+        self.state = state
+        self.read, self.write, self.cksum = counts
+        self.note = note
+        self.children = []
+
+class Pool(object):
+    """One pool from `zpool status`: its fields (state, status, action, scan, errors, ...) and
+    its vdev tree, rooted at a vdev named after the pool; SECTIONS hang off the root too.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.fields = {}
+        self.root = None
+
+    @property
+    def state(self):
+        return self.fields.get('state', '')
+
+    @property
+    def progress(self):
+        """how far the scrub or resilver in progress has got, e.g. '1.70%', or None"""
+        scan = self.fields.get('scan', '')
+        m = PROGRESS.search(scan)
+        return m.group(1) + '%' if m and 'in progress' in scan else None
+
+    def members(self):
+        """(vdev, zpath, [stand-in]) for every leaf vdev; the zpath is pool.vdev for the
+        top-level vdev it's in, pool.section for one directly in a section, or just the pool
+        for a device on its own"""
+        def walk(vdev, zpath, stand_ins):
+            if not vdev.children:
+                yield vdev, zpath, stand_ins
+            for child in vdev.children:
+                kind = child.name.rsplit('-', 1)[0]
+                for member in walk(child, zpath, stand_ins + [kind] if kind in STAND_INS else stand_ins):
+                    yield member
+
+        if self.root is None:
+            return
+        for top in self.root.children:
+            if top.name in SECTIONS:
+                for vdev in top.children:
+                    name = vdev.name if vdev.children else top.name
+                    for member in walk(vdev, '{}.{}'.format(self.name, name), []):
+                        yield member
+            elif top.children:
+                for member in walk(top, '{}.{}'.format(self.name, top.name), []):
+                    yield member
+            else:
+                yield top, self.name, []
+
+def parse(lines):
+    """Pools from the lines of `zpool status` output, each as soon as its config is read"""
+    pool = None
+    key = None    # the field a continuation line belongs to
+    stack = None  # [(depth, vdev)] down to the last one read, while reading a config
+    for line in lines:
+        if stack is not None:
+            if not line.strip():
+                stack = None
+                continue
+            line = line.lstrip('\t')
+            stripped = line.lstrip(' ')
+            depth = (len(line) - len(stripped)) // 2
+            fields = stripped.split()
+            vdev = Vdev(fields[0], *split_stats(fields[1:]))
+            if pool.root is None:
+                pool.root = vdev
+                stack.append((-1, vdev))
+                continue
+            if depth == 0:
+                # a section, listed level with the pool but part of it
+                del stack[1:]
+            else:
+                while stack[-1][0] >= depth:
+                    stack.pop()
+            stack[-1][1].children.append(vdev)
+            stack.append((depth, vdev))
+            continue
+
+        m = FIELD.match(line)
+        if m:
+            key, value = m.groups()
+            if key == 'pool':
+                if pool is not None:
+                    yield pool
+                pool = Pool(value.strip())
+            elif pool is not None:
+                pool.fields[key] = value.strip()
+        elif HEADER.match(line) and pool is not None:
+            stack = []
+        elif pool is not None and key in pool.fields and line.strip():
+            pool.fields[key] += ' ' + line.strip()
+    if pool is not None:
+        yield pool
+
+def split_stats(fields):
+    """(state, (read, write, cksum), note) from what follows a vdev's name; spares and cache
+    devices have a state and nothing else, sections not even that"""
+    if len(fields) >= 4:
+        return fields[0], tuple(fields[1:4]), ' '.join(fields[4:])
+    return (fields[0] if fields else ''), ('', '', ''), ' '.join(fields[1:])
+
+def members(pools):
+    """member name -> (zpath, {column: value}) for every device in `pools`. A device in use in
+    one place and listed under spares keeps the place it's in use; a spare shared by several
+    pools is '*.spares'."""
+    result = {}
+    for pool in pools:
+        progress = pool.progress
+        for vdev, zpath, stand_ins in pool.members():
+            note = []
+            note.extend(stand_ins)
+            if vdev.note == '(resilvering)' and progress:
+                note.append('resilvering ' + progress)
+            elif vdev.note:
+                note.append(vdev.note.strip('()'))
+            values = {key: value for key, value in zip(COLUMNS, (
+                vdev.state, vdev.read, vdev.write, vdev.cksum, ', '.join(note))) if value}
+
+            spare = zpath.endswith('.spares')
+            if vdev.name in result:
+                other = result[vdev.name][0]
+                if spare and other.endswith('.spares') and other != zpath:
+                    result[vdev.name] = ('*.spares', values)
+                if spare or not other.endswith('.spares'):
+                    continue
+            result[vdev.name] = (zpath, values)
+    return trimmed(result)
+
+def trimmed(result):
+    """leave off the '-0' of pool.vdev-0 in pools whose only top-level vdev that is"""
+    by_pool = {}
+    for zpath, _ in result.values():
+        pool, sep, vdev = zpath.partition('.')
+        if sep:
+            by_pool.setdefault(pool, set()).add(vdev)
+    trim = set(pool for pool, vdevs in by_pool.items() if all(vdev.endswith('-0') for vdev in vdevs))
+    return {name: (zpath[:-2] if zpath.partition('.')[0] in trim and zpath.endswith('-0') else zpath, values)
+            for name, (zpath, values) in result.items()}
+
+def status(pool, timeout=None, flags=('-p',)):
+    """the Pools in `zpool status` output for `pool`; -p for exact error counts"""
+    cmd = data.ZPOOL_STATUS + list(flags) + [pool]
+    try:
+        out = data.run_command(cmd, timeout=timeout, stderr=subprocess.STDOUT)
+    except subprocess.CalledProcessError as ex:
+        if flags and b'invalid option' in (ex.output or b''):
+            # zfs before 0.7 doesn't have -p
+            return status(pool, timeout, flags=())
+        raise
+    return list(parse(out.decode(data.CLI_UTILS_ENCODING).splitlines()))
+
+def status_all(timeout=None):
+    """the Pools in plain `zpool status` output: every pool, and the one form a sudoers entry
+    for exactly `zpool status` allows. Error counts may be rounded (1.2K) without -p."""
+    out = data.run_command(data.ZPOOL_STATUS, timeout=timeout, stderr=subprocess.STDOUT)
+    return list(parse(out.decode(data.CLI_UTILS_ENCODING).splitlines()))
+
+def kstat_root():
+    return os.path.join(data.PROC, 'spl', 'kstat', 'zfs')
+
+def imported():
+    """names of the imported pools, from /proc/spl/kstat/zfs; None without the ZFS module"""
+    root = kstat_root()
+    try:
+        entries = os.listdir(root)
+    except OSError:
+        return None
+    # (arcstats, dmu_tx, ... are files: global, not pools)
+    return [name for name in entries if os.path.isdir(os.path.join(root, name))]
+
+def runs_status(mode='auto'):
+    """whether collect(`mode`) would run `zpool status`, by what's imported now"""
+    return mode == 'always' or (mode == 'auto' and bool(imported()))
+
+def kstat():
+    """pool -> (state, {counter: value}) for the imported pools, from /proc/spl/kstat/zfs,
+    which anyone can read; None without the ZFS module. The state is '' before zfs 0.8, and
+    the counters (see KSTAT_IO) are missing after 2.1."""
+    names = imported()
+    if names is None:
+        return None
+    pools = {}
+    for name in names:
+        path = os.path.join(kstat_root(), name)
+        try:
+            with open(os.path.join(path, 'state')) as f:
+                state = f.read().strip()
+        except (IOError, OSError):
+            state = ''
+        pools[name] = (state, read_kstat_io(path))
+    return pools
+
+def read_kstat_io(path):
+    """KSTAT_IO from a KSTAT_TYPE_IO file: a header line, then a line of names and one of values"""
+    try:
+        with open(os.path.join(path, 'io')) as f:
+            lines = f.read().splitlines()
+    except (IOError, OSError):
+        return {}
+    if len(lines) < 3:
+        return {}
+    counters = dict(zip(lines[1].split(), lines[2].split()))
+    return {key: int(counters[key]) for key in KSTAT_IO if counters.get(key, '').isdigit()}
+
+@timing.timed('zpool')
+def collect(mode='auto', timeout=None):
+    """(kstat(), fetch()'s pools or exception), or (kstat(), None) when `zpool status` isn't
+    run: with `mode` 'never', or 'auto' when /proc/spl/kstat/zfs says no pool is imported or
+    isn't there (no ZFS module)"""
+    kstats = kstat()
+    if kstats is not None:
+        timing.count('zpools', len(kstats))
+    if mode == 'never' or (mode == 'auto' and not kstats):
+        return kstats, None
+    return kstats, fetch(timeout, names=sorted(kstats) if kstats is not None else None)
+
+def fetch(timeout=None, names=None):
+    """The Pools `zpool status` reports, one `zpool status POOL` per pool (the imported
+    `names`, or what `zpool list` says), run concurrently so that a big or slow pool doesn't hold
+    up the rest. Returns the exception instead if `zpool` isn't there or won't run without a
+    password. If sudo won't run `zpool status POOL`, tries plain `zpool status` before giving
+    up, for sudoers entries that allow just that."""
+    import concurrent.futures
+
+    deadline = None if timeout is None else time.time() + timeout
+
+    if names is None:
+        try:
+            # (doesn't need root, unlike status on most systems)
+            out = data.run_command(data.ZPOOL_LIST, timeout=timeout, stderr=subprocess.DEVNULL)
+        except OSError as ex:
+            return ex
+        except subprocess.CalledProcessError:
+            # no ZFS module, say; `zpool status` says why, or asks for sudoers
+            return fetch_all(time_left(deadline))
+        names = out.decode(data.CLI_UTILS_ENCODING).split()
+    if not names:
+        return []
+    if len(names) == 1:
+        try:
+            return status(names[0], timeout=time_left(deadline))
+        except OSError as ex:
+            return ex
+        except subprocess.CalledProcessError:
+            return fetch_all(time_left(deadline))
+
+    pools = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(WORKERS, len(names))) as executor:
+        futures = [executor.submit(status_by, name, deadline) for name in names]
+        for future in futures:
+            try:
+                pools.extend(future.result())
+            except OSError as ex:
+                for other in futures:
+                    other.cancel()
+                return ex
+            except subprocess.CalledProcessError:
+                for other in futures:
+                    other.cancel()
+                break
+        else:
+            return pools
+    return fetch_all(time_left(deadline))
+
+def time_left(deadline):
+    """seconds until `deadline` (a time.time()), or None for no deadline"""
+    return None if deadline is None else max(0, deadline - time.time())
+
+def status_by(pool, deadline):
+    """status(`pool`) in the time left before `deadline` when it starts, not when it was
+    queued: jobs queued behind WORKERS others get less"""
+    return status(pool, timeout=time_left(deadline))
+
+def fetch_all(timeout=None):
+    """status_all(), or the exception, once `zpool status POOL` has been refused"""
+    try:
+        return status_all(timeout=timeout)
+    except (subprocess.CalledProcessError, OSError) as ex:
+        return ex
@@ -4,9 +4,10 @@ setup(
     name = 'lsblkpro',
     version = '0',
     packages = ['lsblkpro'],
+    # (os.scandir, concurrent.futures, subprocess timeouts, time.thread_time)
+    python_requires = '>=3.7',
     install_requires = [
         'future>=0.15.2',
-        'bytesize>=0',
         'pint>=0.6',
     ],
     entry_points = {
@@ -23,4 +24,9 @@ setup(
     keywords = ['lsblk', 'zfs', 'zpool', 'console'],
     url = "https://github.com/cpiro/lsblkpro",
     bugtrack_url = "https://github.com/cpiro/lsblkpro/issues",
+    classifiers = [
+        'Programming Language :: Python :: 3',
+        'Programming Language :: Python :: 3 :: Only',
+        'Operating System :: POSIX :: Linux',
+    ],
 )
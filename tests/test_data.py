@@ -0,0 +1,136 @@
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+from builtins import *
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from lsblkpro import data, lsblkpro
+
+def device(name, **lsblk):
+    dev = data.Device(name)
+    dev.lsblk = data.Record([('NAME', name)] + sorted(lsblk.items()))
+    dev.partitions = []
+    return dev
+
+def partition(name, dev, **lsblk):
+    part = data.Partition(name, dev)
+    part.lsblk = data.Record([('NAME', name)] + sorted(lsblk.items()))
+    dev.partitions.append(part)
+    return part
+
+def host_of(*entities):
+    host = data.Host()
+    host.devices = {entity.name: entity for entity in entities if isinstance(entity, data.Device)}
+    host.partitions = {entity.name: entity for entity in entities if isinstance(entity, data.Partition)}
+    return host
+
+class IdentifyTest(unittest.TestCase):
+    def setUp(self):
+        # two paths to one multipathed drive, and another drive
+        self.sda = device('sda', WWN='0x5000c5', SERIAL='Z1Z0')
+        self.sdb = device('sdb', WWN='0x5000c5', SERIAL='Z1Z0')
+        self.sda1 = partition('sda1', self.sda, PARTUUID='p-a-1')
+        self.sdc = device('sdc', WWN='0x5000c6')
+        self.sdc.by = {'by-vdev': 'a1'}
+        self.host = host_of(self.sda, self.sdb, self.sda1, self.sdc)
+        self.host.reindex()
+
+    def test_unique(self):
+        self.assertIs(self.host.entity('sda'), self.sda)
+        self.assertIs(self.host.entity('0x5000c6'), self.sdc)
+        self.assertIs(self.host.entity('a1'), self.sdc)
+        self.assertIs(self.host.entity('p-a-1'), self.sda1)
+
+    def test_ambiguous(self):
+        self.assertIsNone(self.host.identities['0x5000c5'])
+        self.assertIsNone(self.host.identities['Z1Z0'])
+        with self.assertRaises(KeyError):
+            self.host.entity('0x5000c5')
+        # a third claimant doesn't settle it
+        self.host.identify(self.sdc, ['0x5000c5'])
+        self.assertIsNone(self.host.identities['0x5000c5'])
+
+    def test_kernel_name_wins(self):
+        self.host.identify(self.sdc, ['sda'])
+        self.assertIs(self.host.entity('sda'), self.sda)
+
+    def test_unknown(self):
+        self.assertNotIn('sdz', self.host.identities)
+        with self.assertRaises(KeyError):
+            self.host.entity('sdz')
+        self.host.identify(self.sdc, [None, ''])
+        self.assertNotIn('', self.host.identities)
+
+    def test_partitions_dont_inherit(self):
+        # lsblk gives a partition its drive's WWN; it mustn't make the WWN ambiguous
+        sdd = device('sdd', WWN='0x5000c7')
+        sdd1 = partition('sdd1', sdd, WWN='0x5000c7', SERIAL='S')
+        host = host_of(sdd, sdd1)
+        host.reindex()
+        self.assertIs(host.entity('0x5000c7'), sdd)
+        self.assertNotIn('S', host.identities)
+
+    def test_reindex(self):
+        # a path to the drive goes away: its WWN is the other's again
+        del self.host.devices['sdb']
+        self.host.reindex()
+        self.assertIs(self.host.entity('0x5000c5'), self.sda)
+        self.assertNotIn('sdb', self.host.identities)
+        # an entity is replaced by a new one of the same name
+        sdc = device('sdc', WWN='0x5000c6')
+        sdc.by = {'by-vdev': 'a2'}
+        self.host.devices['sdc'] = sdc
+        self.host.reindex()
+        self.assertIs(self.host.entity('sdc'), sdc)
+        self.assertIs(self.host.entity('a2'), sdc)
+        self.assertNotIn('a1', self.host.identities)
+
+class RefreshTest(unittest.TestCase):
+    """a host of two paths to one drive (sda, sdb) and another drive (sdc), in a temporary
+    directory, read with the native collector"""
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        for name, directory in (('SYSFS', 'sys'), ('DEV', 'dev'), ('UDEV_DATA', 'udev'), ('PROC', 'proc')):
+            self.addCleanup(setattr, data, name, getattr(data, name))
+            setattr(data, name, os.path.join(self.root, directory))
+        self.put(os.path.join('proc', 'self', 'mountinfo'), '')
+        self.disk('sda', 0, '0x5000c5')
+        self.disk('sdb', 16, '0x5000c5')
+        self.disk('sdc', 32, '0x5000c6')
+        self.args = lsblkpro.parse_args(['--collector', 'native', '--zpool-status', 'never'])
+
+    def put(self, path, text):
+        path = os.path.join(self.root, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with io.open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+
+    def disk(self, name, minor, wwn):
+        self.put(os.path.join('sys', 'block', name, 'size'), '2048\n')
+        self.put(os.path.join('sys', 'block', name, 'dev'), '8:{}\n'.format(minor))
+        self.put(os.path.join('udev', 'b8:{}'.format(minor)), 'E:ID_WWN={}\n'.format(wwn))
+
+    def test_refresh(self):
+        host = data.Host.go(self.args)
+        self.assertIsNone(host.identities['0x5000c5'])
+        old_sda = host.entity('sda')
+
+        # sda is refreshed alone: sdb still claims the WWN
+        host.refresh(self.args, ['sda'])
+        self.assertIsNot(host.entity('sda'), old_sda)
+        self.assertIsNone(host.identities['0x5000c5'])
+        self.assertIs(host.entity('0x5000c6'), host.devices['sdc'])
+
+        # sdb goes away, and a refresh of it forgets it
+        shutil.rmtree(os.path.join(data.SYSFS, 'block', 'sdb'))
+        self.assertIn('sdb', host.refresh(self.args, ['sdb']))
+        self.assertNotIn('sdb', host.identities)
+        # ...but only reindex knows the WWN is no longer shared
+        self.assertIsNone(host.identities['0x5000c5'])
+        host.reindex()
+        self.assertIs(host.entity('0x5000c5'), host.devices['sda'])
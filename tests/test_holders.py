@@ -0,0 +1,68 @@
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+from builtins import *
+
+import unittest
+
+from lsblkpro import data, holders
+
+def devices(spec):
+    """name -> Device from {name: ([holder], {partition: [holder]})}"""
+    result = {}
+    for name, (holder_names, partitions) in spec.items():
+        dev = result[name] = data.Device(name)
+        dev.holder_names = list(holder_names)
+        dev.partitions = []
+        for part_name, part_holders in sorted(partitions.items()):
+            part = data.Partition(part_name, dev)
+            part.holder_names = list(part_holders)
+            dev.partitions.append(part)
+    return result
+
+class HolderGraphTest(unittest.TestCase):
+    def test_stack(self):
+        # LVM on an md mirror of two disks' first partitions, and a disk on its own
+        graph = holders.HolderGraph(devices({
+            'sda': ([], {'sda1': ['md0'], 'sda2': []}),
+            'sdb': ([], {'sdb1': ['md0']}),
+            'sdc': ([], {}),
+            'md0': (['dm-0'], {}),
+            'dm-0': ([], {}),
+        }))
+        self.assertEqual(graph.depth, {'sda': 0, 'sdb': 0, 'sdc': 0, 'md0': 1, 'dm-0': 2})
+        self.assertEqual(graph.order, ['sda', 'sdb', 'md0', 'dm-0', 'sdc'])
+        self.assertEqual(graph.holders['sda'], ['md0'])
+        self.assertEqual(sorted(graph.members['md0']), ['sda', 'sdb'])
+
+    def test_several_holders(self):
+        # one disk's partitions in an md array and under an LVM volume
+        graph = holders.HolderGraph(devices({
+            'sdd': ([], {'sdd1': ['md1'], 'sdd2': ['dm-1']}),
+            'sde': ([], {'sde1': ['md1']}),
+            'md1': ([], {}),
+            'dm-1': ([], {}),
+            'sda': ([], {}),
+        }))
+        self.assertEqual(graph.holders['sdd'], ['dm-1', 'md1'])
+        self.assertEqual(graph.depth, {'sda': 0, 'sdd': 0, 'sde': 0, 'md1': 1, 'dm-1': 1})
+        # each device once, under the first stack that reaches it, every holder after its members
+        self.assertEqual(graph.order, ['sda', 'sdd', 'dm-1', 'sde', 'md1'])
+
+    def test_whole_disk_and_unknown_holders(self):
+        # a holder that isn't among the devices (filtered out, say) is left out
+        graph = holders.HolderGraph(devices({
+            'sdf': (['dm-2'], {}),
+            'sdg': (['dm-2', 'dm-9'], {}),
+            'dm-2': ([], {}),
+        }))
+        self.assertEqual(graph.holders['sdg'], ['dm-2'])
+        self.assertEqual(graph.order, ['sdf', 'sdg', 'dm-2'])
+        self.assertEqual(graph.depth['dm-2'], 1)
+
+    def test_cycle(self):
+        graph = holders.HolderGraph(devices({
+            'dm-3': (['dm-4'], {}),
+            'dm-4': (['dm-3'], {}),
+            'sda': ([], {}),
+        }))
+        self.assertEqual(sorted(graph.order), ['dm-3', 'dm-4', 'sda'])
+        self.assertEqual(graph.depth['dm-3'], 0)
@@ -0,0 +1,35 @@
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+from builtins import *
+
+import os
+import unittest
+
+from lsblkpro import lsblkpro
+
+class ShortFormatterTest(unittest.TestCase):
+    def test_binary(self):
+        formatter = lsblkpro.short_formatter(base=1024)
+        self.assertEqual(formatter(0), '0B')
+        self.assertEqual(formatter(512), '512B')
+        self.assertEqual(formatter(1024), '1.0K')
+        self.assertEqual(formatter(480 * 1024 ** 3), '480G')
+        self.assertEqual(formatter(4000787030016), '3.6T')
+        # never more than four characters
+        self.assertEqual(formatter(1010 * 1024 ** 3), '1.0T')
+
+    def test_guessed(self):
+        formatter = lsblkpro.short_formatter(tolerance=0.025)
+        # sold in decimal units
+        self.assertEqual(formatter(4000787030016), '4.0T')
+        self.assertEqual(formatter(500107862016), '500G')
+        # round in binary ones
+        self.assertEqual(formatter(480 * 1024 ** 3), '480G')
+        # round in neither
+        self.assertEqual(formatter(1333595676672), '1.2T')
+
+    def test_no_pint(self):
+        import subprocess
+        import sys
+        code = "import sys, lsblkpro.lsblkpro as l; l.short_formatter()(1); print('pint' in sys.modules)"
+        self.assertEqual(subprocess.check_output(
+            [sys.executable, '-c', code], cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).strip(), b'False')
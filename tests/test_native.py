@@ -0,0 +1,166 @@
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+from builtins import *
+
+import io
+import os
+import shutil
+import argparse
+import tempfile
+import unittest
+from unittest import mock
+
+from lsblkpro import data, native
+
+class FakeHost(unittest.TestCase):
+    """sysfs, /dev, the udev database and /proc in a temporary directory"""
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        for name, directory in (('SYSFS', 'sys'), ('DEV', 'dev'), ('UDEV_DATA', 'udev'), ('PROC', 'proc')):
+            self.addCleanup(setattr, data, name, getattr(data, name))
+            setattr(data, name, os.path.join(self.root, directory))
+
+    def put(self, path, text):
+        path = os.path.join(self.root, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with io.open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+
+    def block(self, name, major, minor, sectors, parent=None, **attributes):
+        """the entity for a device (or partition of `parent`) with sysfs `attributes`, e.g. queue/rotational"""
+        directory = os.path.join('sys', 'block', parent.name, name) if parent else os.path.join('sys', 'block', name)
+        self.put(os.path.join(directory, 'size'), '{}\n'.format(sectors))
+        for filename, value in attributes.items():
+            self.put(os.path.join(directory, filename.replace('__', '/')), '{}\n'.format(value))
+        entity = data.Partition(name, parent) if parent else data.Device(name)
+        entity.major, entity.minor = major, minor
+        return entity
+
+    def udev(self, entity, **props):
+        self.put(os.path.join('udev', 'b{}:{}'.format(entity.major, entity.minor)),
+                 ''.join('E:{}={}\n'.format(k, v) for k, v in sorted(props.items())))
+
+    def record(self, entity, parent=None, all_devices=False):
+        args = argparse.Namespace(all_devices=all_devices, projection=None)
+        self.put(os.path.join('proc', 'self', 'mountinfo'), '')
+        return native.Collector(args).record_for(entity, parent)
+
+class RecordTest(FakeHost):
+    def test_disk(self):
+        sda = self.block('sda', 8, 0, 7814037168, queue__rotational=1, queue__scheduler='none [mq-deadline]',
+                         device__model='ST4000NM0033', ro=0)
+        self.udev(sda, ID_SCSI_SERIAL='Z1Z0', ID_SERIAL_SHORT='other', ID_WWN='0x5000c5',
+                  ID_PART_TABLE_TYPE='gpt')
+        rec = self.record(sda)
+        self.assertEqual(rec['NAME'], 'sda')
+        self.assertEqual(rec['PATH'], os.path.join(data.DEV, 'sda'))
+        self.assertEqual(rec['SIZE'], str(7814037168 * 512))
+        self.assertEqual(rec['TYPE'], 'disk')
+        self.assertEqual(rec['MAJ:MIN'], '8:0')
+        self.assertEqual(rec['ROTA'], '1')
+        self.assertEqual(rec['SCHED'], 'mq-deadline')
+        self.assertEqual(rec['MODEL'], 'ST4000NM0033')
+        self.assertEqual(rec['SERIAL'], 'Z1Z0')
+        self.assertEqual(rec['WWN'], '0x5000c5')
+        self.assertEqual(rec['PTTYPE'], 'gpt')
+        self.assertEqual(rec['PKNAME'], '')
+
+    def test_serial_from_sysfs(self):
+        nvme = self.block('nvme0n1', 259, 0, 2048, device__serial='S4EV')
+        self.assertEqual(self.record(nvme)['SERIAL'], 'S4EV')
+
+    def test_partition(self):
+        sda = self.block('sda', 8, 0, 4096, queue__rotational=0, device__model='X')
+        sda1 = self.block('sda1', 8, 1, 2048, parent=sda, ro=1)
+        self.udev(sda1, ID_FS_TYPE='ext4', ID_FS_UUID='u-u-i-d', ID_PART_ENTRY_NAME='root')
+        rec = self.record(sda1, sda)
+        self.assertEqual(rec['TYPE'], 'part')
+        self.assertEqual(rec['PKNAME'], 'sda')
+        # its own attributes, but the queue of its disk
+        self.assertEqual(rec['RO'], '1')
+        self.assertEqual(rec['ROTA'], '0')
+        self.assertEqual(rec['MODEL'], '')
+        self.assertEqual((rec['FSTYPE'], rec['UUID'], rec['PARTLABEL']), ('ext4', 'u-u-i-d', 'root'))
+
+    def test_dm(self):
+        dm = self.block('dm-0', 253, 0, 2048, dm__name='vg0-lv0', dm__uuid='LVM-abcdef')
+        self.put(os.path.join('sys', 'block', 'dm-0', 'slaves', 'sdb2'), '')
+        rec = self.record(dm)
+        self.assertEqual(rec['KNAME'], 'dm-0')
+        self.assertEqual(rec['NAME'], 'vg0-lv0')
+        self.assertEqual(rec['PATH'], os.path.join(data.DEV, 'mapper', 'vg0-lv0'))
+        self.assertEqual(rec['TYPE'], 'lvm')
+        self.assertEqual(rec['PKNAME'], 'sdb2')
+
+    def test_skipped(self):
+        sr0 = self.block('sr0', 11, 0, 0, device__type=5)
+        loop0 = self.block('loop0', 7, 0, 0)
+        ram0 = self.block('ram0', 1, 0, 8192)
+        for entity in (sr0, loop0, ram0):
+            self.assertIsNone(self.record(entity), entity.name)
+            self.assertIsNotNone(self.record(entity, all_devices=True), entity.name)
+        self.assertEqual(self.record(sr0, all_devices=True)['TYPE'], 'rom')
+
+class EntityTypeTest(FakeHost):
+    def entity_type(self, entity):
+        return native.entity_type(entity, os.path.join(data.SYSFS, 'block', entity.name), None)
+
+    def test_types(self):
+        self.assertEqual(self.entity_type(self.block('md0', 9, 0, 1, md__level='raid1')), 'raid1')
+        self.assertEqual(self.entity_type(self.block('dm-1', 253, 1, 1, dm__uuid='CRYPT-LUKS2-x')), 'crypt')
+        self.assertEqual(self.entity_type(self.block('dm-2', 253, 2, 1, dm__uuid='part1-mpath-x')), 'part')
+        self.assertEqual(self.entity_type(self.block('dm-3', 253, 3, 1, dm__uuid='')), 'dm')
+        self.assertEqual(self.entity_type(self.block('loop1', 7, 1, 1)), 'loop')
+        self.assertEqual(self.entity_type(self.block('sdc', 8, 32, 1)), 'disk')
+
+class TransportTest(FakeHost):
+    def device(self, name, target):
+        path = os.path.join(data.SYSFS, 'block', name)
+        os.makedirs(os.path.join(self.root, 'sys', target))
+        os.makedirs(path)
+        os.symlink(os.path.join(self.root, 'sys', target), os.path.join(path, 'device'))
+        return path
+
+    def test_transports(self):
+        sata = self.device('sda', 'devices/pci0000:00/ata1/host0/target0:0:0/0:0:0:0')
+        self.assertEqual(native.hctl_and_transport(sata), ('0:0:0:0', 'sata'))
+        sas = self.device('sdb', 'devices/host2/port-2:0/end_device-2:0/target2:0:0/2:0:0:0')
+        self.assertEqual(native.hctl_and_transport(sas), ('2:0:0:0', 'sas'))
+        nvme = self.device('nvme0n1', 'devices/pci0000:00/nvme/nvme0')
+        self.assertEqual(native.hctl_and_transport(nvme), ('', 'nvme'))
+        os.makedirs(os.path.join(data.SYSFS, 'block', 'zram0'))
+        self.assertEqual(native.hctl_and_transport(os.path.join(data.SYSFS, 'block', 'zram0')), ('', ''))
+
+class MountpointsTest(FakeHost):
+    def test_mountinfo(self):
+        self.put(os.path.join('proc', 'self', 'mountinfo'),
+                 '22 1 8:1 / / rw,relatime shared:1 - ext4 /dev/sda1 rw\n'
+                 '40 22 8:17 / /mnt/my\\040disk rw shared:2 - ext4 /dev/sdb1 rw\n'
+                 '41 22 8:1 /home /home rw shared:3 - ext4 /dev/sda1 rw\n')
+        self.put(os.path.join('proc', 'swaps'), 'Filename\tType\tSize\tUsed\tPriority\n'
+                 '/dev/sda2 partition 1048572 0 -2\n/dev/gone partition 1 0 -3\n')
+        real_stat = os.stat
+
+        def stat(path, *args, **kwargs):
+            if path == '/dev/sda2':
+                return mock.Mock(st_rdev=os.makedev(8, 2))
+            if path == '/dev/gone':
+                raise OSError(2, 'No such file or directory')
+            return real_stat(path, *args, **kwargs)
+
+        with mock.patch.object(os, 'stat', stat):
+            mounts = native.read_mountpoints()
+        # the first mount wins, like lsblk
+        self.assertEqual(mounts, {(8, 1): '/', (8, 17): '/mnt/my disk', (8, 2): '[SWAP]'})
+
+class CrossCheckTest(unittest.TestCase):
+    def test_both_ways(self):
+        mine = [{'KNAME': 'sda', 'SIZE': '1'}, {'KNAME': 'sdc', 'SIZE': '3'}]
+        theirs = [{'KNAME': 'sda', 'SIZE': '2'}, {'KNAME': 'sdb', 'SIZE': '2'}]
+        self.assertEqual(list(native.cross_check(mine, theirs)), [
+            ('sda', 'SIZE', '1', '2'),
+            ('sdb', None, None, theirs[1]),
+            ('sdc', None, mine[1], None),
+        ])
+        self.assertEqual(list(native.cross_check(theirs, theirs)), [])
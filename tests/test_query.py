@@ -0,0 +1,108 @@
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+from builtins import *
+
+import unittest
+
+from lsblkpro import query
+
+class Row(dict):
+    """what a --where sees of a table row: its fields, and the size as laid out"""
+    def __init__(self, size=None, **fields):
+        super().__init__(fields)
+        self.size = size
+
+def matches(exprs, row):
+    return query.Query(exprs).matches(row)
+
+class ParseSizeTest(unittest.TestCase):
+    def test_plain(self):
+        self.assertEqual(query.parse_size('512'), 512)
+        self.assertEqual(query.parse_size(' 1.5 '), 1.5)
+
+    def test_prefixes(self):
+        self.assertEqual(query.parse_size('4k'), 4000)
+        self.assertEqual(query.parse_size('4KiB'), 4096)
+        self.assertEqual(query.parse_size('2T'), 2 * 1000 ** 4)
+        self.assertEqual(query.parse_size('1.5Gi'), 3 * 1024 ** 3 // 2)
+        self.assertEqual(query.parse_size('1EB'), 1000 ** 6)
+
+class ParserTest(unittest.TestCase):
+    def test_precedence(self):
+        node = query.parse('a=1 or b=2 and c=3')
+        self.assertIsInstance(node, query.Or)
+        self.assertIsInstance(node.nodes[1], query.And)
+        node = query.parse('(a=1 || b=2) && !c')
+        self.assertIsInstance(node, query.And)
+        self.assertIsInstance(node.nodes[0], query.Or)
+        self.assertIsInstance(node.nodes[1], query.Not)
+
+    def test_values(self):
+        node = query.parse('MOUNTPOINT="/mnt/my disk"')
+        self.assertEqual(node.value, '/mnt/my disk')
+        node = query.parse(r"MODEL='it\'s'")
+        self.assertEqual(node.value, "it's")
+        node = query.parse('NAME=~sd(a|b) and TYPE=disk')
+        self.assertEqual(node.nodes[0].value, 'sd(a|b)')
+        node = query.parse('TYPE in (disk, "rai d1",part)')
+        self.assertEqual(node.value, ['disk', 'rai d1', 'part'])
+
+    def test_legacy(self):
+        node = query.parse('MOUNTPOINT=/mnt/my disk')
+        self.assertEqual((node.key, node.op, node.value), ('MOUNTPOINT', '==', '/mnt/my disk'))
+
+    def test_errors(self):
+        for text in ('(a=1', 'a=1 and', 'and=1', 'a in disk', 'a=1 b=2 (', 'a=~(', 'size=~1'):
+            with self.assertRaises(query.QueryError, msg=text):
+                query.Query([text])
+
+    def test_str(self):
+        self.assertEqual(str(query.parse('SIZE>1k')), 'SIZE > 1k (1000 bytes)')
+        self.assertEqual(str(query.parse('a=1 and (b or not c)')), 'a == 1 and (b is set or not (c is set))')
+
+class MatchTest(unittest.TestCase):
+    def test_compare(self):
+        row = Row(NAME='sda', TYPE='disk', MOUNTPOINT='')
+        self.assertTrue(matches(['NAME=sda'], row))
+        self.assertFalse(matches(['NAME!=sda'], row))
+        self.assertTrue(matches(['NAME'], row))
+        self.assertFalse(matches(['MOUNTPOINT'], row))
+        self.assertFalse(matches(['VENDOR'], row))
+
+    def test_regexp_and_glob(self):
+        row = Row(NAME='sdab', MODEL='ST4000NM')
+        self.assertTrue(matches(['NAME=~sd[a-z]+'], row))
+        self.assertTrue(matches(['MODEL!~WDC'], row))
+        self.assertTrue(matches(['NAME glob sd?b'], row))
+        self.assertFalse(matches(['NAME glob sd?'], row))
+
+    def test_in(self):
+        self.assertTrue(matches(['TYPE in (raid1, raid10)'], Row(TYPE='raid10')))
+        self.assertFalse(matches(['TYPE in (raid1, raid10)'], Row(TYPE='raid0')))
+
+    def test_size(self):
+        row = Row(size='4.0T', SIZE='4000787030016')
+        self.assertTrue(matches(['SIZE>3.5T'], row))
+        self.assertTrue(matches(['SIZE<4TiB'], row))
+        self.assertFalse(matches(['SIZE>=4TiB'], row))
+        self.assertTrue(matches(['SIZE=4.0T'], row))
+        self.assertFalse(matches(['ROTA>0'], Row(ROTA='')))
+
+    def test_several(self):
+        row = Row(NAME='sda', TYPE='disk')
+        self.assertTrue(matches(['NAME=sda', 'TYPE=disk'], row))
+        self.assertFalse(matches(['NAME=sda', 'TYPE=part'], row))
+        self.assertTrue(matches(['not (TYPE=part or NAME=sdb)'], row))
+
+class DecideTest(unittest.TestCase):
+    def test_pushable(self):
+        self.assertTrue(query.Query(['TYPE=disk and MODEL=x']).pushable)
+        self.assertFalse(query.Query(['MODEL=x']).pushable)
+
+    def test_decide(self):
+        probe = {'NAME': 'sda', 'KNAME': 'sda', 'TYPE': 'disk', 'TRAN': 'sata'}
+        self.assertIs(query.Query(['TRAN=sas']).decide(probe), False)
+        self.assertIs(query.Query(['TRAN=sas or TYPE=disk']).decide(probe), True)
+        self.assertIsNone(query.Query(['TYPE=disk and MODEL=x']).decide(probe))
+        self.assertIs(query.Query(['TYPE=part and MODEL=x']).decide(probe), False)
+        self.assertIs(query.Query(['not MODEL=x or TYPE=disk']).decide(probe), True)
+        self.assertIsNone(query.Query(['not MODEL=x']).decide(probe))
@@ -0,0 +1,165 @@
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+from builtins import *
+
+import io
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import unittest
+from unittest import mock
+
+from lsblkpro import data, snapshot
+
+def sample_host():
+    host = data.Host()
+    sda = data.Device('sda')
+    sda.major, sda.minor = 8, 0
+    sda.lsblk = data.Record([('NAME', 'sda'), ('SIZE', '4000787030016'), ('TYPE', 'disk')])
+    sda.by = {'by-vdev': 'a1'}
+    sda.smart = {'temp': 31}
+    sda1 = data.Partition('sda1', sda)
+    sda1.major, sda1.minor = 8, 1
+    sda1.lsblk = data.Record([('NAME', 'sda1'), ('TYPE', 'part'), ('FSTYPE', 'zfs_member')])
+    sda1.holder_names = []
+    sda1.zpath = 'tank.raidz2-0'
+    sda1.zfs = {'zstate': 'ONLINE', 'zcksum': '2'}
+    sda1.iostat = {'r/s': 1.5}
+    sda.partitions = [sda1]
+    host.devices = {'sda': sda}
+    host.partitions = {'sda1': sda1}
+    host.missing_from_lsblk = []
+    host.zpool_status_result = True
+    host.zpool_states = {'tank': 'ONLINE'}
+    host.zpool_io = {'tank': {'nread': 1024}}
+    host.skipped = [('smart', 'timed out')]
+    return host
+
+class FakeHost(unittest.TestCase):
+    """where the fingerprint looks, and the snapshots, in a temporary directory"""
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        for name, directory in (('SYSFS', 'sys'), ('DEV', 'dev'), ('UDEV_DATA', os.path.join('run', 'udev', 'data')),
+                                ('PROC', 'proc')):
+            self.addCleanup(setattr, data, name, getattr(data, name))
+            setattr(data, name, os.path.join(self.root, directory))
+        self.put(os.path.join('sys', 'kernel', 'uevent_seqnum'), '100\n')
+        self.put(os.path.join('sys', 'block', 'sda', 'size'), '8\n')
+        self.put(os.path.join('proc', 'self', 'mountinfo'), '22 1 8:1 / / rw - ext4 /dev/sda1 rw\n')
+        os.makedirs(data.UDEV_DATA)
+        self.path = os.path.join(self.root, 'snapshot')
+        self.args = argparse.Namespace(all_devices=False, collector='auto', projection=None, iostat=None, smart=None)
+
+    def put(self, path, text):
+        path = os.path.join(self.root, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with io.open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+
+class RoundTripTest(FakeHost):
+    def test_round_trip(self):
+        snapshot.store(self.path, sample_host(), hostname='box')
+        host = snapshot.load(self.path)
+        sda, sda1 = host.devices['sda'], host.partitions['sda1']
+        self.assertEqual((sda.major, sda.minor, sda.lsblk['SIZE'], sda.by, sda.smart),
+                         (8, 0, '4000787030016', {'by-vdev': 'a1'}, {'temp': 31}))
+        self.assertEqual(sda.partitions, [sda1])
+        self.assertIs(sda1.device, sda)
+        self.assertEqual(dict(sda1.lsblk.items()), {'NAME': 'sda1', 'TYPE': 'part', 'FSTYPE': 'zfs_member'})
+        self.assertEqual((sda1.zpath, sda1.zfs, sda1.iostat), ('tank.raidz2-0', {'zstate': 'ONLINE', 'zcksum': '2'},
+                                                               {'r/s': 1.5}))
+        self.assertEqual(sda1.holder_names, [])
+        self.assertIs(host.identities['sda1'], sda1)
+        self.assertEqual(host.skipped, [('smart', 'timed out')])
+        self.assertEqual((host.zpool_status_result, host.zpool_states, host.zpool_io),
+                         (True, {'tank': 'ONLINE'}, {'tank': {'nread': 1024}}))
+        self.assertEqual(snapshot.read(self.path)['hostname'], 'box')
+
+    def test_atomic(self):
+        snapshot.store(self.path, sample_host())
+        broken = sample_host()
+        broken.devices['sda'].smart = {'temp': object()}  # not JSON
+        with self.assertRaises(TypeError):
+            snapshot.store(self.path, broken)
+        # the old snapshot is intact, and no temporary file is left behind
+        self.assertEqual(snapshot.load(self.path).devices['sda'].smart, {'temp': 31})
+        self.assertEqual([name for name in os.listdir(self.root) if name.startswith('.lsblkpro-snapshot-')], [])
+
+    def test_not_a_snapshot(self):
+        self.put('snapshot', 'hello')
+        with self.assertRaises(snapshot.SnapshotError):
+            snapshot.load(self.path)
+        with self.assertRaises(snapshot.SnapshotError):
+            snapshot.load(os.path.join(self.root, 'nonexistent'))
+
+class RefusalTest(FakeHost):
+    def test_symlink(self):
+        snapshot.store(self.path, sample_host())
+        link = os.path.join(self.root, 'link')
+        os.symlink(self.path, link)
+        with self.assertRaises(snapshot.SnapshotError):
+            snapshot.load(link)
+        self.assertIsNone(snapshot.load_fresh(link, None))
+
+    def test_owner(self):
+        snapshot.store(self.path, sample_host())
+        real_fstat = os.fstat
+
+        def fstat(fd):
+            return mock.Mock(wraps=real_fstat(fd), st_uid=os.getuid() + 4242)
+
+        with mock.patch.object(os, 'fstat', fstat):
+            with self.assertRaises(snapshot.SnapshotError) as caught:
+                snapshot.load(self.path)
+        self.assertIn('refusing', str(caught.exception))
+
+class FreshnessTest(FakeHost):
+    def store(self):
+        fingerprint = snapshot.fingerprint(self.args)
+        snapshot.store(self.path, sample_host(), fingerprint)
+        return fingerprint
+
+    def test_hit(self):
+        self.store()
+        self.assertIsNotNone(snapshot.load_fresh(self.path, snapshot.fingerprint(self.args)))
+
+    def test_ttl(self):
+        fingerprint = self.store()
+        past = time.time() - 120
+        os.utime(self.path, (past, past))
+        self.assertIsNone(snapshot.load_fresh(self.path, fingerprint, ttl=60))
+        self.assertIsNotNone(snapshot.load_fresh(self.path, fingerprint, ttl=600))
+
+    def test_udev_busy(self):
+        fingerprint = self.store()
+        os.mkdir(os.path.join(self.root, 'run', 'udev', 'queue'))
+        self.assertIsNone(snapshot.load_fresh(self.path, fingerprint))
+
+    def assertInvalidatedBy(self, change):
+        self.store()
+        change()
+        self.assertIsNone(snapshot.load_fresh(self.path, snapshot.fingerprint(self.args)))
+
+    def test_uevent(self):
+        self.assertInvalidatedBy(lambda: self.put(os.path.join('sys', 'kernel', 'uevent_seqnum'), '101\n'))
+
+    def test_new_device(self):
+        self.assertInvalidatedBy(lambda: self.put(os.path.join('sys', 'block', 'sdb', 'size'), '8\n'))
+
+    def test_mount(self):
+        self.assertInvalidatedBy(lambda: self.put(os.path.join('proc', 'self', 'mountinfo'),
+                                                  '22 1 8:1 / / rw - ext4 /dev/sda1 rw\n'
+                                                  '23 22 8:2 / /srv rw - ext4 /dev/sda2 rw\n'))
+
+    def test_pool_import(self):
+        self.assertInvalidatedBy(lambda: os.makedirs(os.path.join(self.root, 'proc', 'spl', 'kstat', 'zfs', 'tank')))
+
+    def test_options(self):
+        self.store()
+        self.args.all_devices = True
+        self.assertIsNone(snapshot.load_fresh(self.path, snapshot.fingerprint(self.args)))
+        self.args.all_devices = False
+        self.assertIsNotNone(snapshot.load_fresh(self.path, snapshot.fingerprint(self.args)))
@@ -0,0 +1,54 @@
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+from builtins import *
+
+import random
+import unittest
+
+from lsblkpro import sorting
+
+class Row(dict):
+    def sort_value(self, key):
+        return self.get(key)
+
+class KeyTest(unittest.TestCase):
+    def test_natural(self):
+        self.assertEqual(sorted(['a10', 'a2', 'b1', 'a1'], key=sorting.natural_key), ['a1', 'a2', 'a10', 'b1'])
+        self.assertEqual(sorted(['ST4000', 'ST10000', 'HGST'], key=sorting.natural_key), ['HGST', 'ST4000', 'ST10000'])
+
+    def test_device(self):
+        names = ['sdaa', 'sdb', 'sda', 'sdz', 'sda10', 'sda2', 'sdab', 'sda1']
+        self.assertEqual(sorted(names, key=sorting.device_key),
+                         ['sda', 'sda1', 'sda2', 'sda10', 'sdb', 'sdz', 'sdaa', 'sdab'])
+        self.assertEqual(sorted(['nvme10n1', 'nvme2n1', 'nvme2n10', 'nvme2n2'], key=sorting.device_key),
+                         ['nvme2n1', 'nvme2n2', 'nvme2n10', 'nvme10n1'])
+
+class SortRowsTest(unittest.TestCase):
+    def names(self, rows):
+        return [row.get('NAME') for row in rows]
+
+    def test_by_name(self):
+        rows = [Row(NAME=name) for name in ('sdaa', 'sdb', 'sda', 'sdz')]
+        self.assertEqual(self.names(sorting.sort_rows(rows, ['NAME'])), ['sda', 'sdb', 'sdz', 'sdaa'])
+        self.assertEqual(self.names(sorting.sort_rows(rows, ['NAME'], reverse=True)), ['sdaa', 'sdz', 'sdb', 'sda'])
+
+    def test_missing_last(self):
+        rows = [Row(NAME='a', temp='40'), Row(NAME='b'), Row(NAME='c', temp='31'), Row(NAME='d', temp=''),
+                Row(NAME='e', temp='n/a'), Row(NAME='f', temp='35.5')]
+        self.assertEqual(self.names(sorting.sort_rows(rows, ['temp'])), ['c', 'f', 'a', 'b', 'd', 'e'])
+        self.assertEqual(self.names(sorting.sort_rows(rows, ['temp'], reverse=True))[:3], ['a', 'f', 'c'])
+        self.assertEqual(set(self.names(sorting.sort_rows(rows, ['temp'], reverse=True))[3:]), {'b', 'd', 'e'})
+
+    def test_several_keys(self):
+        rows = [Row(NAME='sdb', MODEL='X'), Row(NAME='sda', MODEL='Y'), Row(NAME='sdc', MODEL='X')]
+        self.assertEqual(self.names(sorting.sort_rows(rows, ['MODEL', 'NAME'])), ['sdb', 'sdc', 'sda'])
+
+    def test_top(self):
+        rng = random.Random(1)
+        rows = [Row(NAME='sd{}'.format(ii), temp=str(rng.randint(20, 30)) if ii % 7 else '') for ii in range(200)]
+        for reverse in (False, True):
+            for top in (1, 5, 50, 500):
+                full = sorting.sort_rows(rows, ['temp', 'NAME'], reverse=reverse)
+                self.assertEqual(sorting.sort_rows(rows, ['temp', 'NAME'], reverse=reverse, top=top), full[:top])
+        # ties kept in their original order, as a full sort would
+        full = sorting.sort_rows(rows, ['temp'])
+        self.assertEqual(sorting.sort_rows(rows, ['temp'], top=30), full[:30])
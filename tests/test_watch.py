@@ -0,0 +1,41 @@
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+from builtins import *
+
+import io
+import unittest
+from unittest import mock
+
+from lsblkpro import watch
+
+class ClipTest(unittest.TestCase):
+    def test_plain(self):
+        self.assertEqual(watch.clip('sda  4.0T', 20), 'sda  4.0T')
+        self.assertEqual(watch.clip('sda  4.0T', 4), 'sda ')
+
+    def test_escapes(self):
+        # the escapes take no room, and are kept whole even past the cut
+        self.assertEqual(watch.clip('\033[1mNAME size\033[0m', 4), '\033[1mNAME\033[0m')
+        self.assertEqual(watch.clip('\033[1;30msda1 512M', 6), '\033[1;30msda1 5')
+        self.assertEqual(watch.clip('ab\033[0mcdef', 3), 'ab\033[0mc')
+
+class ScreenTest(unittest.TestCase):
+    def draw(self, lines, size):
+        with mock.patch.object(watch, 'terminal_size', return_value=size):
+            self.screen.draw(lines)
+        out = self.out.getvalue()
+        self.out.seek(0)
+        self.out.truncate()
+        return out
+
+    def setUp(self):
+        self.out = io.StringIO()
+        self.screen = watch.Screen(self.out)
+
+    def test_clipped(self):
+        out = self.draw(['\033[1m' + 'x' * 30, 'y' * 30, 'z'], (2, 11))
+        self.assertIn('\033[1;1H\033[1m' + 'x' * 10 + '\033[0m', out)
+        self.assertIn('\033[2;1H' + 'y' * 10 + '\033[0m', out)
+        self.assertNotIn('z', out)
+        # what's past the edge changing doesn't repaint the line
+        self.assertEqual(self.draw(['\033[1m' + 'x' * 31, 'y' * 10 + 'w'], (2, 11)), '')
+        self.assertIn('w', self.draw(['\033[1m' + 'x' * 31, 'y' * 10 + 'w'], (2, 20)))
@@ -0,0 +1,142 @@
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+from builtins import *
+
+import io
+import os
+import time
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from lsblkpro import data, zpool
+
+SAMPLE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'zpool-status-replacing')
+
+SECTIONS = """\
+  pool: tank
+ state: DEGRADED
+config:
+
+\tNAME        STATE     READ WRITE CKSUM
+\ttank        DEGRADED     0     0     0
+\t  mirror-0  DEGRADED     0     0     0
+\t    sda     ONLINE       0     0     0
+\t    sdb     FAULTED      3  1.2K     0  too many errors
+\t  mirror-1  ONLINE       0     0     0
+\t    sdc     ONLINE       0     0     0
+\t    sdd     ONLINE       0     0     0
+\tlogs
+\t  nvme0n1   ONLINE       0     0     0
+\tspares
+\t  sde       AVAIL
+\t  sdc       INUSE     currently in use
+
+errors: No known data errors
+"""
+
+def sample():
+    with io.open(SAMPLE, encoding='utf-8') as f:
+        return list(zpool.parse(f.read().splitlines()))
+
+class ParseTest(unittest.TestCase):
+    def test_pools(self):
+        koji, lrrr = sample()
+        self.assertEqual((koji.name, koji.state, koji.progress), ('koji', 'ONLINE', None))
+        self.assertEqual((lrrr.name, lrrr.state, lrrr.progress), ('lrrr', 'ONLINE', '1.70%'))
+        # continuation lines are folded into their field
+        self.assertEqual(lrrr.fields['action'], 'Wait for the resilver to complete.')
+        self.assertTrue(lrrr.fields['scan'].endswith('28.0G resilvered, 1.70% done'))
+
+    def test_tree(self):
+        koji, lrrr = sample()
+        self.assertEqual(koji.root.name, 'koji')
+        self.assertEqual([vdev.name for vdev in koji.root.children], ['raidz3-0'])
+        self.assertEqual(len(koji.root.children[0].children), 9)
+        replacing = lrrr.root.children[0].children[2]
+        self.assertEqual((replacing.name, replacing.state), ('replacing-2', 'UNAVAIL'))
+        old, new = replacing.children
+        self.assertEqual((old.name, old.note), ('456459487266711499', 'was /dev/disk/by-vdev/c4-part1'))
+        self.assertEqual((new.name, new.state, new.note), ('sdi', 'ONLINE', '(resilvering)'))
+
+    def test_members(self):
+        members = zpool.members(sample())
+        self.assertEqual(len(members), 15)
+        # the only top-level vdev loses its '-0'
+        self.assertEqual(members['a1'], ('koji.raidz3', {'zstate': 'ONLINE', 'zread': '0', 'zwrite': '0', 'zcksum': '0'}))
+        self.assertEqual(members['sdi'][1]['znote'], 'replacing, resilvering 1.70%')
+        self.assertEqual(members['456459487266711499'][1]['znote'], 'replacing, was /dev/disk/by-vdev/c4-part1')
+
+    def test_sections(self):
+        members = zpool.members(zpool.parse(SECTIONS.splitlines()))
+        self.assertEqual(members['sdb'], ('tank.mirror-0', {
+            'zstate': 'FAULTED', 'zread': '3', 'zwrite': '1.2K', 'zcksum': '0', 'znote': 'too many errors'}))
+        self.assertEqual(members['nvme0n1'][0], 'tank.logs')
+        self.assertEqual(members['sde'], ('tank.spares', {'zstate': 'AVAIL'}))
+        # a spare in use keeps the place it's in use
+        self.assertEqual(members['sdc'][0], 'tank.mirror-1')
+
+class KstatTest(unittest.TestCase):
+    """/proc/spl/kstat/zfs in a temporary directory, as data.PROC"""
+    def setUp(self):
+        self.proc = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.proc)
+        self.addCleanup(setattr, data, 'PROC', data.PROC)
+        data.PROC = self.proc
+        self.root = os.path.join(self.proc, 'spl', 'kstat', 'zfs')
+
+    def put(self, path, text):
+        path = os.path.join(self.root, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with io.open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+
+    def test_no_module(self):
+        self.assertIsNone(zpool.imported())
+        self.assertIsNone(zpool.kstat())
+        self.assertFalse(zpool.runs_status('auto'))
+        self.assertTrue(zpool.runs_status('always'))
+        self.assertEqual(zpool.collect('auto'), (None, None))
+
+    def test_no_pools(self):
+        self.put('arcstats', '')
+        self.assertEqual(zpool.imported(), [])
+        self.assertEqual(zpool.collect('auto'), ({}, None))
+
+    def test_pools(self):
+        self.put('arcstats', '')
+        self.put(os.path.join('tank', 'state'), 'ONLINE\n')
+        self.put(os.path.join('tank', 'io'), '12 3 0x00 1 80 1234 5678\n'
+                 'nread    nwritten reads    writes   wtime\n'
+                 '1024     2048     3        4        5\n')
+        # zfs before 0.8: no state; after 2.1: no io
+        self.put(os.path.join('old', 'io'), '')
+        self.put(os.path.join('new', 'state'), 'DEGRADED\n')
+        self.assertEqual(sorted(zpool.imported()), ['new', 'old', 'tank'])
+        self.assertEqual(zpool.kstat(), {
+            'tank': ('ONLINE', {'nread': 1024, 'nwritten': 2048, 'reads': 3, 'writes': 4}),
+            'old': ('', {}),
+            'new': ('DEGRADED', {}),
+        })
+        self.assertTrue(zpool.runs_status('auto'))
+        self.assertEqual(zpool.collect('never')[1], None)
+
+class FetchTest(unittest.TestCase):
+    def test_deadline(self):
+        timeouts = []
+
+        def status(pool, timeout=None):
+            timeouts.append(timeout)
+            time.sleep(0.2)
+            return []
+
+        # one at a time: the second pool's time starts running out while it waits
+        with mock.patch.object(zpool, 'status', status), mock.patch.object(zpool, 'WORKERS', 1):
+            self.assertEqual(zpool.fetch(10, names=['tank', 'koji']), [])
+        first, second = timeouts
+        self.assertLessEqual(first, 10)
+        self.assertLess(second, first - 0.15)
+        with mock.patch.object(zpool, 'status', status):
+            zpool.fetch(None, names=['tank', 'koji'])
+        self.assertEqual(timeouts[2:], [None, None])